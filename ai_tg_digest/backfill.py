@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from telethon import TelegramClient
+
+from ai_tg_digest import db, dedup, stats
+from ai_tg_digest.config import AppSettings
+from ai_tg_digest.ingest import fetch_source_with_backoff, sync_sources
+from ai_tg_digest.pipeline import (
+    ProgressWriter,
+    candidate_similarity,
+    extracted_urls,
+    load_checkpoints,
+    process_new_messages,
+    process_new_messages_async,
+    refresh_digest_candidates,
+    regenerate_summaries,
+)
+from ai_tg_digest.utils import normalize_text, normalize_urls
+
+logger = logging.getLogger(__name__)
+
+LINK_CHUNK_SIZE = 512
+
+
+async def ingest_history(conn, settings: AppSettings, since: datetime, client: TelegramClient | None = None) -> int:
+    # Walks every enabled source back to `since` regardless of its cursor; rows we already
+    # have are skipped by the unique (source_id, tg_message_id) key.
+    if client is None:
+        async with TelegramClient(settings.tg_session, settings.tg_api_id, settings.tg_api_hash) as client:
+            return await ingest_history(conn, settings, since, client)
+
+    sync_sources(conn, settings)
+    rows = conn.execute("SELECT id, id_or_username, last_tg_message_id FROM sources WHERE enabled=1").fetchall()
+    with db.BulkWriter(conn, settings.db_write_batch_size) as writer:
+        for row in rows:
+            try:
+                payloads, max_id = await fetch_source_with_backoff(client, {**dict(row), "last_tg_message_id": None}, since, None, settings)
+            except Exception:  # noqa: BLE001
+                logger.exception("History fetch failed for %s", row["id_or_username"])
+                continue
+            writer.add_raw_messages(payloads)
+            if max_id and max_id > (row["last_tg_message_id"] or 0):
+                writer.set_source_cursor(row["id"], max_id)
+    return writer.inserted
+
+
+def score_row(task: tuple[str, list[str], list[dict]], settings: AppSettings) -> tuple[list[str], dict[int, float]]:
+    text, raw_urls, candidates = task
+    urls = [u for u in normalize_urls(raw_urls) if u]
+    norm = normalize_text(text)
+    norm_hash = dedup.simhash(norm) if settings.sim_simhash_max_distance else 0
+    return urls, {c["id"]: candidate_similarity(norm, norm_hash, c, settings) for c in candidates}
+
+
+def fetch_staged(conn, since: datetime) -> list:
+    return conn.execute(
+        """
+        SELECT rm.*, s.weight FROM raw_messages rm
+        JOIN sources s ON s.id=rm.source_id
+        WHERE rm.canonical_news_id IS NULL AND rm.posted_at >= ?
+          AND rm.extracted_json IS NOT NULL
+        ORDER BY rm.posted_at DESC, rm.id
+        """,
+        (since.isoformat(),),
+    ).fetchall()
+
+
+def link_staged(conn, settings: AppSettings, since: datetime, workers: int | None = None) -> int:
+    # Same decisions as linking one row at a time: URL normalization and similarity scores
+    # against the canonicals that exist when a chunk starts are computed in the pool, then rows
+    # are linked serially in backlog order. A score is only reused if its canonical has not been
+    # touched earlier in the chunk; anything else (new or updated canonicals) is scored inline.
+    workers = workers or os.cpu_count() or 1
+    window = (datetime.utcnow() - timedelta(days=settings.dedup_window_days)).isoformat()
+    rows = fetch_staged(conn, since)
+    progress = ProgressWriter(conn, settings)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for start in range(0, len(rows), LINK_CHUNK_SIZE):
+            chunk = rows[start : start + LINK_CHUNK_SIZE]
+            staged = [load_checkpoints(row) for row in chunk]
+            tasks = []
+            with stats.timer("backfill.candidates"):
+                for row, done in zip(chunk, staged):
+                    text = row["text"] or ""
+                    candidates = [dict(c) for c in dedup.lsh_candidates(conn, text, window)]
+                    tasks.append((text, extracted_urls(done["extracted"]), candidates))
+            with stats.timer("backfill.score"):
+                score = partial(score_row, settings=settings)
+                if pool:
+                    scored = list(pool.map(score, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+                else:
+                    scored = [score(task) for task in tasks]
+            touched: set[int] = set()
+            for row, done, (urls, scores) in zip(chunk, staged, scored):
+                fresh = {k: v for k, v in scores.items() if k not in touched}
+                progress.link((row, done["extracted"]), urls=urls, scores=fresh)
+                linked = conn.execute("SELECT canonical_news_id FROM raw_messages WHERE id=?", (row["id"],)).fetchone()[0]
+                if linked:
+                    touched.add(linked)
+    finally:
+        if pool:
+            pool.shutdown()
+        progress.commit()
+    return progress.completed
+
+
+async def backfill(
+    conn, settings: AppSettings, since: datetime, workers: int | None = None, fetch: bool = True, client: TelegramClient | None = None
+) -> dict[str, int]:
+    ingested = await ingest_history(conn, settings, since, client) if fetch else 0
+    if settings.llm_concurrency > 1:
+        staged = await process_new_messages_async(conn, settings, since=since, link=False)
+    else:
+        staged = process_new_messages(conn, settings, since=since, link=False)
+    linked = link_staged(conn, settings, since, workers)
+    summarized = regenerate_summaries(conn, settings)
+    refresh_digest_candidates(conn, settings)
+    return {"ingested": ingested, "staged": staged, "linked": linked, "summarized": summarized}
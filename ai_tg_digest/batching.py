@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Callable, Iterable
+
+from ai_tg_digest.llm import CHARS_PER_TOKEN, render
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_batches(items: Iterable[dict], token_budget: int, max_items: int) -> list[list[dict]]:
+    batches: list[list[dict]] = []
+    current: list[dict] = []
+    used = 0
+    for item in items:
+        cost = sum(estimate_tokens(str(v)) for v in item.values())
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch_items(result: Any, expected_ids: Iterable[str]) -> dict[str, dict]:
+    expected = {str(i) for i in expected_ids}
+    if isinstance(result, dict):
+        items = result.get("items", result.get("results"))
+        if items is None:
+            # Some models answer with a mapping keyed by id instead of an array.
+            items = [dict(v, id=k) for k, v in result.items() if isinstance(v, dict)]
+    else:
+        items = result
+    parsed: dict[str, dict] = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        item_id = str(item.get("id", "")).strip()
+        if item_id in expected and item_id not in parsed:
+            parsed[item_id] = {k: v for k, v in item.items() if k != "id"}
+    return parsed
+
+
+def run_batched(
+    llm,
+    system_prompt: str,
+    template: str,
+    placeholder: str,
+    items: list[dict],
+    single_call: Callable[[str], dict],
+    token_budget: int,
+    max_items: int,
+) -> dict[str, dict]:
+    results: dict[str, dict] = {}
+    for batch in pack_batches(items, token_budget, max_items):
+        ids = [item["id"] for item in batch]
+        try:
+            result = llm.complete_json(system_prompt, render(template, **{placeholder: batch}), template=template)
+        except RuntimeError:
+            result = None
+        results.update(parse_batch_items(result, ids))
+        for item_id in ids:
+            if item_id not in results:
+                results[item_id] = single_call(item_id)
+    return results
+
+
+async def run_batched_async(
+    llm,
+    system_prompt: str,
+    template: str,
+    placeholder: str,
+    items: list[dict],
+    single_call: Callable[[str], Any],
+    token_budget: int,
+    max_items: int,
+) -> dict[str, dict]:
+    async def one(batch: list[dict]) -> dict[str, dict]:
+        ids = [item["id"] for item in batch]
+        try:
+            result = await llm.complete_json(system_prompt, render(template, **{placeholder: batch}), template=template)
+        except RuntimeError:
+            result = None
+        parsed = parse_batch_items(result, ids)
+        missing = [i for i in ids if i not in parsed]
+        for item_id, value in zip(missing, await asyncio.gather(*(single_call(i) for i in missing))):
+            parsed[item_id] = value
+        return parsed
+
+    results: dict[str, dict] = {}
+    for parsed in await asyncio.gather(*(one(b) for b in pack_batches(items, token_budget, max_items))):
+        results.update(parsed)
+    return results
@@ -1,15 +1,14 @@
 from __future__ import annotations
 
-import asyncio
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
 
 import typer
 
-from ai_tg_digest import db
-from ai_tg_digest.config import load_settings
-from ai_tg_digest.ingest import ingest_new_messages, sync_sources
-from ai_tg_digest.moderation import queue_digest
-from ai_tg_digest.pipeline import build_digest_text, process_new_messages
-from ai_tg_digest.scheduler import run_scheduler
+from ai_tg_digest import db, stats
+
+# Commands import what they need themselves: telethon, httpx and numpy together
+# take most of a second to import, and `sources list` or a cron-run `build-digest` needs none.
 
 app = typer.Typer()
 sources_app = typer.Typer()
@@ -18,86 +17,257 @@ app.add_typer(sources_app, name="sources")
 app.add_typer(db_app, name="db")
 
 
+@contextmanager
+def open_db(config: str):
+    from ai_tg_digest.config import load_settings
+
+    settings = load_settings(config)
+    with closing(db.connect(settings.db_path)) as conn:
+        db.migrate(conn)
+        yield settings, conn
+
+
 @app.command("ingest")
 def ingest_cmd(config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    count = asyncio.run(ingest_new_messages(conn, settings))
-    typer.echo(f"Ingested {count} raw messages")
+    import asyncio
+
+    from ai_tg_digest.ingest import ingest_new_messages
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "ingest"):
+            count = asyncio.run(ingest_new_messages(conn, settings))
+        typer.echo(f"Ingested {count} raw messages")
+
+
+@app.command("refresh-metrics")
+def refresh_metrics_cmd(config: str = "config.yaml"):
+    import asyncio
+
+    from ai_tg_digest.refresh import refresh_engagement
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "refresh"):
+            result = asyncio.run(refresh_engagement(conn, settings))
+        typer.echo(f"Refreshed {result['changed']}/{result['polled']} messages in {result['requests']} requests, rescored {result['rescored']} canonicals")
 
 
 @app.command("process")
-def process_cmd(config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    count = process_new_messages(conn, settings)
-    typer.echo(f"Processed {count} messages")
+def process_cmd(
+    config: str = "config.yaml",
+    concurrency: int = typer.Option(0, help="parallel LLM requests, 0 = LLM_CONCURRENCY"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="bypass the LLM response cache for this run"),
+    retry_quarantined: bool = typer.Option(False, "--retry-quarantined", help="give quarantined messages a fresh set of attempts"),
+    retry_skipped: bool = typer.Option(
+        False, "--retry-skipped", help="run prefilter-skipped messages from the last DEDUP_WINDOW_DAYS through the prefilter again"
+    ),
+    max_items: int | None = typer.Option(None, help="stop after this many messages, 0 = no limit (default PROCESS_MAX_ITEMS)"),
+    time_budget: float | None = typer.Option(None, help="stop starting new messages after N seconds, 0 = no limit (default PROCESS_TIME_BUDGET_SECONDS)"),
+):
+    import asyncio
+
+    from ai_tg_digest.llm_cache import open_llm_cache
+    from ai_tg_digest.pipeline import process_new_messages, process_new_messages_async, requeue_quarantined, requeue_skipped
+
+    with open_db(config) as (settings, conn):
+        if no_cache:
+            settings = settings.model_copy(update={"llm_cache_enabled": False})
+        if retry_quarantined:
+            typer.echo(f"Requeued {requeue_quarantined(conn)} quarantined messages")
+        if retry_skipped:
+            since = datetime.utcnow() - timedelta(days=settings.dedup_window_days)
+            typer.echo(f"Requeued {requeue_skipped(conn, since)} skipped messages")
+        cache = open_llm_cache(settings)
+        concurrency = concurrency or settings.llm_concurrency
+        try:
+            with stats.run(conn, "process"):
+                if concurrency > 1:
+                    count = asyncio.run(
+                        process_new_messages_async(conn, settings, concurrency, cache=cache, max_items=max_items, time_budget=time_budget)
+                    )
+                else:
+                    count = process_new_messages(conn, settings, cache=cache, max_items=max_items, time_budget=time_budget)
+        finally:
+            if cache:
+                cache_stats = cache.stats()
+                typer.echo(f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+                cache.close()
+        typer.echo(f"Processed {count} messages")
+
+
+@app.command("backfill")
+def backfill_cmd(
+    since: datetime = typer.Option(..., formats=["%Y-%m-%d"], help="fetch and process history back to this date"),
+    workers: int = typer.Option(0, help="processes for URL normalization and similarity scoring, 0 = CPU count"),
+    fetch: bool = typer.Option(True, help="fetch history from Telegram before processing"),
+    config: str = "config.yaml",
+):
+    import asyncio
+
+    from ai_tg_digest.backfill import backfill
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "backfill"):
+            result = asyncio.run(backfill(conn, settings, since, workers or None, fetch))
+        typer.echo(
+            f"Backfill: ingested {result['ingested']}, staged {result['staged']}, linked {result['linked']} messages, "
+            f"summarized {result['summarized']} canonicals"
+        )
 
 
 @app.command("build-digest")
-def build_digest(period: str = typer.Option(..., help="morning|evening"), dry_run: bool = True, config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    text = build_digest_text(conn, period, settings)
-    typer.echo(text)
-    if not dry_run:
-        typer.echo("Use queue-digest for moderation flow")
+def build_digest(
+    period: str = typer.Option(..., help="morning|evening"),
+    dry_run: bool = True,
+    variant: str = typer.Option("publish", help="publish|preview"),
+    config: str = "config.yaml",
+):
+    from ai_tg_digest.pipeline import build_digest_text, refresh_digest_candidates
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "build-digest"):
+            refresh_digest_candidates(conn, settings)
+            with closing(db.connect_readonly(settings.db_path)) as ro_conn:
+                text = build_digest_text(ro_conn, period, settings, variant)
+        typer.echo(text)
+        if not dry_run:
+            typer.echo("Use queue-digest for moderation flow")
 
 
 @app.command("queue-digest")
 def queue_digest_cmd(period: str = typer.Option(..., help="morning|evening"), config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    text = build_digest_text(conn, period, settings)
-    digest_id = asyncio.run(queue_digest(conn, settings, period, text))
-    typer.echo(f"Queued digest #{digest_id}")
+    import asyncio
+
+    from ai_tg_digest.moderation import queue_digest
+    from ai_tg_digest.pipeline import build_digest_texts, refresh_digest_candidates
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "queue-digest"):
+            refresh_digest_candidates(conn, settings)
+            with closing(db.connect_readonly(settings.db_path)) as ro_conn:
+                preview, publish = build_digest_texts(ro_conn, period, settings)
+            digest_id = asyncio.run(queue_digest(conn, settings, period, preview, publish))
+        typer.echo(f"Queued digest #{digest_id}")
+
 
+@app.command("stats")
+def stats_cmd(
+    runs: int = typer.Option(20, help="aggregate over the last N runs (--prometheus always exports all-time totals)"),
+    command: str = typer.Option("", help="only runs of this command (cycle, process, ingest, ...)"),
+    prometheus: bool = typer.Option(False, "--prometheus", help="print Prometheus text exposition format"),
+    config: str = "config.yaml",
+):
+    with open_db(config) as (settings, conn):
+        counters, histograms = stats.load_totals(conn, command or None) if prometheus else stats.load_recent(conn, runs, command or None)
+        typer.echo(stats.render_prometheus(counters, histograms) if prometheus else stats.render_table(counters, histograms), nl=not prometheus)
 
-@app.command("run-scheduler")
+
+@app.command("serve")
+def serve_cmd(config: str = "config.yaml"):
+    from ai_tg_digest.scheduler import run_scheduler
+
+    run_scheduler(config)
+
+
+@app.command("run-scheduler", hidden=True)
 def run_scheduler_cmd(config: str = "config.yaml"):
+    from ai_tg_digest.scheduler import run_scheduler
+
     run_scheduler(config)
 
 
 @sources_app.command("list")
 def list_sources(config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    for row in conn.execute("SELECT * FROM sources ORDER BY id"):
-        typer.echo(f"{row['id']}: {row['id_or_username']} ({row['type']}) w={row['weight']} enabled={row['enabled']}")
+    with open_db(config) as (settings, conn):
+        for row in conn.execute("SELECT * FROM sources ORDER BY id"):
+            typer.echo(f"{row['id']}: {row['id_or_username']} ({row['type']}) w={row['weight']} enabled={row['enabled']}")
 
 
 @sources_app.command("add")
 def add_source(id_or_username: str, type: str = "channel", weight: float = 1.0, enabled: bool = True, config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    db.upsert_sources(conn, [{"id_or_username": id_or_username, "type": type, "weight": weight, "enabled": enabled}])
-    typer.echo("Added")
+    with open_db(config) as (settings, conn):
+        db.upsert_sources(conn, [{"id_or_username": id_or_username, "type": type, "weight": weight, "enabled": enabled}])
+        typer.echo("Added")
 
 
 @sources_app.command("remove")
 def remove_source(id_or_username: str, config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    conn.execute("DELETE FROM sources WHERE id_or_username=?", (id_or_username,))
-    conn.commit()
-    typer.echo("Removed")
+    with open_db(config) as (settings, conn):
+        conn.execute("DELETE FROM sources WHERE id_or_username=?", (id_or_username,))
+        conn.commit()
+        typer.echo("Removed")
 
 
 @db_app.command("init")
 @db_app.command("migrate")
 def migrate_cmd(config: str = "config.yaml"):
-    settings = load_settings(config)
-    conn = db.connect(settings.db_path)
-    db.migrate(conn)
-    sync_sources(conn, settings)
-    typer.echo("DB ready")
+    from ai_tg_digest.ingest import sync_sources
+
+    with open_db(config) as (settings, conn):
+        sync_sources(conn, settings)
+        typer.echo("DB ready")
+
+
+@db_app.command("backfill-fingerprints")
+def backfill_fingerprints_cmd(config: str = "config.yaml"):
+    from ai_tg_digest import dedup
+
+    with open_db(config) as (settings, conn):
+        count = dedup.backfill_fingerprints(conn)
+        conn.commit()
+        typer.echo(f"Fingerprinted {count} canonicals")
+
+
+@db_app.command("renormalize-urls")
+def renormalize_urls_cmd(config: str = "config.yaml"):
+    from ai_tg_digest import dedup
+
+    with open_db(config) as (settings, conn):
+        count = dedup.renormalize_links(conn)
+        conn.commit()
+        typer.echo(f"Re-keyed {count} canonical links")
+
+
+@db_app.command("convert-json")
+def convert_json_cmd(
+    config: str = "config.yaml",
+    batch_size: int = typer.Option(db.CONVERT_BATCH_SIZE, help="rows per transaction"),
+):
+    with open_db(config) as (settings, conn):
+        count = db.convert_json_columns(conn, batch_size)
+        typer.echo(f"Converted {count} rows (labels, message URLs, re-keyed links)")
+
+
+@db_app.command("compact")
+def compact_cmd(
+    config: str = "config.yaml",
+    archive: bool = typer.Option(True, help="move rows past RETENTION_DAYS into the monthly archives first"),
+):
+    from ai_tg_digest import retention
+
+    with open_db(config) as (settings, conn):
+        with stats.run(conn, "compact"):
+            if archive:
+                result = retention.run_retention(conn, settings)
+                typer.echo(
+                    f"Archived {result['raw_messages']} raw messages and {result['canonical_news']} canonicals, "
+                    f"pruned {result['orphans']} orphaned rows"
+                )
+            before, after = retention.compact(conn)
+        typer.echo(f"Compacted {before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB")
+
+
+@db_app.command("explain")
+def explain_cmd(config: str = "config.yaml"):
+    with open_db(config) as (settings, conn):
+        scans = 0
+        for name, plan, has_scan in db.explain_hot_queries(conn):
+            scans += has_scan
+            typer.echo(f"{'SCAN!' if has_scan else 'ok   '} {name}")
+            for line in plan:
+                typer.echo(f"      {line}")
+        if scans:
+            typer.echo(f"{scans} hot queries fall back to full table scans")
+            raise typer.Exit(1)
 
 
 if __name__ == "__main__":
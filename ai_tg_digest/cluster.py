@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from functools import lru_cache
+
+import numpy as np
+
+from ai_tg_digest.utils import URL_RE, normalize_text
+
+NGRAM = 4
+HASH_BITS = 14
+PROJECTION_DIMS = 128
+# Candidates come from the projected vectors, whose cosine is off by a few hundredths at the
+# similarities that matter; anything within this margin of the threshold gets the exact check.
+CANDIDATE_MARGIN = 0.1
+BLOCK_ROWS = 1024
+PROJECTION_CHUNK = 256
+_MULT = np.uint64(0x9E3779B1)
+
+
+def _ngram_buckets(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    # Rolling hash over every character n-gram of every text at once: texts are concatenated
+    # into one code point array and n-grams that straddle two texts are dropped.
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    ends = np.cumsum(lengths)
+    doc_of = np.repeat(np.arange(len(texts)), lengths)
+    positions = np.arange(max(0, codes.size - NGRAM + 1))
+    valid = positions + NGRAM <= ends[doc_of[positions]] if positions.size else positions.astype(bool)
+    h = np.zeros(positions.size, dtype=np.uint64)
+    for k in range(NGRAM):
+        h = (h ^ codes[positions + k]) * _MULT
+    buckets = (h >> np.uint64(64 - HASH_BITS)).astype(np.int64)
+    return doc_of[positions][valid], buckets[valid]
+
+
+def tfidf(texts: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Sparse L2-normalized rows: bucket ids and weights sorted by doc then bucket, plus the
+    # start offset of every doc's slice.
+    docs, buckets = _ngram_buckets(texts)
+    keys, tf = np.unique(docs * (1 << HASH_BITS) + buckets, return_counts=True)
+    docs, buckets = keys >> HASH_BITS, keys & ((1 << HASH_BITS) - 1)
+    df = np.bincount(buckets, minlength=1 << HASH_BITS)
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    weights = (1 + np.log(tf)) * idf[buckets]
+    norms = np.sqrt(np.bincount(docs, weights=weights**2, minlength=len(texts)))
+    weights = weights / np.where(norms[docs] > 0, norms[docs], 1)
+    starts = np.searchsorted(docs, np.arange(len(texts) + 1))
+    return buckets, weights.astype(np.float32), starts
+
+
+@lru_cache(maxsize=1)
+def _basis() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((1 << HASH_BITS, PROJECTION_DIMS), dtype=np.float32) / np.float32(np.sqrt(PROJECTION_DIMS))
+
+
+def project(buckets: np.ndarray, weights: np.ndarray, starts: np.ndarray, count: int) -> np.ndarray:
+    # Gaussian random projection of the sparse rows; dot products are preserved in expectation.
+    basis = _basis()
+    out = np.empty((count, PROJECTION_DIMS), dtype=np.float32)
+    # Scatter a chunk of sparse rows into a dense block and let BLAS do the projection; the
+    # block is cleared again through the same indices instead of being reallocated.
+    block = np.zeros((PROJECTION_CHUNK, 1 << HASH_BITS), dtype=np.float32)
+    for first in range(0, count, PROJECTION_CHUNK):
+        last = min(count, first + PROJECTION_CHUNK)
+        lo, hi = starts[first], starts[last]
+        rows = np.repeat(np.arange(last - first), np.diff(starts[first : last + 1]))
+        block[rows, buckets[lo:hi]] = weights[lo:hi]
+        out[first:last] = block[: last - first] @ basis
+        block[rows, buckets[lo:hi]] = 0
+    norms = np.linalg.norm(out, axis=1, keepdims=True)
+    return out / np.where(norms > 0, norms, 1)
+
+
+def _exact_cosine(a: int, b: int, buckets: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> float:
+    _, ia, ib = np.intersect1d(
+        buckets[starts[a] : starts[a + 1]], buckets[starts[b] : starts[b + 1]], assume_unique=True, return_indices=True
+    )
+    return float(np.dot(weights[starts[a] + ia], weights[starts[b] + ib]))
+
+
+def leaders(texts: list[str], threshold: float) -> list[int]:
+    # For every text, the index of the earlier text it duplicates (itself if none). Each member
+    # is checked against its leader directly, so clusters never chain through intermediate posts.
+    count = len(texts)
+    if count < 2:
+        return list(range(count))
+    # URLs are left to the URL dedup: tracking tails and different links would only add noise.
+    buckets, weights, starts = tfidf([normalize_text(URL_RE.sub(" ", t)) for t in texts])
+    vectors = project(buckets, weights, starts, count)
+    result = list(range(count))
+    for first in range(0, count, BLOCK_ROWS):
+        block = vectors[first : first + BLOCK_ROWS] @ vectors[: first + BLOCK_ROWS].T
+        rows, cols = np.nonzero(block >= threshold - CANDIDATE_MARGIN)
+        for row, col in sorted(zip((rows + first).tolist(), cols.tolist())):
+            if col >= row or result[row] != row or result[col] != col:
+                continue
+            if _exact_cosine(row, col, buckets, weights, starts) >= threshold:
+                result[row] = col
+    return result
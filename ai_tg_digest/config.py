@@ -19,6 +19,7 @@ class AppSettings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="", extra="ignore")
 
     db_path: Path = Path("digest.db")
+    db_write_batch_size: int = Field(default=500, alias="DB_WRITE_BATCH_SIZE")
 
     tg_api_id: int = Field(alias="TG_API_ID")
     tg_api_hash: str = Field(alias="TG_API_HASH")
@@ -30,12 +31,53 @@ class AppSettings(BaseSettings):
     openai_base_url: str = Field(alias="OPENAI_BASE_URL")
     openai_api_key: str = Field(alias="OPENAI_API_KEY")
     openai_model: str = Field(alias="OPENAI_MODEL")
+    llm_concurrency: int = Field(default=1, alias="LLM_CONCURRENCY")
+    llm_batch_size: int = Field(default=1, alias="LLM_BATCH_SIZE")
+    llm_batch_token_budget: int = Field(default=6000, alias="LLM_BATCH_TOKEN_BUDGET")
+    llm_rpm: float = Field(default=0, alias="LLM_RPM")
+    llm_tpm: float = Field(default=0, alias="LLM_TPM")
+    llm_backoff_base_seconds: float = Field(default=1.0, alias="LLM_BACKOFF_BASE_SECONDS")
+    llm_backoff_max_seconds: float = Field(default=60, alias="LLM_BACKOFF_MAX_SECONDS")
+    llm_circuit_failures: int = Field(default=10, alias="LLM_CIRCUIT_FAILURES")
+    llm_circuit_cooldown_seconds: float = Field(default=120, alias="LLM_CIRCUIT_COOLDOWN_SECONDS")
+    process_commit_every: int = Field(default=20, alias="PROCESS_COMMIT_EVERY")
+    process_page_size: int = Field(default=200, alias="PROCESS_PAGE_SIZE")
+    process_max_items: int = Field(default=0, alias="PROCESS_MAX_ITEMS")
+    process_time_budget_seconds: float = Field(default=0, alias="PROCESS_TIME_BUDGET_SECONDS")
+    process_max_attempts: int = Field(default=5, alias="PROCESS_MAX_ATTEMPTS")
+    process_retry_base_seconds: float = Field(default=60, alias="PROCESS_RETRY_BASE_SECONDS")
+    llm_cache_enabled: bool = Field(default=True, alias="LLM_CACHE_ENABLED")
+    llm_cache_path: Path = Field(default=Path("llm_cache.db"), alias="LLM_CACHE_PATH")
+    llm_cache_ttl_hours: float = Field(default=168, alias="LLM_CACHE_TTL_HOURS")
+    llm_cache_max_entries: int = Field(default=50000, alias="LLM_CACHE_MAX_ENTRIES")
+
+    ingest_concurrency: int = Field(default=8, alias="INGEST_CONCURRENCY")
+    ingest_flood_retries: int = Field(default=3, alias="INGEST_FLOOD_RETRIES")
+    ingest_flood_wait_max_seconds: int = Field(default=300, alias="INGEST_FLOOD_WAIT_MAX_SECONDS")
+
+    metrics_refresh_window_hours: int = Field(default=24, alias="METRICS_REFRESH_WINDOW_HOURS")
+    metrics_refresh_max_requests: int = Field(default=20, alias="METRICS_REFRESH_MAX_REQUESTS")
+    metrics_refresh_time_budget_seconds: float = Field(default=60, alias="METRICS_REFRESH_TIME_BUDGET_SECONDS")
+
+    prefilter_enabled: bool = Field(default=True, alias="PREFILTER_ENABLED")
+    prefilter_min_score_channel: float = Field(default=0.1, alias="PREFILTER_MIN_SCORE_CHANNEL")
+    prefilter_min_score_group: float = Field(default=0.35, alias="PREFILTER_MIN_SCORE_GROUP")
+    cluster_enabled: bool = Field(default=True, alias="CLUSTER_ENABLED")
+    cluster_threshold: float = Field(default=0.85, alias="CLUSTER_THRESHOLD")
 
     dedup_window_days: int = Field(default=7, alias="DEDUP_WINDOW_DAYS")
     sim_threshold: float = Field(default=0.85, alias="SIM_THRESHOLD")
+    sim_simhash_max_distance: int = Field(default=0, alias="SIM_SIMHASH_MAX_DISTANCE")
 
+    retention_days: int = Field(default=90, alias="RETENTION_DAYS")
+    retention_time: str = Field(default="04:30", alias="RETENTION_TIME")
+    retention_vacuum_pages: int = Field(default=0, alias="RETENTION_VACUUM_PAGES")
+    archive_dir: Path = Field(default=Path("archive"), alias="ARCHIVE_DIR")
+
+    cycle_interval_minutes: float = Field(default=15, alias="CYCLE_INTERVAL_MINUTES")
     morning_time: str = Field(default="09:00", alias="MORNING_TIME")
     evening_time: str = Field(default="19:00", alias="EVENING_TIME")
+    digest_window_hours: int = Field(default=12, alias="DIGEST_WINDOW_HOURS")
     max_items_per_digest: int = Field(default=10, alias="MAX_ITEMS_PER_DIGEST")
     max_items_per_category: int = Field(default=3, alias="MAX_ITEMS_PER_CATEGORY")
 
@@ -4,74 +4,288 @@ import json
 import sqlite3
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator
+
+from ai_tg_digest import stats
+from ai_tg_digest.utils import message_urls, normalize_urls
+
+
+BUSY_TIMEOUT_MS = 10_000
+CACHE_SIZE_KIB = 64 * 1024
+WRITE_BATCH_SIZE = 500
+CONVERT_BATCH_SIZE = 2000
 
 
 def connect(db_path: Path) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+    # WAL lets the scheduler, the moderation listener and CLI readers work on the same file
+    # without blocking each other; synchronous=NORMAL is durable enough under WAL.
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    # Only takes effect on a new, empty file; existing ones switch over in `aidigest db compact`.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def connect_readonly(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA query_only=1")
     return conn
 
 
+# Number of the newest file in migrations/; bump it together with every new migration.
+LATEST_SCHEMA_VERSION = 14
+
+
 def migrate(conn: sqlite3.Connection, migrations_dir: Path = Path("migrations")) -> None:
+    # Every CLI command calls this; a current DB is recognised from the header's user_version
+    # without touching the migrations directory or schema_migrations.
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= LATEST_SCHEMA_VERSION:
+        return
     conn.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name TEXT PRIMARY KEY)")
     applied = {r[0] for r in conn.execute("SELECT name FROM schema_migrations")}
-    for path in sorted(migrations_dir.glob("*.sql")):
+    paths = sorted(migrations_dir.glob("*.sql"))
+    for path in paths:
         if path.name in applied:
             continue
         conn.executescript(path.read_text(encoding="utf-8"))
         conn.execute("INSERT INTO schema_migrations(name) VALUES (?)", (path.name,))
+    if paths:
+        conn.execute(f"PRAGMA user_version={int(paths[-1].name.split('_', 1)[0])}")
     conn.commit()
 
 
-def upsert_sources(conn: sqlite3.Connection, sources: Iterable[dict]) -> None:
-    for s in sources:
-        conn.execute(
-            """
-            INSERT INTO sources(id_or_username,type,weight,enabled)
-            VALUES(?,?,?,?)
-            ON CONFLICT(id_or_username) DO UPDATE SET type=excluded.type, weight=excluded.weight, enabled=excluded.enabled
-            """,
-            (s["id_or_username"], s["type"], s["weight"], int(s["enabled"])),
+# Queries on the processing and digest hot paths. Callers run these constants, and
+# HOT_QUERIES feeds the same text to EXPLAIN QUERY PLAN (`aidigest db explain`,
+# tests/test_db.py), so the index checks can't drift from what actually runs.
+BACKLOG_QUERY = """
+    SELECT rm.*, s.weight, s.type AS source_type FROM raw_messages rm
+    JOIN sources s ON s.id=rm.source_id
+    WHERE rm.canonical_news_id IS NULL
+      AND COALESCE(rm.process_stage, '') NOT IN ('quarantined', 'skipped')
+      AND (rm.next_attempt_at IS NULL OR rm.next_attempt_at <= ?)
+      AND rm.posted_at >= ?
+      AND rm.posted_at <= ? AND (rm.posted_at < ? OR rm.id > ?)
+    ORDER BY rm.posted_at DESC, rm.id
+    LIMIT ?
+"""
+# {} takes one "?" per URL.
+URL_DEDUP_QUERY = "SELECT canonical_news_id FROM canonical_links WHERE normalized_url IN ({}) LIMIT 1"
+MESSAGE_URL_DEDUP_QUERY = """
+    SELECT l.canonical_news_id FROM raw_message_urls u
+    JOIN canonical_links l ON l.normalized_url=u.normalized_url
+    WHERE u.raw_message_id=?
+    LIMIT 1
+"""
+# {} takes one "(band=? AND bucket=?)" per band, joined with OR.
+LSH_CANDIDATES_QUERY = """
+    SELECT c.id, c.main_event_ru, c.norm_text, c.norm_len, c.simhash FROM canonical_news c
+    WHERE c.id IN (SELECT canonical_news_id FROM canonical_lsh WHERE {}) AND c.last_seen_at >= ?
+    ORDER BY c.id
+"""
+LINKED_TEXT_LENGTH_QUERY = "SELECT MAX(length(text)) FROM raw_messages WHERE canonical_news_id=? AND id<>?"
+SUMMARY_DIRTY_QUERY = """
+    SELECT c.id, c.main_event_ru, c.event_type FROM canonical_news c
+    WHERE c.summary_dirty=1 AND c.id > ? AND EXISTS (SELECT 1 FROM raw_messages rm WHERE rm.canonical_news_id=c.id)
+    ORDER BY c.id
+    LIMIT ?
+"""
+DIGEST_DIRTY_QUERY = """
+    SELECT c.id, c.title_ru, c.summary_bullets_json, c.why_important_ru, c.importance_score, c.last_seen_at, c.labels_json,
+           (SELECT group_concat(label, char(10)) FROM (
+              SELECT x.label FROM canonical_labels x WHERE x.canonical_news_id=c.id ORDER BY x.confidence DESC, x.id
+           )) AS labels,
+           (SELECT group_concat(normalized_url, char(10)) FROM (
+              SELECT l.normalized_url FROM canonical_links l WHERE l.canonical_news_id=c.id ORDER BY l.id LIMIT ?
+           )) AS links
+    FROM canonical_news c
+    WHERE c.digest_dirty=1 AND c.last_seen_at >= ?
+"""
+DIGEST_SELECTION_QUERY = """
+    SELECT item_json, preview_block, publish_block FROM (
+      SELECT d.*, ROW_NUMBER() OVER (PARTITION BY category ORDER BY importance_score DESC, canonical_news_id) AS rank
+      FROM digest_candidates d WHERE d.last_seen_at >= ?
+    )
+    WHERE rank <= ?
+    ORDER BY importance_score DESC, canonical_news_id
+    LIMIT ?
+"""
+METRICS_REFRESH_QUERY = """
+    SELECT rm.id, rm.tg_message_id, rm.posted_at, rm.canonical_news_id,
+           rm.views, rm.forwards, rm.reactions_count, rm.comments_count,
+           s.id_or_username, s.weight
+    FROM raw_messages rm
+    JOIN sources s ON s.id=rm.source_id
+    WHERE rm.posted_at >= ? AND s.enabled=1
+    ORDER BY rm.metrics_refreshed_at IS NOT NULL, rm.metrics_refreshed_at, rm.posted_at DESC
+    LIMIT ?
+"""
+AUTO_PUBLISH_QUERY = "SELECT id FROM digests WHERE status='queued' AND auto_publish_at <= ?"
+
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {
+    "backlog": (BACKLOG_QUERY, ("2000-01-01", "", "9999-12-31", "9999-12-31", 0, 200)),
+    "url_dedup": (URL_DEDUP_QUERY.format("?,?"), ("a", "b")),
+    "message_url_dedup": (MESSAGE_URL_DEDUP_QUERY, (1,)),
+    "lsh_candidates": (LSH_CANDIDATES_QUERY.format("(band=? AND bucket=?) OR (band=? AND bucket=?)"), (0, 1, 1, 2, "2000-01-01")),
+    "linked_text_length": (LINKED_TEXT_LENGTH_QUERY, (1, 1)),
+    "summary_dirty": (SUMMARY_DIRTY_QUERY, (0, 64)),
+    "digest_dirty": (DIGEST_DIRTY_QUERY, (3, "2000-01-01")),
+    "digest_selection": (DIGEST_SELECTION_QUERY, ("2000-01-01", 2, 10)),
+    "metrics_refresh": (METRICS_REFRESH_QUERY, ("2000-01-01", 100)),
+    "auto_publish": (AUTO_PUBLISH_QUERY, ("2000-01-01",)),
+}
+
+
+def explain_hot_queries(conn: sqlite3.Connection) -> list[tuple[str, list[str], bool]]:
+    # A plain "SCAN <table>" (no index) is a full table scan; index scans, constant rows and
+    # scans over an already-limited subquery result are fine.
+    report = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        has_scan = any(
+            line.startswith("SCAN ")
+            and " USING " not in line
+            and "CONSTANT ROW" not in line
+            and not line.startswith("SCAN (subquery")
+            for line in plan
         )
-    conn.commit()
+        report.append((name, plan, has_scan))
+    return report
 
 
-def insert_raw_message(conn: sqlite3.Connection, payload: dict) -> None:
-    conn.execute(
+def upsert_sources(conn: sqlite3.Connection, sources: Iterable[dict]) -> None:
+    conn.executemany(
         """
-        INSERT OR IGNORE INTO raw_messages(
-          source_id,tg_message_id,permalink,posted_at,text,views,forwards,reactions_count,comments_count,known_urls_json,dedup_status,canonical_news_id
-        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+        INSERT INTO sources(id_or_username,type,weight,enabled)
+        VALUES(?,?,?,?)
+        ON CONFLICT(id_or_username) DO UPDATE SET type=excluded.type, weight=excluded.weight, enabled=excluded.enabled
         """,
-        (
-            payload["source_id"],
-            payload["tg_message_id"],
-            payload.get("permalink"),
-            payload["posted_at"],
-            payload.get("text"),
-            payload.get("views"),
-            payload.get("forwards"),
-            payload.get("reactions_count"),
-            payload.get("comments_count"),
-            json.dumps(payload.get("known_urls", []), ensure_ascii=False),
-            payload.get("dedup_status"),
-            payload.get("canonical_news_id"),
-        ),
+        [(s["id_or_username"], s["type"], s["weight"], int(s["enabled"])) for s in sources],
+    )
+    conn.commit()
+
+
+RAW_MESSAGE_INSERT = """
+    INSERT OR IGNORE INTO raw_messages(
+      source_id,tg_message_id,permalink,posted_at,text,views,forwards,reactions_count,comments_count,known_urls_json,dedup_status,canonical_news_id
+    ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+"""
+
+
+def _raw_message_params(payload: dict) -> tuple:
+    return (
+        payload["source_id"],
+        payload["tg_message_id"],
+        payload.get("permalink"),
+        payload["posted_at"],
+        payload.get("text"),
+        payload.get("views"),
+        payload.get("forwards"),
+        payload.get("reactions_count"),
+        payload.get("comments_count"),
+        json.dumps(payload.get("known_urls", []), ensure_ascii=False),
+        payload.get("dedup_status"),
+        payload.get("canonical_news_id"),
+    )
+
+
+# Keyed by (source_id, tg_message_id) so executemany needs no lastrowid round trip; a message
+# that was already stored keeps the URLs it had.
+RAW_MESSAGE_URLS_INSERT = """
+    INSERT OR IGNORE INTO raw_message_urls(raw_message_id, normalized_url)
+    SELECT id, ? FROM raw_messages WHERE source_id=? AND tg_message_id=?
+"""
+
+
+def _raw_message_url_params(payloads: Iterable[dict]) -> list[tuple]:
+    return [
+        (url, p["source_id"], p["tg_message_id"])
+        for p in payloads
+        for url in message_urls(p.get("text"), p.get("known_urls", []))
+    ]
+
+
+def insert_raw_message(conn: sqlite3.Connection, payload: dict) -> None:
+    insert_raw_messages(conn, [payload])
+
+
+def insert_raw_messages(conn: sqlite3.Connection, payloads: Iterable[dict]) -> int:
+    payloads = list(payloads)
+    inserted = conn.executemany(RAW_MESSAGE_INSERT, [_raw_message_params(p) for p in payloads]).rowcount
+    conn.executemany(RAW_MESSAGE_URLS_INSERT, _raw_message_url_params(payloads))
+    return inserted
+
+
+def insert_canonical_links(conn: sqlite3.Connection, links: Iterable[tuple[int, str, str | None]]) -> int:
+    return conn.executemany(
+        "INSERT OR IGNORE INTO canonical_links(canonical_news_id, normalized_url, domain) VALUES(?,?,?)", list(links)
+    ).rowcount
+
+
+class BulkWriter:
+    # Buffers ingest rows and flushes them with executemany, one transaction per flush.
+    # Source cursors go into the same transaction as the rows they cover, so a cursor
+    # never gets ahead of the data it points past.
+    def __init__(self, conn: sqlite3.Connection, batch_size: int = WRITE_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.raw_messages: list[dict] = []
+        self.cursors: dict[int, int] = {}
+        self.inserted = 0
+
+    def __enter__(self) -> BulkWriter:
+        return self
+
+    def __exit__(self, exc_type, *exc: object) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def add_raw_messages(self, payloads: Iterable[dict]) -> None:
+        self.raw_messages.extend(payloads)
+        if len(self.raw_messages) >= self.batch_size:
+            self.flush()
+
+    def set_source_cursor(self, source_id: int, last_tg_message_id: int) -> None:
+        self.cursors[source_id] = max(last_tg_message_id, self.cursors.get(source_id, 0))
+
+    def flush(self) -> None:
+        if not (self.raw_messages or self.cursors):
+            return
+        with stats.timer("db.flush"), self.conn:
+            if self.raw_messages:
+                self.inserted += insert_raw_messages(self.conn, self.raw_messages)
+            if self.cursors:
+                self.conn.executemany(
+                    "UPDATE sources SET last_tg_message_id=? WHERE id=?", [(v, k) for k, v in self.cursors.items()]
+                )
+        self.raw_messages, self.cursors = [], {}
+
+
+def replace_labels(conn: sqlite3.Connection, canonical_id: int, labels: Iterable[dict]) -> None:
+    conn.execute("DELETE FROM canonical_labels WHERE canonical_news_id=?", (canonical_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO canonical_labels(canonical_news_id, label, confidence) VALUES(?,?,?)",
+        [(canonical_id, x["label"], x.get("confidence") or 0) for x in labels if x.get("label")],
     )
 
 
 def create_canonical(conn: sqlite3.Connection, item: dict) -> int:
     cur = conn.execute(
         """
-        INSERT INTO canonical_news(title_ru,summary_bullets_json,why_important_ru,labels_json,event_type,main_event_ru,importance_score,first_seen_at,last_seen_at,sources_count,raw_count,metadata_json)
+        INSERT INTO canonical_news(title_ru,summary_bullets_json,why_important_ru,event_type,main_event_ru,importance_score,first_seen_at,last_seen_at,sources_count,raw_count,metadata_json,summary_dirty)
         VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
         """,
         (
             item.get("title_ru"),
             json.dumps(item.get("bullets_ru", []), ensure_ascii=False),
             item.get("why_important_ru"),
-            json.dumps(item.get("labels", []), ensure_ascii=False),
             item.get("event_type"),
             item.get("main_event_ru"),
             item.get("importance_score", 0),
@@ -80,6 +294,68 @@ def create_canonical(conn: sqlite3.Connection, item: dict) -> int:
             item.get("sources_count", 1),
             item.get("raw_count", 1),
             json.dumps(item.get("metadata", {}), ensure_ascii=False),
+            int(item.get("summary_dirty", False)),
         ),
     )
-    return int(cur.lastrowid)
+    canonical_id = int(cur.lastrowid)
+    replace_labels(conn, canonical_id, item.get("labels", []))
+    return canonical_id
+
+
+def _convert_labels(conn: sqlite3.Connection, first: int, last: int) -> int:
+    rows = conn.execute(
+        "SELECT id, labels_json FROM canonical_news WHERE id > ? AND id <= ? AND labels_json IS NOT NULL", (first, last)
+    ).fetchall()
+    for row in rows:
+        replace_labels(conn, row["id"], json.loads(row["labels_json"]))
+    conn.execute("UPDATE canonical_news SET labels_json=NULL WHERE id > ? AND id <= ? AND labels_json IS NOT NULL", (first, last))
+    return len(rows)
+
+
+def _convert_message_urls(conn: sqlite3.Connection, first: int, last: int) -> int:
+    rows = conn.execute("SELECT id, text, known_urls_json FROM raw_messages WHERE id > ? AND id <= ?", (first, last)).fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO raw_message_urls(raw_message_id, normalized_url) VALUES(?,?)",
+        [(row["id"], url) for row in rows for url in message_urls(row["text"], json.loads(row["known_urls_json"] or "[]"))],
+    )
+    return len(rows)
+
+
+def rekey_links(conn: sqlite3.Connection, first: int, last: int) -> int:
+    # Re-keys canonical_links after normalize_url rules change; the old spelling of a URL
+    # would otherwise never match a new message's link again.
+    rows = conn.execute(
+        "SELECT id, canonical_news_id, normalized_url, domain FROM canonical_links WHERE id > ? AND id <= ?", (first, last)
+    ).fetchall()
+    stale = [(row, url) for row, url in zip(rows, normalize_urls(r["normalized_url"] for r in rows)) if url != row["normalized_url"]]
+    conn.executemany(
+        "INSERT OR IGNORE INTO canonical_links(canonical_news_id, normalized_url, domain) VALUES(?,?,?)",
+        [(row["canonical_news_id"], url, row["domain"]) for row, url in stale],
+    )
+    conn.executemany("DELETE FROM canonical_links WHERE id=?", [(row["id"],) for row, _ in stale])
+    return len(stale)
+
+
+JSON_CONVERSIONS = {"canonical_labels": _convert_labels, "raw_message_urls": _convert_message_urls, "canonical_links": rekey_links}
+
+
+def convert_json_chunks(conn: sqlite3.Connection, batch_size: int = CONVERT_BATCH_SIZE) -> Iterator[int]:
+    # Moves rows written before migration 012 out of labels_json / known_urls_json and re-keys
+    # links stored before migration 013, one id range per transaction, yielding the rows
+    # converted after each. Other connections only ever wait
+    # for one chunk; async callers yield to the event loop between chunks. Progress is committed
+    # with each chunk, so an interrupted conversion resumes where it stopped.
+    for name, last_id, max_id in conn.execute("SELECT name, last_id, max_id FROM json_conversions").fetchall():
+        while last_id < max_id:
+            upto = min(max_id, last_id + batch_size)
+            with stats.timer("db.convert_json"), conn:
+                converted = JSON_CONVERSIONS[name](conn, last_id, upto)
+                conn.execute("UPDATE json_conversions SET last_id=? WHERE name=?", (upto, name))
+            last_id = upto
+            yield converted
+        conn.execute("DELETE FROM json_conversions WHERE name=?", (name,))
+        conn.commit()
+
+
+def convert_json_columns(conn: sqlite3.Connection, batch_size: int = CONVERT_BATCH_SIZE) -> int:
+    return sum(convert_json_chunks(conn, batch_size))
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import hashlib
+import zlib
+from array import array
+
+from ai_tg_digest import db
+from ai_tg_digest.utils import normalize_text, normalize_urls
+
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+_MIX = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+_BIN_SHIFT = 64 - (NUM_PERM - 1).bit_length()
+_VALUE_MASK = (1 << 32) - 1
+_SIGN_BIT = 1 << 63
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set[int]:
+    clean = normalize_text(text)
+    if not clean:
+        return set()
+    if len(clean) <= size:
+        return {zlib.crc32(clean.encode("utf-8"))}
+    return {zlib.crc32(clean[i : i + size].encode("utf-8")) for i in range(len(clean) - size + 1)}
+
+
+def minhash_signature(text: str) -> list[int]:
+    # One-permutation hashing: a single mixed hash per shingle is split into NUM_PERM bins,
+    # empty bins borrow the next filled bin's minimum (rotation densification).
+    hashes = shingles(text)
+    if not hashes:
+        return []
+    bins: list[int | None] = [None] * NUM_PERM
+    for h in hashes:
+        mixed = (h * _MIX) & _MASK64
+        idx = mixed >> _BIN_SHIFT
+        value = mixed & _VALUE_MASK
+        current = bins[idx]
+        if current is None or value < current:
+            bins[idx] = value
+    signature = [0] * NUM_PERM
+    for i in range(NUM_PERM):
+        for step in range(NUM_PERM):
+            value = bins[(i + step) % NUM_PERM]
+            if value is not None:
+                signature[i] = (value + step) & _VALUE_MASK
+                break
+    return signature
+
+
+def band_buckets(signature: list[int]) -> list[tuple[int, int]]:
+    buckets = []
+    for band in range(BANDS if signature else 0):
+        chunk = array("I", signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]).tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, "big", signed=True)))
+    return buckets
+
+
+def simhash(norm_text: str) -> int:
+    # 64-bit word simhash, stored as a signed integer so it fits an SQLite INTEGER.
+    # Bits are voted column-wise over the tokens' binary strings, which keeps the per-token
+    # work in C instead of a 64-step Python loop.
+    tokens = norm_text.split()
+    if not tokens:
+        return 0
+    bits = [f"{int.from_bytes(hashlib.blake2b(t.encode('utf-8'), digest_size=8).digest(), 'big'):064b}" for t in tokens]
+    value = int("".join("1" if column.count("1") * 2 > len(tokens) else "0" for column in zip(*bits)), 2)
+    return value - (1 << 64) if value & _SIGN_BIT else value
+
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & _MASK64).bit_count()
+
+
+def fingerprint(text: str | None) -> tuple[str, int, int]:
+    norm = normalize_text(text or "")
+    return norm, len(norm), simhash(norm)
+
+
+def index_canonical(conn, canonical_id: int, text: str | None) -> None:
+    conn.execute("UPDATE canonical_news SET norm_text=?, norm_len=?, simhash=? WHERE id=?", (*fingerprint(text), canonical_id))
+    signature = minhash_signature(text or "")
+    conn.execute("DELETE FROM canonical_lsh WHERE canonical_news_id=?", (canonical_id,))
+    conn.executemany(
+        "INSERT OR IGNORE INTO canonical_lsh(band, bucket, canonical_news_id) VALUES(?,?,?)",
+        [(band, bucket, canonical_id) for band, bucket in band_buckets(signature)],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO canonical_minhash(canonical_news_id, signature) VALUES(?,?)",
+        (canonical_id, array("I", signature).tobytes()),
+    )
+
+
+def index_missing(conn, batch_size: int = 1000) -> int:
+    total = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT c.id, c.main_event_ru FROM canonical_news c
+            LEFT JOIN canonical_minhash m ON m.canonical_news_id=c.id
+            WHERE m.canonical_news_id IS NULL AND c.id > ?
+            ORDER BY c.id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return total
+        for row in rows:
+            index_canonical(conn, row["id"], row["main_event_ru"])
+        total += len(rows)
+        last_id = rows[-1]["id"]
+
+
+def backfill_fingerprints(conn, batch_size: int = 1000) -> int:
+    total = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, main_event_ru FROM canonical_news WHERE norm_len IS NULL ORDER BY id LIMIT ?", (batch_size,)
+        ).fetchall()
+        if not rows:
+            return total
+        conn.executemany(
+            "UPDATE canonical_news SET norm_text=?, norm_len=?, simhash=? WHERE id=?",
+            [(*fingerprint(row["main_event_ru"]), row["id"]) for row in rows],
+        )
+        total += len(rows)
+
+
+def renormalize_links(conn, batch_size: int = 1000) -> int:
+    changed, last_id = 0, 0
+    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM canonical_links").fetchone()[0]
+    while last_id < max_id:
+        changed += db.rekey_links(conn, last_id, last_id + batch_size)
+        last_id += batch_size
+    return changed
+
+
+def lsh_candidates(conn, text: str, since: str) -> list:
+    buckets = band_buckets(minhash_signature(text))
+    if not buckets:
+        return []
+    q = db.LSH_CANDIDATES_QUERY.format(" OR ".join(["(band=? AND bucket=?)"] * len(buckets)))
+    params = [v for pair in buckets for v in pair]
+    return conn.execute(q, (*params, since)).fetchall()
@@ -1,48 +1,106 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 from datetime import datetime, timedelta
 
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
 
-from ai_tg_digest import db
+from ai_tg_digest import db, stats
 from ai_tg_digest.config import AppSettings
 
+logger = logging.getLogger(__name__)
+
 
 def sync_sources(conn, settings: AppSettings) -> None:
     db.upsert_sources(conn, [s.model_dump() for s in settings.sources])
 
 
-async def ingest_new_messages(conn, settings: AppSettings, limit_per_source: int = 200) -> int:
+def message_metrics(msg) -> dict:
+    return {
+        "views": getattr(msg, "views", None),
+        "forwards": getattr(msg, "forwards", None),
+        "reactions_count": sum((r.count for r in getattr(getattr(msg, "reactions", None), "results", []) or []), 0),
+        "comments_count": getattr(msg, "replies", None).replies if getattr(msg, "replies", None) else None,
+    }
+
+
+def message_to_payload(msg, source_id: int, id_or_username: str) -> dict:
+    known_urls = []
+    if getattr(msg, "entities", None):
+        for e in msg.entities:
+            if hasattr(e, "url"):
+                known_urls.append(e.url)
+    return {
+        "source_id": source_id,
+        "tg_message_id": msg.id,
+        "permalink": f"https://t.me/{id_or_username.lstrip('@')}/{msg.id}",
+        "posted_at": msg.date.replace(tzinfo=None).isoformat(),
+        "text": msg.message,
+        **message_metrics(msg),
+        "known_urls": known_urls,
+    }
+
+
+async def fetch_source(client, row, since: datetime, limit: int) -> tuple[list[dict], int | None]:
+    # With a cursor we walk upwards from it (reverse=True), so a burst larger than `limit`
+    # is picked up by the next cycle instead of leaving a gap below the new high-water mark.
+    # Posts older than `since` are dropped in both directions: for a source re-enabled after
+    # weeks the cursor still moves past them, but they never reach the backlog.
+    cursor = row["last_tg_message_id"]
+    kwargs = {"limit": limit, "min_id": cursor, "reverse": True} if cursor else {"limit": limit}
+    payloads: list[dict] = []
+    max_id = cursor
+    async for msg in client.iter_messages(row["id_or_username"], **kwargs):
+        stale = msg.date.replace(tzinfo=None) < since
+        if stale and not cursor:
+            break
+        max_id = max(max_id or 0, msg.id)
+        if msg.message and not stale:
+            payloads.append(message_to_payload(msg, row["id"], row["id_or_username"]))
+    return payloads, max_id
+
+
+async def fetch_source_with_backoff(client, row, since: datetime, limit: int, settings: AppSettings) -> tuple[list[dict], int | None]:
+    attempt = 0
+    while True:
+        try:
+            return await fetch_source(client, row, since, limit)
+        except FloodWaitError as e:
+            stats.incr("ingest.flood_waits")
+            attempt += 1
+            if attempt > settings.ingest_flood_retries or e.seconds > settings.ingest_flood_wait_max_seconds:
+                raise
+            logger.warning("FloodWait %ss on %s, retry %s", e.seconds, row["id_or_username"], attempt)
+            await asyncio.sleep(e.seconds)
+
+
+async def ingest_new_messages(conn, settings: AppSettings, limit_per_source: int = 200, client: TelegramClient | None = None) -> int:
+    if client is None:
+        async with TelegramClient(settings.tg_session, settings.tg_api_id, settings.tg_api_hash) as client:
+            return await ingest_new_messages(conn, settings, limit_per_source, client)
+
     sync_sources(conn, settings)
-    total = 0
-    async with TelegramClient(settings.tg_session, settings.tg_api_id, settings.tg_api_hash) as client:
-        rows = conn.execute("SELECT id, id_or_username FROM sources WHERE enabled=1").fetchall()
-        for row in rows:
-            since = datetime.utcnow() - timedelta(days=settings.dedup_window_days)
-            async for msg in client.iter_messages(row["id_or_username"], limit=limit_per_source):
-                if not msg.message:
-                    continue
-                dt = msg.date.replace(tzinfo=None)
-                if dt < since:
-                    break
-                known_urls = []
-                if getattr(msg, "entities", None):
-                    for e in msg.entities:
-                        if hasattr(e, "url"):
-                            known_urls.append(e.url)
-                payload = {
-                    "source_id": row["id"],
-                    "tg_message_id": msg.id,
-                    "permalink": f"https://t.me/{row['id_or_username'].lstrip('@')}/{msg.id}",
-                    "posted_at": dt.isoformat(),
-                    "text": msg.message,
-                    "views": getattr(msg, "views", None),
-                    "forwards": getattr(msg, "forwards", None),
-                    "reactions_count": sum((r.count for r in getattr(getattr(msg, "reactions", None), "results", []) or []), 0),
-                    "comments_count": getattr(msg, "replies", None).replies if getattr(msg, "replies", None) else None,
-                    "known_urls": known_urls,
-                }
-                db.insert_raw_message(conn, payload)
-                total += 1
-        conn.commit()
-    return total
+    rows = conn.execute("SELECT id, id_or_username, last_tg_message_id FROM sources WHERE enabled=1").fetchall()
+    since = datetime.utcnow() - timedelta(days=settings.dedup_window_days)
+    semaphore = asyncio.Semaphore(max(1, settings.ingest_concurrency))
+
+    async def fetch(row):
+        async with semaphore:
+            with stats.timer("ingest.fetch"):
+                return row, await fetch_source_with_backoff(client, row, since, limit_per_source, settings)
+
+    with db.BulkWriter(conn, settings.db_write_batch_size) as writer:
+        for task in asyncio.as_completed([fetch(row) for row in rows]):
+            try:
+                row, (payloads, max_id) = await task
+            except Exception:  # noqa: BLE001
+                logger.exception("Ingest failed for a source, skipping it this cycle")
+                stats.incr("ingest.source_errors")
+                continue
+            stats.incr("ingest.messages", len(payloads))
+            writer.add_raw_messages(payloads)
+            if max_id:
+                writer.set_source_cursor(row["id"], max_id)
+    return writer.inserted
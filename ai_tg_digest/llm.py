@@ -1,41 +1,229 @@
 from __future__ import annotations
 
+import asyncio
 import json
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from typing import Any
 
 import httpx
 
+from ai_tg_digest import stats
+from ai_tg_digest.llm_cache import LLMCache, make_cache_key
+from ai_tg_digest.ratelimit import CircuitBreaker, RateLimiter
 from ai_tg_digest.utils import robust_json_loads
 
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+RETRY_STATUSES = {408, 409, 429}
+CHARS_PER_TOKEN = 3
+# Reserved against the tokens/min bucket for the completion until `usage` tells the real number.
+COMPLETION_TOKENS_RESERVE = 400
+# Model output that doesn't parse as JSON; the endpoint itself is fine, so no backoff.
+PARSE_ERRORS = (ValueError, KeyError, IndexError, TypeError)
+
+
+class RetryableError(RuntimeError):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _build_payload(model: str, system_prompt: str, user_prompt: str, temperature: float) -> dict[str, Any]:
+    return {
+        "model": model,
+        "temperature": temperature,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+    }
+
+
+def _estimate_tokens(payload: dict[str, Any]) -> int:
+    return sum(len(m["content"]) for m in payload["messages"]) // CHARS_PER_TOKEN + COMPLETION_TOKENS_RESERVE
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _reserve(limiter: RateLimiter, breaker: CircuitBreaker, estimate: int) -> float:
+    # Raises CircuitOpenError straight to the caller: no point queueing behind a dead endpoint.
+    breaker.check()
+    wait = limiter.reserve(estimate)
+    if wait:
+        stats.observe("llm.throttle_wait", wait)
+    return wait
+
+
+def _failed(limiter: RateLimiter, breaker: CircuitBreaker, attempt: int, error: Exception) -> None:
+    breaker.record_failure()
+    limiter.backoff(attempt, getattr(error, "retry_after", None))
+
+
+def _parse_response(response: httpx.Response, limiter: RateLimiter, breaker: CircuitBreaker, estimate: int) -> dict[str, Any]:
+    status = response.status_code
+    if status in RETRY_STATUSES or status >= 500:
+        stats.incr("llm.throttled" if status == 429 else "llm.server_errors")
+        raise RetryableError(f"HTTP {status}", _retry_after(response))
+    if status >= 400:
+        stats.incr("llm.rejected")
+        raise RuntimeError(f"LLM request rejected: HTTP {status} {response.text[:200]}")
+    breaker.record_success()
+    body = response.json()
+    usage = body.get("usage") or {}
+    stats.incr("llm.prompt_tokens", usage.get("prompt_tokens") or 0)
+    stats.incr("llm.completion_tokens", usage.get("completion_tokens") or 0)
+    total = usage.get("total_tokens") or (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+    limiter.record_usage(estimate, total or None)
+    return robust_json_loads(body["choices"][0]["message"]["content"])
+
+
+def _cached(cache: LLMCache | None, key: str | None) -> dict[str, Any] | None:
+    if not key:
+        return None
+    cached = cache.get(key)
+    stats.incr("llm.cache_hits" if cached is not None else "llm.cache_misses")
+    return cached
+
 
 class OpenAICompatClient:
-    def __init__(self, base_url: str, api_key: str, model: str):
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        cache: LLMCache | None = None,
+        limiter: RateLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._client: httpx.Client | None = None
+
+    def _http(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(timeout=60.0, headers={"Authorization": f"Bearer {self.api_key}"})
+        return self._client
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def complete_json(
+        self, system_prompt: str, user_prompt: str, temperature: float = 0.1, retries: int = 2, template: str = ""
+    ) -> dict[str, Any]:
+        key = make_cache_key(self.model, system_prompt, template, user_prompt) if self.cache else None
+        if (cached := _cached(self.cache, key)) is not None:
+            return cached
+        payload = _build_payload(self.model, system_prompt, user_prompt, temperature)
+        estimate = _estimate_tokens(payload)
+        last_error: Exception | None = None
+        for attempt in range(retries + 1):
+            stats.incr("llm.calls" if attempt == 0 else "llm.retries")
+            if wait := _reserve(self.limiter, self.breaker, estimate):
+                time.sleep(wait)
+            try:
+                with stats.timer("llm.request"):
+                    response = self._http().post(f"{self.base_url}/chat/completions", json=payload)
+                result = _parse_response(response, self.limiter, self.breaker, estimate)
+            except (httpx.TransportError, RetryableError) as e:
+                last_error = e
+                _failed(self.limiter, self.breaker, attempt, e)
+                continue
+            except PARSE_ERRORS as e:
+                last_error = e
+                stats.incr("llm.parse_errors")
+                continue
+            if key:
+                self.cache.put(key, self.model, result)
+            return result
+        stats.incr("llm.failures")
+        raise RuntimeError(f"LLM JSON completion failed: {last_error}")
+
+
+class AsyncOpenAICompatClient:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        model: str,
+        max_concurrency: int = 8,
+        cache: LLMCache | None = None,
+        limiter: RateLimiter | None = None,
+        breaker: CircuitBreaker | None = None,
+    ):
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
         self.model = model
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=60.0,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    async def __aenter__(self) -> AsyncOpenAICompatClient:
+        return self
+
+    async def __aexit__(self, *exc: object) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
 
-    def complete_json(self, system_prompt: str, user_prompt: str, temperature: float = 0.1, retries: int = 2) -> dict[str, Any]:
-        payload = {
-            "model": self.model,
-            "temperature": temperature,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        }
-        headers = {"Authorization": f"Bearer {self.api_key}"}
-        with httpx.Client(timeout=60.0) as client:
-            last_error: Exception | None = None
-            for _ in range(retries + 1):
-                try:
-                    response = client.post(f"{self.base_url}/chat/completions", headers=headers, json=payload)
-                    response.raise_for_status()
-                    text = response.json()["choices"][0]["message"]["content"]
-                    return robust_json_loads(text)
-                except Exception as e:  # noqa: BLE001
-                    last_error = e
-            raise RuntimeError(f"LLM JSON completion failed: {last_error}")
+    async def complete_json(
+        self, system_prompt: str, user_prompt: str, temperature: float = 0.1, retries: int = 2, template: str = ""
+    ) -> dict[str, Any]:
+        key = make_cache_key(self.model, system_prompt, template, user_prompt) if self.cache else None
+        if (cached := _cached(self.cache, key)) is not None:
+            return cached
+        payload = _build_payload(self.model, system_prompt, user_prompt, temperature)
+        estimate = _estimate_tokens(payload)
+        last_error: Exception | None = None
+        for attempt in range(retries + 1):
+            stats.incr("llm.calls" if attempt == 0 else "llm.retries")
+            if wait := _reserve(self.limiter, self.breaker, estimate):
+                await asyncio.sleep(wait)
+            try:
+                async with self._semaphore:
+                    with stats.timer("llm.request"):
+                        response = await self._client.post(f"{self.base_url}/chat/completions", json=payload)
+                result = _parse_response(response, self.limiter, self.breaker, estimate)
+            except (httpx.TransportError, RetryableError) as e:
+                last_error = e
+                _failed(self.limiter, self.breaker, attempt, e)
+                continue
+            except PARSE_ERRORS as e:
+                last_error = e
+                stats.incr("llm.parse_errors")
+                continue
+            if key:
+                self.cache.put(key, self.model, result)
+            return result
+        stats.incr("llm.failures")
+        raise RuntimeError(f"LLM JSON completion failed: {last_error}")
 
 
 def load_prompt(name: str) -> tuple[str, str]:
@@ -47,4 +235,6 @@ def load_prompt(name: str) -> tuple[str, str]:
 
 
 def render(template: str, **kwargs: Any) -> str:
-    return template.format(**{k: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v for k, v in kwargs.items()})
+    # Templates embed literal JSON examples, so only substitute the placeholders we were given.
+    values = {k: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v for k, v in kwargs.items()}
+    return PLACEHOLDER_RE.sub(lambda m: str(values[m.group(1)]) if m.group(1) in values else m.group(0), template)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any
+
+from ai_tg_digest.config import AppSettings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+  key TEXT PRIMARY KEY,
+  model TEXT NOT NULL,
+  response_json TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  last_access_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access_at);
+"""
+
+
+def make_cache_key(model: str, system_prompt: str, template: str, user_prompt: str) -> str:
+    template_hash = hashlib.sha256(f"{system_prompt}\0{template}".encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\0{template_hash}\0{user_prompt}".encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    # Lives in its own SQLite file and commits on every write, so cached completions survive
+    # a pipeline run that dies before its own transaction commits.
+    def __init__(self, path: Path, ttl_seconds: float, max_entries: int, evict_every: int = 500):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self.evict()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        now = time.time()
+        row = self.conn.execute("SELECT response_json, created_at FROM llm_cache WHERE key=?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE llm_cache SET last_access_at=? WHERE key=?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, value: dict[str, Any]) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO llm_cache(key, model, response_json, created_at, last_access_at) VALUES(?,?,?,?,?)",
+            (key, model, json.dumps(value, ensure_ascii=False), now, now),
+        )
+        self.conn.commit()
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        cur = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        removed = cur.rowcount
+        cur = self.conn.execute(
+            """
+            DELETE FROM llm_cache WHERE key IN (
+              SELECT key FROM llm_cache ORDER BY last_access_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+        removed += cur.rowcount
+        self.conn.commit()
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        entries = self.conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def open_llm_cache(settings: AppSettings) -> LLMCache | None:
+    if not settings.llm_cache_enabled:
+        return None
+    return LLMCache(settings.llm_cache_path, settings.llm_cache_ttl_hours * 3600, settings.llm_cache_max_entries)
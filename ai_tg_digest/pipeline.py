@@ -1,12 +1,22 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta
+from typing import Any, Callable, Iterator
+from urllib.parse import urlsplit
 
-from ai_tg_digest import db
+from ai_tg_digest import batching, db, dedup, prefilter, stats
 from ai_tg_digest.config import AppSettings
-from ai_tg_digest.llm import OpenAICompatClient, load_prompt, render
-from ai_tg_digest.utils import normalize_url, text_similarity
+from ai_tg_digest.llm import AsyncOpenAICompatClient, OpenAICompatClient, load_prompt, render
+from ai_tg_digest.llm_cache import LLMCache, open_llm_cache
+from ai_tg_digest.ratelimit import CircuitOpenError, limits_for
+from ai_tg_digest.utils import bounded_similarity, length_bound, normalize_text, normalize_urls
+
+logger = logging.getLogger(__name__)
 
 LABELS = ["NLP", "RAG", "AGENTS", "GRAPHS", "CLASSIC_ML", "TIME_SERIES", "FRAMEWORKS"]
 
@@ -23,134 +33,965 @@ def compute_importance(raw: dict, source_weight: float, hours_old: float) -> flo
     return round(score, 2)
 
 
-def find_or_create_canonical(conn, extracted: dict, text: str, settings: AppSettings) -> int:
-    urls = [u.get("normalized_url") for u in extracted.get("external_urls", []) if u.get("normalized_url")]
+def extracted_urls(extracted: dict) -> list[str]:
+    return [u.get("normalized_url") or u.get("url") or "" for u in extracted.get("external_urls", [])]
+
+
+def find_or_create_canonical(
+    conn, extracted: dict, text: str, settings: AppSettings, urls: list[str] | None = None, scores: dict[int, float] | None = None
+) -> int:
+    with stats.timer("dedup.lookup"):
+        canonical_id, how = match_canonical(conn, extracted, text, settings, urls, scores)
+    stats.incr(f"dedup.{how}")
+    return canonical_id
+
+
+def candidate_similarity(norm: str, norm_hash: int, candidate, settings: AppSettings) -> float:
+    if candidate["norm_len"] is None:
+        return bounded_similarity(norm, normalize_text(candidate["main_event_ru"] or ""), settings.sim_threshold)
+    if (bound := length_bound(len(norm), candidate["norm_len"])) < settings.sim_threshold:
+        stats.incr("dedup.prefilter_length")
+        return bound
+    if settings.sim_simhash_max_distance and dedup.hamming(norm_hash, candidate["simhash"]) > settings.sim_simhash_max_distance:
+        stats.incr("dedup.prefilter_simhash")
+        return 0.0
+    return bounded_similarity(norm, candidate["norm_text"], settings.sim_threshold)
+
+
+def match_canonical(
+    conn, extracted: dict, text: str, settings: AppSettings, urls: list[str] | None = None, scores: dict[int, float] | None = None
+) -> tuple[int, str]:
+    # `urls` and `scores` let a caller hand in already-normalized URLs and precomputed
+    # similarities (see backfill); anything missing from `scores` is computed here.
+    if urls is None:
+        urls = [u for u in normalize_urls(extracted_urls(extracted)) if u]
     if urls:
-        q = "SELECT canonical_news_id FROM canonical_links WHERE normalized_url IN ({}) LIMIT 1".format(",".join("?" * len(urls)))
-        row = conn.execute(q, urls).fetchone()
+        row = conn.execute(db.URL_DEDUP_QUERY.format(",".join("?" * len(urls))), urls).fetchone()
         if row:
-            return row["canonical_news_id"]
+            return row["canonical_news_id"], "by_url"
 
     since = (datetime.utcnow() - timedelta(days=settings.dedup_window_days)).isoformat()
-    candidates = conn.execute("SELECT id, main_event_ru FROM canonical_news WHERE last_seen_at >= ?", (since,)).fetchall()
-    for c in candidates:
-        if text_similarity(text, c["main_event_ru"] or "") >= settings.sim_threshold:
-            return c["id"]
+    norm = normalize_text(text)
+    norm_hash = dedup.simhash(norm) if settings.sim_simhash_max_distance else 0
+    for c in dedup.lsh_candidates(conn, text, since):
+        score = scores.get(c["id"]) if scores else None
+        if score is None:
+            score = candidate_similarity(norm, norm_hash, c, settings)
+        if score >= settings.sim_threshold:
+            return c["id"], "by_similarity"
+
+    # main_event_ru stands in as the title until the canonical's summary is generated.
+    main_event = extracted.get("main_event_ru")
+    canonical_id = db.create_canonical(
+        conn, {"title_ru": main_event, "main_event_ru": main_event, "event_type": extracted.get("event_type"), "summary_dirty": True}
+    )
+    dedup.index_canonical(conn, canonical_id, extracted.get("main_event_ru"))
+    return canonical_id, "new"
+
+
+PROMPT_FILES = {
+    "extraction": "prompt_a_extraction.txt",
+    "multilabel": "prompt_b_multilabel.txt",
+    "summary": "prompt_c_summary.txt",
+    "extraction_batch": "prompt_a_extraction_batch.txt",
+    "multilabel_batch": "prompt_b_multilabel_batch.txt",
+}
+
+
+def load_pipeline_prompts() -> dict[str, tuple[str, str]]:
+    return {stage: load_prompt(name) for stage, name in PROMPT_FILES.items()}
+
+
+# Keyset start: sorts after every posted_at, so the first page needs no special case.
+BACKLOG_START = ("9999-12-31", 0)
+
+
+def fetch_backlog(
+    conn, now: datetime | None = None, since: datetime | None = None, after: tuple[str, int] | None = None, limit: int = -1
+) -> list:
+    # Order is posted_at DESC, id ASC (the idx_raw_messages_backlog order), so the keyset
+    # condition is spelled out instead of a row-value comparison.
+    posted_at, row_id = after or BACKLOG_START
+    return conn.execute(
+        db.BACKLOG_QUERY,
+        ((now or datetime.utcnow()).isoformat(), since.isoformat() if since else "", posted_at, posted_at, row_id, limit),
+    ).fetchall()
+
+
+def iter_backlog(conn, page_size: int, since: datetime | None = None) -> Iterator[list]:
+    # Rows linked or backed off while a page is worked on fall out of the filter, and the
+    # cursor never goes back, so each row is handed out at most once per run.
+    now = datetime.utcnow()
+    after = None
+    while page := fetch_backlog(conn, now, since, after, page_size):
+        yield page
+        if len(page) < page_size:
+            return
+        after = (page[-1]["posted_at"], page[-1]["id"])
+
 
-    return db.create_canonical(conn, {"main_event_ru": extracted.get("main_event_ru"), "event_type": extracted.get("event_type")})
+class Budget:
+    def __init__(self, max_items: int = 0, seconds: float = 0):
+        self.items_left = max_items or None
+        self.deadline = time.monotonic() + seconds if seconds else None
 
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
 
-def process_new_messages(conn, settings: AppSettings) -> int:
-    llm = OpenAICompatClient(settings.openai_base_url, settings.openai_api_key, settings.openai_model)
-    s_ext, u_ext = load_prompt("prompt_a_extraction.txt")
-    s_cls, u_cls = load_prompt("prompt_b_multilabel.txt")
-    s_sum, u_sum = load_prompt("prompt_c_summary.txt")
+    def take(self, rows: list) -> list:
+        if self.items_left is None:
+            return rows
+        rows = rows[: self.items_left]
+        self.items_left -= len(rows)
+        return rows
 
-    rows = conn.execute(
+
+def prefilter_rows(conn, rows: list, settings: AppSettings, record: Callable[..., None]) -> list:
+    todo = []
+    for row in rows:
+        if decision := prefilter.decide(conn, row, settings):
+            record(row, *decision)
+        else:
+            todo.append(row)
+    return todo
+
+
+def cluster_rows(rows: list, settings: AppSettings, follow: Callable[[int, list], None]) -> list:
+    # Near-duplicates inside the page ride along with their earliest post: only that one goes
+    # through the LLM stages and the rest are linked to its canonical once it is linked.
+    fresh = [row for row in rows if row["extracted_json"] is None and row["text"]]
+    if not settings.cluster_enabled or len(fresh) < 2:
+        return rows
+    # numpy is only imported here, so digest building and other CLI paths don't pay for it.
+    from ai_tg_digest import cluster
+
+    with stats.timer("process.cluster"):
+        leaders = cluster.leaders([row["text"] for row in fresh], settings.cluster_threshold)
+    members: dict[int, list] = defaultdict(list)
+    for row, leader in zip(fresh, leaders):
+        if fresh[leader] is not row:
+            members[fresh[leader]["id"]].append(row)
+    for leader_id, rows_ in members.items():
+        follow(leader_id, rows_)
+        stats.incr("process.clustered", len(rows_))
+    followers = {row["id"] for rows_ in members.values() for row in rows_}
+    return [row for row in rows if row["id"] not in followers]
+
+
+def backlog_pages(conn, settings: AppSettings, since: datetime | None, budget: Budget) -> Iterator[list]:
+    for page in iter_backlog(conn, settings.process_page_size, since):
+        page = budget.take(page)
+        if not page or budget.expired():
+            logger.info("Processing budget reached, the rest of the backlog is left for the next run")
+            stats.incr("process.budget_exhausted")
+            return
+        stats.incr("process.messages", len(page))
+        yield page
+
+
+def render_extraction(template: str, row) -> str:
+    return render(
+        template,
+        post_text=row["text"] or "",
+        post_permalink=row["permalink"] or "",
+        known_urls_from_api_json=row["known_urls_json"] or "[]",
+    )
+
+
+def render_multilabel(template: str, row, extracted: dict) -> str:
+    return render(
+        template,
+        title_ru=extracted.get("main_event_ru") or "",
+        main_event_ru=extracted.get("main_event_ru") or "",
+        post_text=row["text"] or "",
+        external_urls_json=extracted.get("external_urls", []),
+    )
+
+
+def render_summary(template: str, row, extracted: dict) -> str:
+    return render(
+        template,
+        title_hint=extracted.get("main_event_ru") or "",
+        main_event_ru=extracted.get("main_event_ru") or "",
+        event_type=extracted.get("event_type") or "прочее",
+        post_text=row["text"] or "",
+        external_urls_json=extracted.get("external_urls", []),
+        signals_json=extracted.get("signals", {}),
+    )
+
+
+def attach_to_canonical(conn, canonical_id: int, row, links: list[tuple[int, str, str | None]]) -> None:
+    # New canonicals start dirty; after that a post only makes the summary stale when it brings a
+    # URL the canonical did not have or more text than any post already linked to it.
+    longest = conn.execute(db.LINKED_TEXT_LENGTH_QUERY, (canonical_id, row["id"])).fetchone()[0]
+    added = db.insert_canonical_links(conn, links)
+    dirty = added > 0 or (longest is not None and len(row["text"] or "") > longest)
+    hours_old = (datetime.utcnow() - datetime.fromisoformat(row["posted_at"])).total_seconds() / 3600
+    conn.execute(
         """
-        SELECT rm.*, s.weight FROM raw_messages rm
-        JOIN sources s ON s.id=rm.source_id
-        WHERE rm.canonical_news_id IS NULL
-        ORDER BY rm.posted_at DESC
+        UPDATE canonical_news
+        SET importance_score=MAX(importance_score,?), last_seen_at=?, raw_count=raw_count+1, summary_dirty=MAX(summary_dirty,?)
+        WHERE id=?
+        """,
+        (compute_importance(dict(row), row["weight"], hours_old), datetime.utcnow().isoformat(), int(dirty), canonical_id),
+    )
+
+
+def apply_llm_results(
+    conn,
+    row,
+    extracted: dict,
+    settings: AppSettings,
+    urls: list[str] | None = None,
+    scores: dict[int, float] | None = None,
+) -> int:
+    canonical_id = find_or_create_canonical(conn, extracted, row["text"] or "", settings, urls, scores)
+    conn.execute(
+        "UPDATE raw_messages SET canonical_news_id=?, dedup_status=?, process_stage=?, next_attempt_at=NULL, last_error=NULL WHERE id=?",
+        (canonical_id, "linked", "linked", row["id"]),
+    )
+    external = extracted.get("external_urls", [])
+    links = zip(normalize_urls(extracted_urls(extracted)), (link.get("domain") for link in external))
+    attach_to_canonical(conn, canonical_id, row, [(canonical_id, url, domain) for url, domain in links if url])
+    conn.execute(
+        "UPDATE canonical_news SET event_type=?, main_event_ru=? WHERE id=?",
+        (extracted.get("event_type"), extracted.get("main_event_ru"), canonical_id),
+    )
+    dedup.index_canonical(conn, canonical_id, extracted.get("main_event_ru"))
+    return canonical_id
+
+
+SUMMARY_MAX_POSTS = 5
+SUMMARY_MAX_CHARS = 6000
+SUMMARY_MAX_URLS = 10
+SUMMARY_PAGE_SIZE = 64
+
+
+def dirty_canonicals(conn, after: int = 0, limit: int | None = None) -> list:
+    return conn.execute(db.SUMMARY_DIRTY_QUERY, (after, limit or SUMMARY_PAGE_SIZE)).fetchall()
+
+
+def dirty_pages(conn, budget: Budget | None) -> Iterator[list[dict]]:
+    # Pages of summary sources, built one page at a time: each can carry SUMMARY_MAX_CHARS of
+    # text per canonical. Canonicals that fail stay dirty; the id cursor keeps them from coming
+    # back in the same run. The run's time budget is checked before every page.
+    after = 0
+    while not (budget and budget.expired()) and (page := dirty_canonicals(conn, after)):
+        after = page[-1]["id"]
+        yield [canonical_source(conn, c) for c in page]
+
+
+def canonical_source(conn, canonical) -> dict:
+    # A row-shaped view of a canonical for the label and summary prompts: the longest linked posts
+    # as the text, extraction signals from the longest one and every link the canonical has.
+    posts = conn.execute(
         """
+        SELECT text, permalink, extracted_json FROM raw_messages
+        WHERE canonical_news_id=? AND text IS NOT NULL
+        ORDER BY length(text) DESC, id
+        LIMIT ?
+        """,
+        (canonical["id"], SUMMARY_MAX_POSTS),
     ).fetchall()
+    texts = list(dict.fromkeys(p["text"] for p in posts))
+    extracted = json.loads(posts[0]["extracted_json"] or "{}") if posts else {}
+    links = conn.execute(
+        "SELECT normalized_url, domain FROM canonical_links WHERE canonical_news_id=? ORDER BY id LIMIT ?",
+        (canonical["id"], SUMMARY_MAX_URLS),
+    ).fetchall()
+    extracted.update(
+        main_event_ru=canonical["main_event_ru"] or extracted.get("main_event_ru"),
+        event_type=canonical["event_type"] or extracted.get("event_type"),
+        external_urls=[{"normalized_url": link["normalized_url"], "domain": link["domain"]} for link in links],
+    )
+    return {
+        "id": canonical["id"],
+        "text": "\n\n---\n\n".join(texts)[:SUMMARY_MAX_CHARS],
+        "permalink": posts[0]["permalink"] if posts else None,
+        "known_urls_json": "[]",
+        "extracted_json": json.dumps(extracted, ensure_ascii=False),
+        "classified_json": None,
+        "summary_json": None,
+    }
+
+
+def apply_summary(conn, canonical_id: int, cls: dict, summary: dict) -> None:
+    conn.execute(
+        """
+        UPDATE canonical_news
+        SET title_ru=COALESCE(?, title_ru), summary_bullets_json=?, why_important_ru=?, summary_dirty=0
+        WHERE id=?
+        """,
+        (summary.get("title_ru"), json.dumps(summary.get("bullets_ru", []), ensure_ascii=False), summary.get("why_important_ru"), canonical_id),
+    )
+    db.replace_labels(conn, canonical_id, cls.get("labels", []))
 
-    for row in rows:
-        extracted = llm.complete_json(
-            s_ext,
-            render(
-                u_ext,
-                post_text=row["text"] or "",
-                post_permalink=row["permalink"] or "",
-                known_urls_from_api_json=row["known_urls_json"] or "[]",
-            ),
-        )
-        canonical_id = find_or_create_canonical(conn, extracted, row["text"] or "", settings)
-        cls = llm.complete_json(
-            s_cls,
-            render(
-                u_cls,
-                title_ru=extracted.get("main_event_ru") or "",
-                main_event_ru=extracted.get("main_event_ru") or "",
-                post_text=row["text"] or "",
-                external_urls_json=extracted.get("external_urls", []),
-            ),
-        )
-        summary = llm.complete_json(
-            s_sum,
-            render(
-                u_sum,
-                title_hint=extracted.get("main_event_ru") or "",
-                main_event_ru=extracted.get("main_event_ru") or "",
-                event_type=extracted.get("event_type") or "прочее",
-                post_text=row["text"] or "",
-                external_urls_json=extracted.get("external_urls", []),
-                signals_json=extracted.get("signals", {}),
-            ),
-        )
 
-        hours_old = (datetime.utcnow() - datetime.fromisoformat(row["posted_at"])).total_seconds() / 3600
-        importance = compute_importance(dict(row), row["weight"], hours_old)
+CHECKPOINT_COLUMNS = {"extracted": "extracted_json", "classified": "classified_json", "summarized": "summary_json"}
+RETRY_MAX_SECONDS = 6 * 3600
 
-        conn.execute(
-            "UPDATE raw_messages SET canonical_news_id=?, dedup_status=? WHERE id=?",
-            (canonical_id, "linked", row["id"]),
+
+def load_checkpoints(row) -> dict[str, dict]:
+    return {stage: json.loads(row[column]) for stage, column in CHECKPOINT_COLUMNS.items() if row[column]}
+
+
+class ProgressWriter:
+    # Every write of a processing run goes through here: stage checkpoints, linked rows and
+    # failures. Commits land every `commit_every` finished rows, so a crash loses at most that
+    # many rows of linking work and never any LLM result that was already checkpointed.
+    def __init__(self, conn, settings: AppSettings, link_rows: bool = True):
+        self.conn = conn
+        self.settings = settings
+        # Without linking, rows stop after their last checkpoint and are linked later in bulk (backfill).
+        self.link_rows = link_rows
+        self.completed = 0
+        self.failed = 0
+        self._uncommitted = 0
+        # In-batch near-duplicates waiting for their leader's canonical, by leader row id.
+        self.followers: dict[int, list] = {}
+
+    def checkpoint(self, row_id: int, stage: str, value: dict) -> None:
+        self.conn.execute(
+            f"UPDATE raw_messages SET process_stage=?, {CHECKPOINT_COLUMNS[stage]}=? WHERE id=?",
+            (stage, json.dumps(value, ensure_ascii=False), row_id),
         )
-        for link in extracted.get("external_urls", []):
-            norm = normalize_url(link.get("normalized_url") or link.get("url") or "")
-            if norm:
-                conn.execute(
-                    "INSERT OR IGNORE INTO canonical_links(canonical_news_id, normalized_url, domain) VALUES(?,?,?)",
-                    (canonical_id, norm, link.get("domain")),
-                )
-        conn.execute(
+
+    def follow(self, leader_id: int, rows: list) -> None:
+        self.followers[leader_id] = rows
+
+    def link(self, item: tuple, **match) -> None:
+        if self.link_rows:
+            self.conn.execute("SAVEPOINT link_row")
+            try:
+                canonical_id = apply_llm_results(self.conn, *item, self.settings, **match)
+            except Exception as e:  # noqa: BLE001
+                self.conn.execute("ROLLBACK TO link_row")
+                self.conn.execute("RELEASE link_row")
+                self.fail(item[0], e)
+                return
+            self.conn.execute("RELEASE link_row")
+            for row in self.followers.pop(item[0]["id"], []):
+                self.prefiltered(row, "clustered", canonical_id, prefilter.message_urls(self.conn, row))
+        self.completed += 1
+        self._tick()
+
+    def prefiltered(self, row, status: str, canonical_id: int | None, urls: list[str]) -> None:
+        if canonical_id is None:
+            self.conn.execute("UPDATE raw_messages SET dedup_status=?, process_stage='skipped' WHERE id=?", (status, row["id"]))
+        else:
+            # Same outcome as a by_url match after extraction, minus the main_event_ru refresh.
+            self.conn.execute(
+                "UPDATE raw_messages SET canonical_news_id=?, dedup_status=?, process_stage='linked' WHERE id=?",
+                (canonical_id, status, row["id"]),
+            )
+            attach_to_canonical(self.conn, canonical_id, row, [(canonical_id, u, urlsplit(u).hostname) for u in urls])
+        self.completed += 1
+        self._tick()
+
+    def fail(self, row, error: Exception) -> None:
+        # Followers of a failed leader stay in the backlog and are clustered again next run.
+        self.followers.pop(row["id"], None)
+        attempts = row["process_attempts"] + 1
+        if attempts >= self.settings.process_max_attempts:
+            stage, next_attempt_at = "quarantined", None
+            stats.incr("process.quarantined")
+        else:
+            delay = min(self.settings.process_retry_base_seconds * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+            stage, next_attempt_at = None, (datetime.utcnow() + timedelta(seconds=delay)).isoformat()
+        logger.warning("Processing raw message %s failed (attempt %s): %s", row["id"], attempts, error)
+        self.conn.execute(
             """
-            UPDATE canonical_news
-            SET title_ru=?, summary_bullets_json=?, why_important_ru=?, labels_json=?, event_type=?, main_event_ru=?, importance_score=MAX(importance_score,?),
-                last_seen_at=?, raw_count=raw_count+1
+            UPDATE raw_messages SET process_stage=COALESCE(?, process_stage), process_attempts=?, next_attempt_at=?, last_error=?
             WHERE id=?
             """,
-            (
-                summary.get("title_ru"),
-                __import__("json").dumps(summary.get("bullets_ru", []), ensure_ascii=False),
-                summary.get("why_important_ru"),
-                __import__("json").dumps(cls.get("labels", []), ensure_ascii=False),
-                extracted.get("event_type"),
-                extracted.get("main_event_ru"),
-                importance,
-                datetime.utcnow().isoformat(),
-                canonical_id,
-            ),
+            (stage, attempts, next_attempt_at, str(error)[:1000], row["id"]),
         )
+        stats.incr("process.failed")
+        self.failed += 1
+        self._tick()
+
+    def _tick(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= self.settings.process_commit_every:
+            self.commit()
+
+    def commit(self) -> None:
+        with stats.timer("db.commit"):
+            self.conn.commit()
+        self._uncommitted = 0
+
+
+def requeue_quarantined(conn) -> int:
+    count = conn.execute(
+        "UPDATE raw_messages SET process_stage=NULL, process_attempts=0, next_attempt_at=NULL WHERE process_stage='quarantined'"
+    ).rowcount
     conn.commit()
-    return len(rows)
+    return count
 
 
-def build_digest_text(conn, period: str, settings: AppSettings) -> str:
-    rows = conn.execute(
-        "SELECT * FROM canonical_news ORDER BY importance_score DESC LIMIT ?",
-        (settings.max_items_per_digest,),
-    ).fetchall()
-    per_cat = defaultdict(int)
-    sections: dict[str, list[str]] = defaultdict(list)
-    for r in rows:
-        labels = __import__("json").loads(r["labels_json"] or "[]")
-        sorted_labels = sorted(labels, key=lambda x: x.get("confidence", 0), reverse=True)
-        best = sorted_labels[0]["label"] if sorted_labels else "FRAMEWORKS"
-        if per_cat[best] >= settings.max_items_per_category:
-            continue
-        per_cat[best] += 1
-        bullets = __import__("json").loads(r["summary_bullets_json"] or "[]")
-        tags = [x["label"] for x in sorted_labels[1:]]
-        body = f"• {r['title_ru']}" + (f" [теги: {', '.join(tags)}]" if tags else "")
-        for b in bullets[:6]:
-            body += f"\n  - {b}"
-        body += f"\n  Почему важно: {r['why_important_ru']}"
-        links = conn.execute("SELECT normalized_url FROM canonical_links WHERE canonical_news_id=? LIMIT 3", (r["id"],)).fetchall()
-        if links:
-            body += "\n  Источники: " + ", ".join(l["normalized_url"] for l in links)
-        sections[best].append(body)
+def requeue_skipped(conn, since: datetime) -> int:
+    # Prefilter decisions are final within a run; after its rules or thresholds change, rows it
+    # skipped go back through it (and, if they pass now, on to the LLM). Only posts since `since`:
+    # anything older would just swamp the backlog.
+    count = conn.execute(
+        "UPDATE raw_messages SET process_stage=NULL, dedup_status=NULL WHERE process_stage='skipped' AND posted_at >= ?",
+        (since.isoformat(),),
+    ).rowcount
+    conn.commit()
+    return count
+
+
+def complete_row(llm, prompts: dict, row, checkpoint: Callable[[int, str, dict], None]) -> tuple:
+    # Extraction is the only per-message stage; labels and summaries are made per canonical.
+    s_ext, u_ext = prompts["extraction"]
+    done = load_checkpoints(row)
+    if "extracted" not in done:
+        done["extracted"] = llm.complete_json(s_ext, render_extraction(u_ext, row), template=u_ext)
+        checkpoint(row["id"], "extracted", done["extracted"])
+    return row, done["extracted"]
+
+
+async def complete_row_async(llm, prompts: dict, row, checkpoint: Callable[[int, str, dict], None]) -> tuple:
+    s_ext, u_ext = prompts["extraction"]
+    done = load_checkpoints(row)
+    if "extracted" not in done:
+        done["extracted"] = await llm.complete_json(s_ext, render_extraction(u_ext, row), template=u_ext)
+        checkpoint(row["id"], "extracted", done["extracted"])
+    return row, done["extracted"]
 
+
+def complete_canonical(llm, prompts: dict, source: dict) -> tuple:
+    s_cls, u_cls = prompts["multilabel"]
+    s_sum, u_sum = prompts["summary"]
+    extracted = json.loads(source["extracted_json"])
+    cls = llm.complete_json(s_cls, render_multilabel(u_cls, source, extracted), template=u_cls)
+    summary = llm.complete_json(s_sum, render_summary(u_sum, source, extracted), template=u_sum)
+    return source, extracted, cls, summary
+
+
+async def complete_canonical_async(llm, prompts: dict, source: dict) -> tuple:
+    s_cls, u_cls = prompts["multilabel"]
+    s_sum, u_sum = prompts["summary"]
+    extracted = json.loads(source["extracted_json"])
+    cls, summary = await asyncio.gather(
+        llm.complete_json(s_cls, render_multilabel(u_cls, source, extracted), template=u_cls),
+        llm.complete_json(s_sum, render_summary(u_sum, source, extracted), template=u_sum),
+    )
+    return source, extracted, cls, summary
+
+
+def extraction_batch_item(row) -> dict:
+    return {
+        "id": str(row["id"]),
+        "post_text": row["text"] or "",
+        "post_permalink": row["permalink"] or "",
+        "known_urls_from_api": json.loads(row["known_urls_json"] or "[]"),
+    }
+
+
+def multilabel_batch_item(row, extracted: dict) -> dict:
+    return {
+        "id": str(row["id"]),
+        "title_ru": extracted.get("main_event_ru") or "",
+        "event_ru": extracted.get("main_event_ru") or "",
+        "raw_text": row["text"] or "",
+        "external_urls": extracted.get("external_urls", []),
+    }
+
+
+class PageState:
+    # Checkpointed results and per-row failures of one batched page. A failed fallback call
+    # drops only its own row from the later stages.
+    def __init__(self, page: list, checkpoint: Callable[[int, str, dict], None]):
+        self.by_id = {str(row["id"]): row for row in page}
+        self.done = {row_id: load_checkpoints(row) for row_id, row in self.by_id.items()}
+        self.failures: dict[str, Exception] = {}
+        self.checkpoint = checkpoint
+
+    def todo(self, stage: str) -> list:
+        return [row for row_id, row in self.by_id.items() if row_id not in self.failures and stage not in self.done[row_id]]
+
+    def record(self, stage: str, results: dict[str, dict | None]) -> None:
+        for row_id, value in results.items():
+            if value is not None and row_id not in self.failures:
+                self.done[row_id][stage] = value
+                self.checkpoint(int(row_id), stage, value)
+
+    def guard(self, call: Callable[[str], Any]) -> Callable[[str], Any]:
+        def guarded(row_id: str):
+            try:
+                return call(row_id)
+            except CircuitOpenError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.failures[row_id] = e
+                return None
+
+        return guarded
+
+    def guard_async(self, call: Callable[[str], Any]) -> Callable[[str], Any]:
+        async def guarded(row_id: str):
+            try:
+                return await call(row_id)
+            except CircuitOpenError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                self.failures[row_id] = e
+                return None
+
+        return guarded
+
+    def outcome(self, *stages: str) -> tuple[list[tuple], list[tuple]]:
+        items, failed = [], []
+        for row_id, row in self.by_id.items():
+            if row_id in self.failures:
+                failed.append((row, self.failures[row_id]))
+            else:
+                items.append((row, *(self.done[row_id][stage] for stage in stages)))
+        return items, failed
+
+
+def complete_page_batched(llm, prompts: dict, page: list, settings: AppSettings, checkpoint) -> tuple[list[tuple], list[tuple]]:
+    state = PageState(page, checkpoint)
+    s_ext, u_ext = prompts["extraction_batch"]
+    s_one_ext, u_one_ext = prompts["extraction"]
+    if todo := state.todo("extracted"):
+        state.record("extracted", batching.run_batched(
+            llm, s_ext, u_ext, "posts_json", [extraction_batch_item(r) for r in todo],
+            state.guard(lambda i: llm.complete_json(s_one_ext, render_extraction(u_one_ext, state.by_id[i]), template=u_one_ext)),
+            settings.llm_batch_token_budget, settings.llm_batch_size,
+        ))
+    return state.outcome("extracted")
+
+
+async def complete_page_batched_async(llm, prompts: dict, page: list, settings: AppSettings, checkpoint) -> tuple[list[tuple], list[tuple]]:
+    state = PageState(page, checkpoint)
+    s_ext, u_ext = prompts["extraction_batch"]
+    s_one_ext, u_one_ext = prompts["extraction"]
+    if todo := state.todo("extracted"):
+        state.record("extracted", await batching.run_batched_async(
+            llm, s_ext, u_ext, "posts_json", [extraction_batch_item(r) for r in todo],
+            state.guard_async(lambda i: llm.complete_json(s_one_ext, render_extraction(u_one_ext, state.by_id[i]), template=u_one_ext)),
+            settings.llm_batch_token_budget, settings.llm_batch_size,
+        ))
+    return state.outcome("extracted")
+
+
+def _no_checkpoint(*_: Any) -> None:
+    # Canonical summaries are rebuilt from scratch each time, so there is nothing to resume.
+    return None
+
+
+def complete_canonicals_batched(llm, prompts: dict, sources: list[dict], settings: AppSettings) -> tuple[list[tuple], list[tuple]]:
+    state = PageState(sources, _no_checkpoint)
+    s_cls, u_cls = prompts["multilabel_batch"]
+    s_one_cls, u_one_cls = prompts["multilabel"]
+    s_sum, u_sum = prompts["summary"]
+    if todo := state.todo("classified"):
+        state.record("classified", batching.run_batched(
+            llm, s_cls, u_cls, "items_json", [multilabel_batch_item(r, state.done[str(r["id"])]["extracted"]) for r in todo],
+            state.guard(lambda i: llm.complete_json(
+                s_one_cls, render_multilabel(u_one_cls, state.by_id[i], state.done[i]["extracted"]), template=u_one_cls
+            )),
+            settings.llm_batch_token_budget, settings.llm_batch_size,
+        ))
+    summarize = state.guard(lambda i: llm.complete_json(
+        s_sum, render_summary(u_sum, state.by_id[i], state.done[i]["extracted"]), template=u_sum
+    ))
+    state.record("summarized", {str(r["id"]): summarize(str(r["id"])) for r in state.todo("summarized")})
+    return state.outcome("extracted", "classified", "summarized")
+
+
+async def complete_canonicals_batched_async(
+    llm, prompts: dict, sources: list[dict], settings: AppSettings
+) -> tuple[list[tuple], list[tuple]]:
+    state = PageState(sources, _no_checkpoint)
+    s_cls, u_cls = prompts["multilabel_batch"]
+    s_one_cls, u_one_cls = prompts["multilabel"]
+    s_sum, u_sum = prompts["summary"]
+
+    async def classify() -> None:
+        if todo := state.todo("classified"):
+            state.record("classified", await batching.run_batched_async(
+                llm, s_cls, u_cls, "items_json", [multilabel_batch_item(r, state.done[str(r["id"])]["extracted"]) for r in todo],
+                state.guard_async(lambda i: llm.complete_json(
+                    s_one_cls, render_multilabel(u_one_cls, state.by_id[i], state.done[i]["extracted"]), template=u_one_cls
+                )),
+                settings.llm_batch_token_budget, settings.llm_batch_size,
+            ))
+
+    async def summarize() -> None:
+        todo = [str(r["id"]) for r in state.todo("summarized")]
+        call = state.guard_async(lambda i: llm.complete_json(
+            s_sum, render_summary(u_sum, state.by_id[i], state.done[i]["extracted"]), template=u_sum
+        ))
+        state.record("summarized", dict(zip(todo, await asyncio.gather(*(call(i) for i in todo)))))
+
+    await asyncio.gather(classify(), summarize())
+    return state.outcome("extracted", "classified", "summarized")
+
+
+def record_summaries(conn, items: list[tuple], failed: list[tuple]) -> None:
+    for source, _, cls, summary in items:
+        apply_summary(conn, source["id"], cls, summary)
+    for source, error in failed:
+        # Stays dirty and is retried at the end of the next run.
+        logger.warning("Summarizing canonical %s failed: %s", source["id"], error)
+        stats.incr("summary.failed")
+    stats.incr("summary.canonicals", len(items))
+    conn.commit()
+
+
+def summarize_dirty(conn, llm, prompts: dict, settings: AppSettings, budget: Budget | None = None) -> int:
+    done = 0
+    with stats.timer("process.summarize"):
+        for sources in dirty_pages(conn, budget):
+            for unit in _pages(sources, max(1, settings.llm_batch_size)):
+                if budget and budget.expired():
+                    return done
+                if settings.llm_batch_size > 1:
+                    items, failed = complete_canonicals_batched(llm, prompts, unit, settings)
+                else:
+                    items, failed = [], []
+                    try:
+                        items.append(complete_canonical(llm, prompts, unit[0]))
+                    except CircuitOpenError:
+                        raise
+                    except Exception as e:  # noqa: BLE001
+                        failed.append((unit[0], e))
+                record_summaries(conn, items, failed)
+                done += len(items)
+    return done
+
+
+async def summarize_dirty_async(conn, llm, prompts: dict, settings: AppSettings, budget: Budget | None = None) -> int:
+    async def one(source: dict) -> tuple[list[tuple], list[tuple]]:
+        try:
+            return [await complete_canonical_async(llm, prompts, source)], []
+        except CircuitOpenError:
+            raise
+        except Exception as e:  # noqa: BLE001
+            return [], [(source, e)]
+
+    done = 0
+    with stats.timer("process.summarize"):
+        for sources in dirty_pages(conn, budget):
+            if settings.llm_batch_size > 1:
+                units = [complete_canonicals_batched_async(llm, prompts, p, settings) for p in _pages(sources, settings.llm_batch_size)]
+            else:
+                units = [one(source) for source in sources]
+            # The client caps in-flight requests; each unit is written as soon as it is back, so
+            # an open circuit only loses the units still in flight.
+            tasks = [asyncio.ensure_future(unit) for unit in units]
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    items, failed = await finished
+                    record_summaries(conn, items, failed)
+                    done += len(items)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+    return done
+
+
+def paused(error: CircuitOpenError) -> None:
+    # Rows that didn't get through keep their checkpoints and attempt counters; the next
+    # cycle picks them up once the endpoint is back.
+    logger.warning("Processing paused: %s", error)
+    stats.incr("process.paused")
+
+
+def process_budget(settings: AppSettings, max_items: int | None, time_budget: float | None) -> Budget:
+    return Budget(
+        settings.process_max_items if max_items is None else max_items,
+        settings.process_time_budget_seconds if time_budget is None else time_budget,
+    )
+
+
+def _pages(rows: list, size: int) -> list[list]:
+    return [rows[i : i + size] for i in range(0, len(rows), size)]
+
+
+def process_new_messages(
+    conn,
+    settings: AppSettings,
+    cache: LLMCache | None = None,
+    since: datetime | None = None,
+    link: bool = True,
+    max_items: int | None = None,
+    time_budget: float | None = None,
+) -> int:
+    owned_cache = cache is None
+    cache = cache or open_llm_cache(settings)
+    limiter, breaker = limits_for(settings)
+    llm = OpenAICompatClient(
+        settings.openai_base_url, settings.openai_api_key, settings.openai_model, cache=cache, limiter=limiter, breaker=breaker
+    )
+    prompts = load_pipeline_prompts()
+    db.convert_json_columns(conn)
+    dedup.index_missing(conn)
+    dedup.backfill_fingerprints(conn)
+
+    budget = process_budget(settings, max_items, time_budget)
+    batched = settings.llm_batch_size > 1
+    progress = ProgressWriter(conn, settings, link)
+    try:
+        for rows in backlog_pages(conn, settings, since, budget):
+            rows = prefilter_rows(conn, rows, settings, progress.prefiltered)
+            if link:
+                rows = cluster_rows(rows, settings, progress.follow)
+            for unit in _pages(rows, settings.llm_batch_size) if batched else rows:
+                if budget.expired():
+                    break
+                if batched:
+                    items, failed = complete_page_batched(llm, prompts, unit, settings, progress.checkpoint)
+                    for item in items:
+                        progress.link(item)
+                    for row, error in failed:
+                        progress.fail(row, error)
+                    continue
+                try:
+                    item = complete_row(llm, prompts, unit, progress.checkpoint)
+                except CircuitOpenError:
+                    raise
+                except Exception as e:  # noqa: BLE001
+                    progress.fail(unit, e)
+                    continue
+                progress.link(item)
+            progress.commit()
+        if link:
+            # Once per run, after every row is linked, so a story reposted N times costs one summary.
+            summarize_dirty(conn, llm, prompts, settings, budget)
+            refresh_digest_candidates(conn, settings)
+    except CircuitOpenError as e:
+        paused(e)
+    finally:
+        llm.close()
+        if owned_cache and cache:
+            cache.close()
+        progress.commit()
+    return progress.completed
+
+
+async def process_new_messages_async(
+    conn,
+    settings: AppSettings,
+    concurrency: int | None = None,
+    cache: LLMCache | None = None,
+    since: datetime | None = None,
+    link: bool = True,
+    max_items: int | None = None,
+    time_budget: float | None = None,
+) -> int:
+    owned_cache = cache is None
+    cache = cache or open_llm_cache(settings)
+    limit = max(1, concurrency or settings.llm_concurrency)
+    prompts = load_pipeline_prompts()
+    # Chunk by chunk with the loop released in between, so moderation callbacks keep running.
+    for _ in db.convert_json_chunks(conn):
+        await asyncio.sleep(0)
+    dedup.index_missing(conn)
+    dedup.backfill_fingerprints(conn)
+
+    budget = process_budget(settings, max_items, time_budget)
+    batched = settings.llm_batch_size > 1
+    # Bounded, so only a couple of units per worker are read ahead of the LLM calls.
+    pending: asyncio.Queue = asyncio.Queue(maxsize=limit * 2)
+    results: asyncio.Queue = asyncio.Queue()
+    progress = ProgressWriter(conn, settings, link)
+
+    def checkpoint(row_id: int, stage: str, value: dict) -> None:
+        results.put_nowait((progress.checkpoint, (row_id, stage, value)))
+
+    def prefiltered(row, *decision) -> None:
+        results.put_nowait((progress.prefiltered, (row, *decision)))
+
+    async def producer() -> None:
+        for rows in backlog_pages(conn, settings, since, budget):
+            rows = prefilter_rows(conn, rows, settings, prefiltered)
+            if link:
+                # Registered before the leader is queued, so its link job always finds them.
+                rows = cluster_rows(rows, settings, progress.follow)
+            for unit in _pages(rows, settings.llm_batch_size) if batched else rows:
+                if budget.expired():
+                    break
+                await pending.put(unit)
+        for _ in range(limit):
+            await pending.put(None)
+
+    async def worker(llm: AsyncOpenAICompatClient) -> None:
+        while (unit := await pending.get()) is not None:
+            if budget.expired():
+                continue
+            if batched:
+                items, failed = await complete_page_batched_async(llm, prompts, unit, settings, checkpoint)
+                for item in items:
+                    await results.put((progress.link, (item,)))
+                for row, error in failed:
+                    await results.put((progress.fail, (row, error)))
+                continue
+            try:
+                await results.put((progress.link, (await complete_row_async(llm, prompts, unit, checkpoint),)))
+            except CircuitOpenError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                await results.put((progress.fail, (unit, e)))
+
+    async def writer() -> None:
+        # The only coroutine touching the connection while workers run, so SQLite sees one writer.
+        while (job := await results.get()) is not None:
+            fn, args = job
+            fn(*args)
+
+    limiter, breaker = limits_for(settings)
+    try:
+        async with AsyncOpenAICompatClient(
+            settings.openai_base_url,
+            settings.openai_api_key,
+            settings.openai_model,
+            max_concurrency=limit,
+            cache=cache,
+            limiter=limiter,
+            breaker=breaker,
+        ) as llm:
+            writer_task = asyncio.create_task(writer())
+            workers = [asyncio.create_task(producer())] + [asyncio.create_task(worker(llm)) for _ in range(limit)]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+            finally:
+                await results.put(None)
+                await writer_task
+            if link:
+                progress.commit()
+                await summarize_dirty_async(conn, llm, prompts, settings, budget)
+                refresh_digest_candidates(conn, settings)
+    except CircuitOpenError as e:
+        paused(e)
+    finally:
+        if owned_cache and cache:
+            cache.close()
+        progress.commit()
+    return progress.completed
+
+
+def regenerate_summaries(conn, settings: AppSettings, cache: LLMCache | None = None) -> int:
+    # Summaries for canonicals linked outside process_new_messages (backfill's bulk linking).
+    owned_cache = cache is None
+    cache = cache or open_llm_cache(settings)
+    limiter, breaker = limits_for(settings)
+    llm = OpenAICompatClient(
+        settings.openai_base_url, settings.openai_api_key, settings.openai_model, cache=cache, limiter=limiter, breaker=breaker
+    )
+    try:
+        return summarize_dirty(conn, llm, load_pipeline_prompts(), settings)
+    except CircuitOpenError as e:
+        paused(e)
+        return 0
+    finally:
+        llm.close()
+        if owned_cache and cache:
+            cache.close()
+
+
+DIGEST_LINKS_PER_ITEM = 3
+DEFAULT_CATEGORY = "FRAMEWORKS"
+
+
+def digest_item(r) -> dict:
+    if r["labels"]:
+        labels = r["labels"].split("\n")
+    else:
+        # Not converted to canonical_labels yet (db.convert_json_columns); same order as SQL gives.
+        legacy = json.loads(r["labels_json"] or "[]")
+        labels = [x["label"] for x in sorted(legacy, key=lambda x: x.get("confidence") or 0, reverse=True)]
+    return {
+        "id": r["id"],
+        "category": labels[0] if labels else DEFAULT_CATEGORY,
+        "tags": labels[1:],
+        "title_ru": r["title_ru"],
+        "bullets": json.loads(r["summary_bullets_json"] or "[]"),
+        "why_important_ru": r["why_important_ru"],
+        "importance_score": r["importance_score"],
+        "links": r["links"].split("\n") if r["links"] else [],
+    }
+
+
+def refresh_digest_candidates(conn, settings: AppSettings, now: datetime | None = None) -> int:
+    # Re-renders the canonicals marked digest_dirty (by triggers on every write that can change
+    # an item) inside the digest window; dirty ones outside it just lose their candidate, as do
+    # candidates that aged out of the window since the last refresh.
+    since = ((now or datetime.utcnow()) - timedelta(hours=settings.digest_window_hours)).isoformat()
+    with stats.timer("digest.refresh"):
+        # Take the write lock before reading the flags: another connection (a CLI `process` next
+        # to the daemon) could otherwise mark a canonical between the read and the clear below,
+        # and that change would never be rendered. An open write transaction already holds it.
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(db.DIGEST_DIRTY_QUERY, (DIGEST_LINKS_PER_ITEM, since)).fetchall()
+        candidates = []
+        for r in rows:
+            item = digest_item(r)
+            candidates.append(
+                (
+                    r["id"],
+                    item["category"],
+                    item["importance_score"],
+                    r["last_seen_at"],
+                    json.dumps(item, ensure_ascii=False),
+                    render_digest_item(item, "preview"),
+                    render_digest_item(item, "publish"),
+                )
+            )
+        conn.execute("DELETE FROM digest_candidates WHERE canonical_news_id IN (SELECT id FROM canonical_news WHERE digest_dirty=1)")
+        conn.executemany(
+            """
+            INSERT INTO digest_candidates(
+              canonical_news_id, category, importance_score, last_seen_at, item_json, preview_block, publish_block
+            ) VALUES(?,?,?,?,?,?,?)
+            """,
+            candidates,
+        )
+        conn.execute("UPDATE canonical_news SET digest_dirty=0 WHERE digest_dirty=1")
+        conn.execute("DELETE FROM digest_candidates WHERE last_seen_at < ?", (since,))
+        conn.commit()
+    stats.incr("digest.rendered", len(candidates))
+    return len(candidates)
+
+
+def select_digest_items(conn, settings: AppSettings, now: datetime | None = None) -> list[dict]:
+    # A bounded read of digest_candidates: the top MAX_ITEMS_PER_CATEGORY of every category in
+    # the period window, best first, with each item's blocks already rendered. Callers refresh
+    # the candidates on a writable connection first (refresh_digest_candidates).
+    since = ((now or datetime.utcnow()) - timedelta(hours=settings.digest_window_hours)).isoformat()
+    rows = conn.execute(db.DIGEST_SELECTION_QUERY, (since, settings.max_items_per_category, settings.max_items_per_digest)).fetchall()
+    return [
+        {**json.loads(r["item_json"]), "blocks": {"preview": r["preview_block"], "publish": r["publish_block"]}} for r in rows
+    ]
+
+
+def render_digest_item(item: dict, variant: str = "publish") -> str:
+    body = f"• {item['title_ru']}" + (f" [теги: {', '.join(item['tags'])}]" if item["tags"] else "")
+    if variant == "preview":
+        body += f" (#{item['id']}, score {item['importance_score']:.1f})"
+    for b in item["bullets"][:6]:
+        body += f"\n  - {b}"
+    body += f"\n  Почему важно: {item['why_important_ru']}"
+    if item["links"]:
+        body += "\n  Источники: " + ", ".join(item["links"])
+    return body
+
+
+def render_digest(items: list[dict], period: str, variant: str = "publish") -> str:
+    sections: dict[str, list[str]] = defaultdict(list)
+    for item in items:
+        sections[item["category"]].append(item.get("blocks", {}).get(variant) or render_digest_item(item, variant))
     title = "Утренний" if period == "morning" else "Вечерний"
     text = [f"{title} AI-дайджест", ""]
     for cat in LABELS:
@@ -159,3 +1000,14 @@ def build_digest_text(conn, period: str, settings: AppSettings) -> str:
             text.extend(sections[cat])
             text.append("")
     return "\n".join(text).strip()
+
+
+def build_digest_texts(conn, period: str, settings: AppSettings) -> tuple[str, str]:
+    with stats.timer("digest.build"):
+        items = select_digest_items(conn, settings)
+        return render_digest(items, period, "preview"), render_digest(items, period, "publish")
+
+
+def build_digest_text(conn, period: str, settings: AppSettings, variant: str = "publish") -> str:
+    with stats.timer("digest.build"):
+        return render_digest(select_digest_items(conn, settings), period, variant)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import re
+
+from ai_tg_digest import db, stats
+from ai_tg_digest.config import AppSettings
+
+# Stems match at a word start ("модел" covers модель/модели), short tokens only as whole words.
+KEYWORD_RE = re.compile(
+    r"\b(?:ai|ии|ml|llm\w*|gpt\w*|rag|nlp|cv|agi|sota|api)\b"
+    r"|\b(?:нейросет|нейрон|модел|model|агент|agent|датасет|dataset|обучен|train|fine-?tun|файнтюн|инференс|inference"
+    r"|бенчмарк|benchmark|трансформер|transformer|diffusion|диффуз|эмбеддинг|embedding|вектор|vector|open.?source"
+    r"|релиз|release|стать|paper|arxiv|github|hugging|pytorch|openai|anthropic|claude|gemini|llama|mistral|deepseek|qwen"
+    r"|машинн|machine learning|deep learning|генератив|generative|промпт|prompt)",
+    re.I,
+)
+AD_RE = re.compile(r"#реклама|#промо|#ad\b|\berid\b|промокод", re.I)
+FULL_LENGTH = 300
+
+
+def message_urls(conn, row) -> list[str]:
+    # Normalized once at ingest (db.insert_raw_messages) instead of on every prefilter pass.
+    return [r[0] for r in conn.execute("SELECT normalized_url FROM raw_message_urls WHERE raw_message_id=? ORDER BY id", (row["id"],))]
+
+
+def url_duplicate(conn, row) -> int | None:
+    found = conn.execute(db.MESSAGE_URL_DEDUP_QUERY, (row["id"],)).fetchone()
+    return found[0] if found else None
+
+
+def relevance(text: str, has_urls: bool) -> float:
+    length = min(1.0, len(text.strip()) / FULL_LENGTH)
+    keywords = min(1.0, len(KEYWORD_RE.findall(text)) / 2)
+    return 0.4 * length + 0.4 * keywords + 0.2 * has_urls
+
+
+def min_score(settings: AppSettings, source_type: str) -> float:
+    return settings.prefilter_min_score_group if source_type == "group" else settings.prefilter_min_score_channel
+
+
+def decide(conn, row, settings: AppSettings) -> tuple[str, int | None, list[str]] | None:
+    # (dedup_status, canonical id to link to or None to skip, normalized urls); None sends the
+    # row to the LLM. Rows that already have checkpoints were accepted on an earlier run.
+    if not settings.prefilter_enabled or row["process_stage"] is not None:
+        return None
+    urls = message_urls(conn, row)
+    if urls and (canonical_id := url_duplicate(conn, row)):
+        stats.incr("prefilter.url_duplicate")
+        return "url_duplicate", canonical_id, urls
+    text = row["text"] or ""
+    if AD_RE.search(text):
+        stats.incr("prefilter.ad")
+        return "skipped_ad", None, urls
+    if relevance(text, bool(urls)) < min_score(settings, row["source_type"]):
+        stats.incr("prefilter.offtopic")
+        return "skipped_offtopic", None, urls
+    return None
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Callable
+
+from ai_tg_digest.config import AppSettings
+
+MIN_RATE_FACTOR = 0.1
+RATE_RECOVERY_STEP = 0.05
+
+
+class CircuitOpenError(Exception):
+    # Deliberately not a RuntimeError: callers that treat RuntimeError as "this item failed"
+    # must let this one through so the whole stage pauses instead.
+    def __init__(self, retry_in: float):
+        super().__init__(f"LLM circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, now: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        # Takes the amount right away (the balance may go negative) and returns how long the
+        # caller has to wait for the balance to be paid back.
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        self.tokens -= amount
+
+
+class RateLimiter:
+    # Requests/min and tokens/min buckets. Token reservations use an estimate of the prompt and
+    # are corrected with the real `usage` once the response arrives. A 429/5xx halves the
+    # effective rate and pauses every caller; each success wins a little of the rate back.
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        now = clock()
+        self.rpm, self.tpm = rpm, tpm
+        self.requests = TokenBucket(rpm, now) if rpm else None
+        self.tokens = TokenBucket(tpm, now) if tpm else None
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _set_factor(self, factor: float) -> None:
+        self.factor = factor
+        if self.requests:
+            self.requests.rate = self.rpm * factor / 60
+        if self.tokens:
+            self.tokens.rate = self.tpm * factor / 60
+
+    def reserve(self, estimated_tokens: int) -> float:
+        with self._lock:
+            now = self.clock()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(estimated_tokens, now))
+            return wait
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int | None) -> None:
+        with self._lock:
+            if self.tokens and actual_tokens is not None:
+                self.tokens.adjust(actual_tokens - estimated_tokens)
+            if self.factor < 1.0:
+                self._set_factor(min(1.0, self.factor + RATE_RECOVERY_STEP))
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        with self._lock:
+            self._set_factor(max(MIN_RATE_FACTOR, self.factor / 2))
+            if retry_after is None:
+                retry_after = min(self.backoff_max, self.backoff_base * 2**attempt) * random.uniform(0.5, 1.0)
+            self.paused_until = max(self.paused_until, self.clock() + retry_after)
+            return retry_after
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failed attempts and rejects calls for
+    # `cooldown` seconds; after that the next call is let through as a probe.
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 120.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    def check(self) -> None:
+        if self.opened_at is not None and (remaining := self.opened_at + self.cooldown - self.clock()) > 0:
+            raise CircuitOpenError(remaining)
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failure_threshold and self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+
+
+_registry: dict[tuple[str, str], tuple[RateLimiter, CircuitBreaker]] = {}
+
+
+def limits_for(settings: AppSettings) -> tuple[RateLimiter, CircuitBreaker]:
+    # One limiter/breaker pair per endpoint and model for the life of the process, so quotas and
+    # an open circuit carry over between daemon cycles and between sync and async clients.
+    key = (settings.openai_base_url, settings.openai_model)
+    if key not in _registry:
+        _registry[key] = (
+            RateLimiter(settings.llm_rpm, settings.llm_tpm, settings.llm_backoff_base_seconds, settings.llm_backoff_max_seconds),
+            CircuitBreaker(settings.llm_circuit_failures, settings.llm_circuit_cooldown_seconds),
+        )
+    return _registry[key]
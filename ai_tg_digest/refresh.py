@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from ai_tg_digest import db, stats
+from ai_tg_digest.config import AppSettings
+from ai_tg_digest.ingest import message_metrics
+from ai_tg_digest.pipeline import compute_importance
+
+logger = logging.getLogger(__name__)
+
+METRIC_FIELDS = ("views", "forwards", "reactions_count", "comments_count")
+GET_MESSAGES_CHUNK = 100
+
+
+def select_refresh_targets(conn, settings: AppSettings, now: datetime) -> list:
+    since = (now - timedelta(hours=settings.metrics_refresh_window_hours)).isoformat()
+    return conn.execute(
+        db.METRICS_REFRESH_QUERY,
+        (since, settings.metrics_refresh_max_requests * GET_MESSAGES_CHUNK),
+    ).fetchall()
+
+
+def plan_requests(rows: list, max_requests: int) -> list[tuple[str, list]]:
+    # Rows arrive least-recently-refreshed first; group them per source into get_messages
+    # id lists and keep the highest-priority requests that fit the budget.
+    by_source: dict[str, list] = defaultdict(list)
+    for row in rows:
+        by_source[row["id_or_username"]].append(row)
+    requests = [
+        (entity, chunk[i : i + GET_MESSAGES_CHUNK])
+        for entity, chunk in by_source.items()
+        for i in range(0, len(chunk), GET_MESSAGES_CHUNK)
+    ]
+    return requests[:max_requests]
+
+
+def apply_refresh(conn, changed: list[tuple], polled_ids: list[int], now: datetime) -> int:
+    conn.executemany(
+        "UPDATE raw_messages SET views=?, forwards=?, reactions_count=?, comments_count=? WHERE id=?",
+        [(*(metrics[f] for f in METRIC_FIELDS), row["id"]) for row, metrics in changed],
+    )
+    conn.executemany("UPDATE raw_messages SET metrics_refreshed_at=? WHERE id=?", [(now.isoformat(), i) for i in polled_ids])
+    scores: dict[int, float] = {}
+    for row, metrics in changed:
+        if not row["canonical_news_id"]:
+            continue
+        hours_old = (now - datetime.fromisoformat(row["posted_at"])).total_seconds() / 3600
+        score = compute_importance(metrics, row["weight"], hours_old)
+        scores[row["canonical_news_id"]] = max(score, scores.get(row["canonical_news_id"], 0.0))
+    conn.executemany(
+        "UPDATE canonical_news SET importance_score=MAX(importance_score, ?) WHERE id=?",
+        [(score, canonical_id) for canonical_id, score in scores.items()],
+    )
+    conn.commit()
+    return len(scores)
+
+
+async def refresh_engagement(conn, settings: AppSettings, client: TelegramClient | None = None) -> dict[str, int]:
+    if client is None:
+        async with TelegramClient(settings.tg_session, settings.tg_api_id, settings.tg_api_hash) as client:
+            return await refresh_engagement(conn, settings, client)
+
+    now = datetime.utcnow()
+    deadline = time.monotonic() + settings.metrics_refresh_time_budget_seconds
+    requests = plan_requests(select_refresh_targets(conn, settings, now), settings.metrics_refresh_max_requests)
+    changed: list[tuple] = []
+    polled: list[int] = []
+    sent = 0
+    for entity, chunk in requests:
+        if time.monotonic() > deadline:
+            break
+        try:
+            messages = await client.get_messages(entity, ids=[r["tg_message_id"] for r in chunk])
+        except FloodWaitError as e:
+            logger.warning("FloodWait %ss during metrics refresh, stopping this cycle", e.seconds)
+            break
+        sent += 1
+        by_id = {m.id: m for m in messages if m is not None}
+        for row in chunk:
+            polled.append(row["id"])
+            msg = by_id.get(row["tg_message_id"])
+            if msg is None:
+                continue
+            metrics = message_metrics(msg)
+            if any(metrics[f] != row[f] for f in METRIC_FIELDS):
+                changed.append((row, metrics))
+    rescored = apply_refresh(conn, changed, polled, now)
+    result = {"requests": sent, "polled": len(polled), "changed": len(changed), "rescored": rescored}
+    for name, value in result.items():
+        stats.incr(f"refresh.{name}", value)
+    return result
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import logging
+import re
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from ai_tg_digest import db, stats
+from ai_tg_digest.config import AppSettings
+
+logger = logging.getLogger(__name__)
+
+# Bulky text columns are stored zlib-compressed in the archives; read them back with unzip().
+COMPRESSED_COLUMNS = {
+    "text",
+    "known_urls_json",
+    "extracted_json",
+    "classified_json",
+    "summary_json",
+    "summary_bullets_json",
+    "labels_json",
+    "metadata_json",
+    "norm_text",
+}
+CANONICAL_CHILDREN = ("canonical_links", "canonical_labels", "canonical_lsh", "canonical_minhash", "digest_candidates")
+ARCHIVE_NAME_RE = re.compile(r"^(\d{4})-(\d{2})\.db$")
+
+
+def zip_text(value):
+    return zlib.compress(value.encode("utf-8"), 6) if isinstance(value, str) else value
+
+
+def unzip(value):
+    return zlib.decompress(value).decode("utf-8") if isinstance(value, bytes) else value
+
+
+def archive_path(settings: AppSettings, month: str) -> Path:
+    return Path(settings.archive_dir) / f"{month}.db"
+
+
+def horizon(settings: AppSettings, now: datetime | None = None) -> str:
+    # Never archive anything dedup or the digest can still look at.
+    days = max(settings.retention_days, settings.dedup_window_days + 1, settings.digest_window_hours / 24 + 1)
+    return ((now or datetime.utcnow()) - timedelta(days=days)).isoformat()
+
+
+def _columns(conn, table: str, schema: str = "main") -> list[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _prepare_archive_table(conn, table: str) -> list[str]:
+    columns = _columns(conn, table)
+    if not _columns(conn, table, "archive"):
+        conn.execute(f"CREATE TABLE archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+        conn.execute(f"CREATE UNIQUE INDEX archive.idx_{table}_id ON {table}(id)")
+    # Hot tables keep gaining columns through migrations; older archives catch up here.
+    for column in set(columns) - set(_columns(conn, table, "archive")):
+        conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column}")
+    return columns
+
+
+def _copy(conn, table: str, where: str, params: tuple) -> int:
+    columns = _prepare_archive_table(conn, table)
+    select = ", ".join(f"zip_text({c})" if c in COMPRESSED_COLUMNS else c for c in columns)
+    # OR REPLACE makes a rerun after a crash between the archive and the hot-DB commit harmless.
+    cur = conn.execute(
+        f"INSERT OR REPLACE INTO archive.{table}({', '.join(columns)}) SELECT {select} FROM main.{table} WHERE {where}", params
+    )
+    return cur.rowcount
+
+
+def _month_bounds(month: str, limit: str) -> tuple[str, str]:
+    year, mon = (int(x) for x in month.split("-"))
+    following = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+    return month, min(following, limit)
+
+
+def _attach(conn, path: Path) -> None:
+    conn.commit()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS archive", (str(path),))
+
+
+def _detach(conn) -> None:
+    conn.commit()
+    conn.execute("DETACH DATABASE archive")
+
+
+def archive_raw_messages(conn, settings: AppSettings, before: str) -> int:
+    moved = 0
+    months = [r[0] for r in conn.execute("SELECT DISTINCT substr(posted_at, 1, 7) FROM raw_messages WHERE posted_at < ?", (before,))]
+    for month in months:
+        start, end = _month_bounds(month, before)
+        _attach(conn, archive_path(settings, month))
+        try:
+            moved += _copy(conn, "raw_messages", "posted_at >= ? AND posted_at < ?", (start, end))
+            # The archive keeps known_urls_json; the normalized URLs only serve hot-DB dedup.
+            conn.execute(
+                "DELETE FROM raw_message_urls WHERE raw_message_id IN (SELECT id FROM raw_messages WHERE posted_at >= ? AND posted_at < ?)",
+                (start, end),
+            )
+            conn.execute("DELETE FROM raw_messages WHERE posted_at >= ? AND posted_at < ?", (start, end))
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _detach(conn)
+    return moved
+
+
+def archive_canonicals(conn, settings: AppSettings, before: str) -> int:
+    # A canonical leaves once it is past the horizon and no hot raw message points at it any more.
+    conn.execute("DROP TABLE IF EXISTS temp.retired")
+    conn.execute(
+        """
+        CREATE TEMP TABLE retired AS
+        SELECT id, substr(last_seen_at, 1, 7) AS month FROM canonical_news c
+        WHERE last_seen_at < ? AND NOT EXISTS (SELECT 1 FROM raw_messages rm WHERE rm.canonical_news_id=c.id)
+        """,
+        (before,),
+    )
+    moved = 0
+    for (month,) in conn.execute("SELECT DISTINCT month FROM temp.retired").fetchall():
+        _attach(conn, archive_path(settings, month))
+        try:
+            ids = "SELECT id FROM temp.retired WHERE month=?"
+            moved += _copy(conn, "canonical_news", f"id IN ({ids})", (month,))
+            _copy(conn, "canonical_links", f"canonical_news_id IN ({ids})", (month,))
+            _copy(conn, "canonical_labels", f"canonical_news_id IN ({ids})", (month,))
+            for table in CANONICAL_CHILDREN:
+                conn.execute(f"DELETE FROM {table} WHERE canonical_news_id IN ({ids})", (month,))
+            conn.execute(f"DELETE FROM canonical_news WHERE id IN ({ids})", (month,))
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _detach(conn)
+    conn.execute("DROP TABLE temp.retired")
+    return moved
+
+
+def prune_orphans(conn) -> int:
+    pruned = 0
+    for table in CANONICAL_CHILDREN:
+        pruned += conn.execute(f"DELETE FROM {table} WHERE canonical_news_id NOT IN (SELECT id FROM canonical_news)").rowcount
+    pruned += conn.execute("DELETE FROM raw_message_urls WHERE raw_message_id NOT IN (SELECT id FROM raw_messages)").rowcount
+    conn.commit()
+    return pruned
+
+
+def incremental_vacuum(conn, pages: int) -> int:
+    # Only reclaims space once the file is in auto_vacuum=INCREMENTAL mode (new databases are;
+    # older ones switch on the next `aidigest db compact`).
+    # executescript steps the pragma to completion; a plain execute() frees a single page.
+    free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});" if pages else "PRAGMA incremental_vacuum;")
+    return free_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def run_retention(conn, settings: AppSettings, now: datetime | None = None) -> dict[str, int]:
+    result = {"raw_messages": 0, "canonical_news": 0, "runs": 0}
+    conn.create_function("zip_text", 1, zip_text, deterministic=True)
+    if settings.retention_days:
+        before = horizon(settings, now)
+        with stats.timer("retention.archive"):
+            result["raw_messages"] = archive_raw_messages(conn, settings, before)
+            result["canonical_news"] = archive_canonicals(conn, settings, before)
+        result["runs"] = stats.prune_runs(conn, before)
+    result["orphans"] = prune_orphans(conn)
+    with stats.timer("retention.vacuum"):
+        result["freed_pages"] = incremental_vacuum(conn, settings.retention_vacuum_pages)
+    for name, value in result.items():
+        stats.incr(f"retention.{name}", value)
+    logger.info("Retention: %s", result)
+    return result
+
+
+def compact(conn) -> tuple[int, int]:
+    # Full rewrite: switches older files to incremental auto_vacuum and defragments tables.
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    before = conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("PRAGMA optimize")
+    return before, conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+
+
+def open_archives(settings: AppSettings):
+    # Read-only connection to the hot DB with every monthly archive attached as archive_YYYY_MM.
+    conn = db.connect_readonly(settings.db_path)
+    conn.create_function("unzip", 1, unzip, deterministic=True)
+    for path in sorted(Path(settings.archive_dir).glob("*.db")):
+        if match := ARCHIVE_NAME_RE.match(path.name):
+            conn.execute(f"ATTACH DATABASE ? AS archive_{match[1]}_{match[2]}", (f"{path.resolve().as_uri()}?mode=ro",))
+    return conn
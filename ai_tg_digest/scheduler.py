@@ -1,35 +1,122 @@
 from __future__ import annotations
 
 import asyncio
+import logging
+import signal
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
 
-from apscheduler.schedulers.blocking import BlockingScheduler
+from telethon import TelegramClient
 
-from ai_tg_digest import db
-from ai_tg_digest.config import load_settings
+from ai_tg_digest import db, retention, stats
+from ai_tg_digest.config import AppSettings, load_settings
 from ai_tg_digest.ingest import ingest_new_messages
-from ai_tg_digest.moderation import process_auto_publish, queue_digest
-from ai_tg_digest.pipeline import build_digest_text, process_new_messages
+from ai_tg_digest.moderation import process_auto_publish, queue_digest, register_moderation_handlers
+from ai_tg_digest.pipeline import build_digest_texts, process_new_messages_async, refresh_digest_candidates
+from ai_tg_digest.refresh import refresh_engagement
 
+logger = logging.getLogger(__name__)
 
-def run_scheduler(config_file: str = "config.yaml") -> None:
-    settings = load_settings(config_file)
+# Fraction of CYCLE_INTERVAL_MINUTES the process step may use when no explicit budget is set;
+# the rest covers ingest, refresh and publishing.
+CYCLE_PROCESS_SHARE = 0.6
+
+
+def next_run_at(now: datetime, hhmm: str) -> datetime:
+    hour, minute = (int(x) for x in hhmm.split(":"))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return run if run > now else run + timedelta(days=1)
+
+
+def process_time_budget(settings: AppSettings, elapsed: float) -> float:
+    # Without an explicit budget, processing gets what is left of its share of the cycle so a
+    # large backlog is worked off over several cycles instead of overrunning one.
+    if settings.process_time_budget_seconds:
+        return settings.process_time_budget_seconds
+    return max(1.0, settings.cycle_interval_minutes * 60 * CYCLE_PROCESS_SHARE - elapsed)
+
+
+async def run_cycle(conn, settings: AppSettings, client: TelegramClient) -> None:
+    # Processing always takes the async path here: a blocking LLM loop would stall the
+    # moderation callbacks sharing this event loop.
+    started = time.monotonic()
+    with stats.run(conn, "cycle"):
+        with stats.timer("ingest"):
+            await ingest_new_messages(conn, settings, client=client)
+        with stats.timer("refresh"):
+            await refresh_engagement(conn, settings, client)
+        with stats.timer("process"):
+            await process_new_messages_async(conn, settings, time_budget=process_time_budget(settings, time.monotonic() - started))
+        with stats.timer("publish"):
+            await process_auto_publish(conn, settings, client)
+
+
+async def queue_period(conn, settings: AppSettings, client: TelegramClient, period: str) -> int:
+    with stats.run(conn, "queue-digest"):
+        # Usually a no-op: the last cycle's processing already rendered everything it touched.
+        refresh_digest_candidates(conn, settings)
+        ro_conn = db.connect_readonly(settings.db_path)
+        try:
+            preview, publish = build_digest_texts(ro_conn, period, settings)
+        finally:
+            ro_conn.close()
+        return await queue_digest(conn, settings, period, preview, publish, client)
+
+
+async def retention_pass(conn, settings: AppSettings) -> None:
+    # Runs on the loop thread like everything else touching `conn`; a short blocking pass once a day.
+    with stats.run(conn, "retention"):
+        retention.run_retention(conn, settings)
+
+
+async def every(interval_seconds: float, job: Callable[[], Awaitable], name: str) -> None:
+    while True:
+        started = time.monotonic()
+        try:
+            await job()
+        except Exception:  # noqa: BLE001
+            logger.exception("%s failed", name)
+        await asyncio.sleep(max(0.0, interval_seconds - (time.monotonic() - started)))
+
+
+async def daily(hhmm: str, job: Callable[[], Awaitable], name: str) -> None:
+    while True:
+        now = datetime.now()
+        await asyncio.sleep((next_run_at(now, hhmm) - now).total_seconds())
+        try:
+            await job()
+        except Exception:  # noqa: BLE001
+            logger.exception("%s failed", name)
+
+
+async def serve(settings: AppSettings) -> None:
     conn = db.connect(settings.db_path)
     db.migrate(conn)
+    client = TelegramClient(settings.tg_session, settings.tg_api_id, settings.tg_api_hash)
+    register_moderation_handlers(client, conn, settings)
 
-    sched = BlockingScheduler()
+    async with client:
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(client.disconnect()))
+        tasks = [
+            asyncio.create_task(client.run_until_disconnected()),
+            asyncio.create_task(every(settings.cycle_interval_minutes * 60, lambda: run_cycle(conn, settings, client), "cycle")),
+            asyncio.create_task(daily(settings.morning_time, lambda: queue_period(conn, settings, client, "morning"), "morning digest")),
+            asyncio.create_task(daily(settings.evening_time, lambda: queue_period(conn, settings, client, "evening"), "evening digest")),
+            asyncio.create_task(daily(settings.retention_time, lambda: retention_pass(conn, settings), "retention")),
+        ]
+        try:
+            # The jobs loop forever; the daemon stops once the client disconnects for good.
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            conn.close()
+        for task in done:
+            task.result()
 
-    def cycle_ingest():
-        asyncio.run(ingest_new_messages(conn, settings))
-        process_new_messages(conn, settings)
-        asyncio.run(process_auto_publish(conn, settings))
 
-    def queue_period(period: str):
-        preview = build_digest_text(conn, period, settings)
-        asyncio.run(queue_digest(conn, settings, period, preview))
-
-    hm1 = settings.morning_time.split(":")
-    hm2 = settings.evening_time.split(":")
-    sched.add_job(cycle_ingest, "interval", minutes=15)
-    sched.add_job(lambda: queue_period("morning"), "cron", hour=int(hm1[0]), minute=int(hm1[1]))
-    sched.add_job(lambda: queue_period("evening"), "cron", hour=int(hm2[0]), minute=int(hm2[1]))
-    sched.start()
+def run_scheduler(config_file: str = "config.yaml") -> None:
+    asyncio.run(serve(load_settings(config_file)))
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterator
+
+# Upper bounds in seconds, Prometheus-style; the last bucket is +Inf.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf)
+
+
+class Histogram:
+    def __init__(self, counts: list[int] | None = None, total: float = 0.0):
+        self.counts = counts or [0] * len(BUCKETS)
+        self.total = total
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def merge(self, other: Histogram) -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def quantile(self, q: float) -> float:
+        # Linear interpolation inside the bucket, the same estimate histogram_quantile() makes.
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) - 1 else lower
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.counters: dict[str, float] = defaultdict(float)
+        self.histograms: dict[str, Histogram] = defaultdict(Histogram)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        self.counters[name] += value
+
+    def observe(self, name: str, seconds: float) -> None:
+        self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+
+# Instrumented code records into whatever run is current; outside a run the samples go
+# to a throwaway recorder. asyncio tasks inherit the context, so workers share the run's recorder.
+_current: ContextVar[Recorder] = ContextVar("aidigest_stats", default=Recorder())
+
+
+def current() -> Recorder:
+    return _current.get()
+
+
+def incr(name: str, value: float = 1) -> None:
+    _current.get().incr(name, value)
+
+
+def observe(name: str, seconds: float) -> None:
+    _current.get().observe(name, seconds)
+
+
+def timer(name: str):
+    return _current.get().timer(name)
+
+
+@contextmanager
+def run(conn, command: str) -> Iterator[Recorder]:
+    recorder = Recorder()
+    token = _current.set(recorder)
+    started_at = datetime.utcnow().isoformat()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield recorder
+    except BaseException:
+        failed = True
+        recorder.incr(f"{command}.failed")
+        raise
+    finally:
+        _current.reset(token)
+        duration = time.perf_counter() - started
+        recorder.observe(command, duration)
+        # In the daemon the connection is shared with the moderation handlers, so a failed run
+        # neither rolls back nor commits writes it finds pending: they may not be its own. Its
+        # record then goes out with whichever commit comes next on this connection.
+        save_run(conn, command, started_at, duration, recorder, commit=not (failed and conn.in_transaction))
+
+
+def save_run(conn, command: str, started_at: str, duration: float, recorder: Recorder, commit: bool = True) -> int:
+    cur = conn.execute(
+        "INSERT INTO runs(command, started_at, duration_seconds) VALUES(?,?,?)", (command, started_at, duration)
+    )
+    run_id = int(cur.lastrowid)
+    conn.executemany(
+        "INSERT INTO run_metrics(run_id, name, kind, count, total, buckets_json) VALUES(?,?,?,?,?,?)",
+        [(run_id, name, "counter", 1, value, None) for name, value in recorder.counters.items()]
+        + [
+            (run_id, name, "histogram", h.count, h.total, json.dumps(h.counts))
+            for name, h in recorder.histograms.items()
+        ],
+    )
+    add_totals(conn, command, recorder)
+    if commit:
+        conn.commit()
+    return run_id
+
+
+def add_totals(conn, command: str, recorder: Recorder) -> None:
+    # metric_totals only ever grows, as Prometheus counters must; pruning old runs leaves it alone.
+    conn.executemany(
+        """
+        INSERT INTO metric_totals(command, name, kind, count, total, buckets_json) VALUES(?,?,'counter',1,?,NULL)
+        ON CONFLICT(command, name) DO UPDATE SET count=count+excluded.count, total=total+excluded.total
+        """,
+        [(command, name, value) for name, value in recorder.counters.items()],
+    )
+    stored = {
+        name: Histogram(json.loads(buckets_json), total)
+        for name, total, buckets_json in conn.execute(
+            "SELECT name, total, buckets_json FROM metric_totals WHERE command=? AND kind='histogram'", (command,)
+        )
+    }
+    merged = []
+    for name, h in recorder.histograms.items():
+        total = stored.get(name, Histogram())
+        total.merge(h)
+        merged.append((command, name, total.count, total.total, json.dumps(total.counts)))
+    conn.executemany(
+        "INSERT OR REPLACE INTO metric_totals(command, name, kind, count, total, buckets_json) VALUES(?,?,'histogram',?,?,?)", merged
+    )
+
+
+def load_totals(conn, command: str | None = None) -> tuple[dict[str, float], dict[str, Histogram]]:
+    counters: dict[str, float] = defaultdict(float)
+    histograms: dict[str, Histogram] = defaultdict(Histogram)
+    rows = conn.execute(
+        "SELECT name, kind, total, buckets_json FROM metric_totals WHERE ? IS NULL OR command=?", (command, command)
+    )
+    for name, kind, total, buckets_json in rows:
+        if kind == "counter":
+            counters[name] += total
+        else:
+            histograms[name].merge(Histogram(json.loads(buckets_json), total))
+    return dict(counters), dict(histograms)
+
+
+def prune_runs(conn, before: str) -> int:
+    # Per-run history feeds `stats` windows only; the cumulative totals already include these runs.
+    conn.execute("DELETE FROM run_metrics WHERE run_id IN (SELECT id FROM runs WHERE started_at < ?)", (before,))
+    return conn.execute("DELETE FROM runs WHERE started_at < ?", (before,)).rowcount
+
+
+def load_recent(conn, runs: int, command: str | None = None) -> tuple[dict[str, float], dict[str, Histogram]]:
+    # runs <= 0 reads every run still stored; see load_totals for the all-time values.
+    counters: dict[str, float] = defaultdict(float)
+    histograms: dict[str, Histogram] = defaultdict(Histogram)
+    rows = conn.execute(
+        """
+        SELECT name, kind, total, buckets_json FROM run_metrics
+        WHERE run_id IN (SELECT id FROM runs WHERE ? IS NULL OR command=? ORDER BY id DESC LIMIT ?)
+        """,
+        (command, command, runs if runs > 0 else -1),
+    )
+    for name, kind, total, buckets_json in rows:
+        if kind == "counter":
+            counters[name] += total
+        else:
+            histograms[name].merge(Histogram(json.loads(buckets_json), total))
+    return dict(counters), dict(histograms)
+
+
+def _metric_name(name: str) -> str:
+    return "aidigest_" + name.replace(".", "_").replace("-", "_")
+
+
+def _sample(value: float) -> str:
+    # Full precision: `:g` would export 12345678 as 1.23457e+07 and fake steps into rate().
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus(counters: dict[str, float], histograms: dict[str, Histogram]) -> str:
+    # Counter and histogram types promise monotonic values: pass load_totals(), not a window.
+    lines = []
+    for name in sorted(counters):
+        metric = _metric_name(name) + "_total"
+        lines += [f"# TYPE {metric} counter", f"{metric} {_sample(counters[name])}"]
+    for name in sorted(histograms):
+        h = histograms[name]
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKETS, h.counts):
+            cumulative += n
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+        lines += [f"{metric}_sum {_sample(h.total)}", f"{metric}_count {h.count}"]
+    return "\n".join(lines) + "\n"
+
+
+def render_table(counters: dict[str, float], histograms: dict[str, Histogram]) -> str:
+    lines = [f"{'stage':<28} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'total s':>10}"]
+    for name in sorted(histograms):
+        h = histograms[name]
+        lines.append(f"{name:<28} {h.count:>8} {h.quantile(0.5) * 1000:>10.1f} {h.quantile(0.95) * 1000:>10.1f} {h.total:>10.2f}")
+    if counters:
+        lines += ["", f"{'counter':<28} {'value':>8}"]
+        lines += [f"{name:<28} {counters[name]:>8g}" for name in sorted(counters)]
+    return "\n".join(lines)
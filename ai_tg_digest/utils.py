@@ -3,38 +3,134 @@ from __future__ import annotations
 import json
 import re
 from difflib import SequenceMatcher
-from typing import Any
+from functools import lru_cache
+from typing import Any, Iterable
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 TRACKING_PARAMS_PREFIXES = ("utm_",)
-TRACKING_PARAMS_EXACT = {"fbclid", "gclid", "yclid", "mc_cid", "mc_eid"}
+TRACKING_PARAMS_EXACT = {"fbclid", "gclid", "yclid", "mc_cid", "mc_eid", "igshid", "ref_src"}
+URL_CACHE_SIZE = 65536
 
+ARXIV_HOSTS = {"arxiv.org", "export.arxiv.org"}
+ARXIV_PATH_RE = re.compile(r"^/(?:abs|pdf|html)/([a-z][a-z.\-]*/\d{7}|\d{4}\.\d{4,5})(?:v\d+)?(?:\.pdf)?/?$", re.I)
+GITHUB_REPO_TAIL_RE = re.compile(r"^(?:\.git|/tree/(?:main|master)|/blob/(?:main|master)/readme\.md)?/?$", re.I)
+YOUTUBE_HOSTS = {"youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be", "youtube-nocookie.com"}
+YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{6,})")
+TELEGRAM_HOSTS = {"t.me", "telegram.me", "telegram.dog"}
+SPOTIFY_HOSTS = {"open.spotify.com", "spotify.link"}
+# Parameters that only mean tracking on some hosts; `si` is a real parameter elsewhere.
+TRACKING_PARAMS_BY_HOST = {"si": YOUTUBE_HOSTS | SPOTIFY_HOSTS}
+URL_RE = re.compile(r"https?://[^\s<>\"'«»)\]]+")
 
-def normalize_url(url: str) -> str:
+
+def _host(netloc: str) -> str:
+    host = netloc.lower().rsplit("@", 1)[-1]
+    for port in (":80", ":443"):
+        host = host.removesuffix(port)
+    return host.removeprefix("www.")
+
+
+def _tracking_param(key: str, host: str) -> bool:
+    return (
+        key in TRACKING_PARAMS_EXACT
+        or any(key.startswith(p) for p in TRACKING_PARAMS_PREFIXES)
+        or host in TRACKING_PARAMS_BY_HOST.get(key, ())
+    )
+
+
+def _domain_rule(host: str, path: str, query: list[tuple[str, str]]) -> str | None:
+    # Canonical forms for hosts whose many URL spellings mean the same resource.
+    if host in ARXIV_HOSTS and (m := ARXIV_PATH_RE.match(path)):
+        return f"https://arxiv.org/abs/{m.group(1).lower()}"
+    if host == "github.com":
+        parts = path.split("/", 3)
+        if len(parts) >= 3 and parts[1] and parts[2]:
+            repo = parts[2].removesuffix(".git")
+            rest = "/" + parts[3] if len(parts) > 3 else ""
+            if GITHUB_REPO_TAIL_RE.match(rest):
+                return f"https://github.com/{parts[1].lower()}/{repo.lower()}"
+    if host in YOUTUBE_HOSTS:
+        video = path.strip("/") if host == "youtu.be" else dict(query).get("v") if path == "/watch" else None
+        if not video and (m := YOUTUBE_PATH_RE.match(path)):
+            video = m.group(1)
+        if video:
+            return f"https://www.youtube.com/watch?v={video.split('/')[0]}"
+    if host in TELEGRAM_HOSTS:
+        if path == "/iv" and (target := dict(query).get("url")):
+            return normalize_url_uncached(target)
+        path = path[2:] if path.startswith("/s/") else path
+        return f"https://t.me{path.rstrip('/')}"
+    return None
+
+
+def normalize_url_uncached(url: str) -> str:
     parsed = urlparse(url.strip())
-    query = []
-    for k, v in parse_qsl(parsed.query, keep_blank_values=True):
-        if k in TRACKING_PARAMS_EXACT or any(k.startswith(p) for p in TRACKING_PARAMS_PREFIXES):
-            continue
-        query.append((k, v))
-    cleaned = parsed._replace(query=urlencode(query), fragment="", netloc=parsed.netloc.lower())
+    host = _host(parsed.netloc)
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if not _tracking_param(k, host)]
+    scheme = parsed.scheme.lower()
+    if scheme in ("http", "https") and parsed.netloc:
+        if canonical := _domain_rule(host, parsed.path, query):
+            return canonical
+        # Plain http and https copies of a link are the same story for dedup purposes.
+        scheme, netloc = "https", host
+    else:
+        netloc = parsed.netloc.lower()
+    cleaned = parsed._replace(scheme=scheme, query=urlencode(sorted(query)), fragment="", netloc=netloc)
     result = urlunparse(cleaned)
     return result[:-1] if result.endswith("/") else result
 
 
+# The same arXiv/GitHub/HF links repeat thousands of times a day; urlparse and friends dominate
+# the uncached cost, so keep a bounded memo of recent results.
+normalize_url = lru_cache(maxsize=URL_CACHE_SIZE)(normalize_url_uncached)
+
+
+def normalize_urls(urls: Iterable[str]) -> list[str]:
+    # One normalization per distinct input, results in input order.
+    seen: dict[str, str] = {}
+    return [seen[u] if u in seen else seen.setdefault(u, normalize_url(u)) for u in urls]
+
+
+def message_urls(text: str | None, known_urls: Iterable[str]) -> list[str]:
+    # Entity URLs from the API plus bare links in the text, normalized and deduplicated.
+    raw = list(known_urls) + [u.rstrip(".,;:!?") for u in URL_RE.findall(text or "")]
+    return list(dict.fromkeys(u for u in normalize_urls(raw) if u))
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text.lower()).strip()
+
+
 def text_similarity(a: str, b: str) -> float:
-    a_clean = re.sub(r"\s+", " ", a.lower()).strip()
-    b_clean = re.sub(r"\s+", " ", b.lower()).strip()
-    return SequenceMatcher(None, a_clean, b_clean).ratio()
+    return SequenceMatcher(None, normalize_text(a), normalize_text(b)).ratio()
 
 
-def robust_json_loads(text: str) -> dict[str, Any]:
+def length_bound(a_len: int, b_len: int) -> float:
+    # Upper bound of SequenceMatcher.ratio() from lengths alone (its real_quick_ratio).
+    return 2.0 * min(a_len, b_len) / (a_len + b_len) if a_len + b_len else 1.0
+
+
+def bounded_similarity(a_norm: str, b_norm: str, threshold: float) -> float:
+    # Same ratio as text_similarity on already-normalized text, but gives up early with an upper
+    # bound (length, then character multiset) once that bound can no longer reach `threshold`.
+    if (bound := length_bound(len(a_norm), len(b_norm))) < threshold:
+        return bound
+    matcher = SequenceMatcher(None, a_norm, b_norm)
+    if (bound := matcher.quick_ratio()) < threshold:
+        return bound
+    return matcher.ratio()
+
+
+def robust_json_loads(text: str) -> Any:
     text = text.strip()
     try:
         return json.loads(text)
     except json.JSONDecodeError:
-        start = text.find("{")
-        end = text.rfind("}")
-        if start == -1 or end == -1 or end <= start:
+        starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+        if not starts:
+            raise
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        if end <= start:
             raise
         return json.loads(text[start : end + 1])
@@ -0,0 +1,160 @@
+"""Compare the full-window similarity scan with the MinHash/LSH candidate lookup.
+
+Usage: python benchmarks/bench_dedup.py --sizes 1000 10000 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from corpus import make_text, make_vocabulary  # noqa: E402
+
+from ai_tg_digest import db, dedup  # noqa: E402
+from ai_tg_digest.utils import bounded_similarity, length_bound, normalize_text, text_similarity  # noqa: E402
+
+NAIVE_TIMED_QUERIES = 5
+# Shorter than the corpus default so numbers stay comparable with earlier runs of this benchmark.
+TEXT_WORDS = (12, 24)
+
+
+def mutate(text: str, rng: random.Random, vocabulary: list[str]) -> str:
+    # Up to three swapped words put some probes right around the 0.85 threshold, where LSH misses.
+    words = text.split()
+    for _ in range(rng.randint(1, 3)):
+        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+    return " ".join(words) + "."
+
+
+def build_db(path: Path, texts: list[str]) -> tuple:
+    conn = db.connect(path)
+    db.migrate(conn, ROOT / "migrations")
+    seen = datetime.utcnow().isoformat()
+    conn.executemany(
+        "INSERT INTO canonical_news(main_event_ru, first_seen_at, last_seen_at) VALUES(?,?,?)",
+        [(t, seen, seen) for t in texts],
+    )
+    started = time.perf_counter()
+    dedup.index_missing(conn)
+    conn.commit()
+    return conn, time.perf_counter() - started
+
+
+def naive_lookup(conn, text: str, since: str, threshold: float):
+    for c in conn.execute("SELECT id, main_event_ru FROM canonical_news WHERE last_seen_at >= ?", (since,)):
+        if text_similarity(text, c["main_event_ru"] or "") >= threshold:
+            return c["id"]
+    return None
+
+
+def full_scan_lookup(conn, text: str, since: str, threshold: float):
+    # Every canonical in the window, like naive_lookup, but with the exact early-exit bounds of
+    # the fingerprinted path: the same decisions at a cost that allows hundreds of probes at 100k.
+    norm = normalize_text(text)
+    for c in conn.execute("SELECT id, norm_text, norm_len FROM canonical_news WHERE last_seen_at >= ?", (since,)):
+        if length_bound(len(norm), c["norm_len"]) >= threshold and bounded_similarity(norm, c["norm_text"], threshold) >= threshold:
+            return c["id"]
+    return None
+
+
+def lsh_lookup(conn, text: str, since: str, threshold: float):
+    for c in dedup.lsh_candidates(conn, text, since):
+        if text_similarity(text, c["main_event_ru"] or "") >= threshold:
+            return c["id"]
+    return None
+
+
+def fingerprint_lookup(conn, text: str, since: str, threshold: float):
+    # Current path: precomputed normalized text, length bound and quick_ratio before ratio().
+    norm = normalize_text(text)
+    for c in dedup.lsh_candidates(conn, text, since):
+        if length_bound(len(norm), c["norm_len"]) >= threshold and bounded_similarity(norm, c["norm_text"], threshold) >= threshold:
+            return c["id"]
+    return None
+
+
+def bench(size: int, queries: int, naive_queries: int, threshold: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    texts = [make_text(rng, vocabulary, TEXT_WORDS) for _ in range(size)]
+    probes = [mutate(rng.choice(texts), rng, vocabulary) if i % 2 == 0 else make_text(rng, vocabulary, TEXT_WORDS) for i in range(queries)]
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, index_seconds = build_db(Path(tmp) / "bench.db", texts)
+        since = (datetime.utcnow() - timedelta(days=7)).isoformat()
+
+        started = time.perf_counter()
+        lsh_results = [lsh_lookup(conn, p, since, threshold) for p in probes]
+        lsh_seconds = (time.perf_counter() - started) / len(probes)
+
+        started = time.perf_counter()
+        fingerprint_results = [fingerprint_lookup(conn, p, since, threshold) for p in probes]
+        fingerprint_seconds = (time.perf_counter() - started) / len(probes)
+        assert fingerprint_results == lsh_results
+
+        started = time.perf_counter()
+        candidate_counts = [len(dedup.lsh_candidates(conn, p, since)) for p in probes]
+        candidates_seconds = (time.perf_counter() - started) / len(probes)
+
+        # Only a few probes are timed on the plain scan; at 100k canonicals each takes seconds.
+        timed = probes[:NAIVE_TIMED_QUERIES]
+        started = time.perf_counter()
+        naive_results = [naive_lookup(conn, p, since, threshold) for p in timed]
+        naive_seconds = (time.perf_counter() - started) / max(1, len(timed))
+
+        sample = probes[:naive_queries]
+        scan_results = [full_scan_lookup(conn, p, since, threshold) for p in sample]
+        assert scan_results[: len(timed)] == naive_results
+        conn.close()
+
+    # LSH can only miss (a band collision is needed to be compared at all), never add a match.
+    agree = sum(1 for a, b in zip(scan_results, lsh_results) if a == b)
+    missed = sum(1 for a, b in zip(scan_results, lsh_results) if a is not None and b is None)
+    matches = sum(1 for a in scan_results if a is not None)
+    return {
+        "canonicals": size,
+        "index_build_s": round(index_seconds, 3),
+        "naive_ms_per_query": round(naive_seconds * 1000, 3),
+        "lsh_ms_per_query": round(lsh_seconds * 1000, 3),
+        "lsh_fingerprint_ms_per_query": round(fingerprint_seconds * 1000, 3),
+        "lsh_candidates_ms_per_query": round(candidates_seconds * 1000, 3),
+        "avg_candidates": round(sum(candidate_counts) / len(candidate_counts), 2),
+        "speedup": round(naive_seconds / lsh_seconds, 1) if lsh_seconds else None,
+        "naive_probes": len(sample),
+        "decisions_agree_rate": round(agree / len(sample), 4) if sample else None,
+        "lsh_recall": round(1 - missed / matches, 4) if matches else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--naive-queries", type=int, default=300, help="probes whose LSH decision is checked against a full-window scan")
+    parser.add_argument("--threshold", type=float, default=0.85)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = [bench(size, args.queries, args.naive_queries, args.threshold, args.seed) for size in args.sizes]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(
+            f"{r['canonicals']:>7} canonicals: naive {r['naive_ms_per_query']:>10.3f} ms/query, "
+            f"lsh {r['lsh_ms_per_query']:>7.3f} ms/query, fingerprinted {r['lsh_fingerprint_ms_per_query']:>7.3f} ms/query (candidates {r['lsh_candidates_ms_per_query']:.3f} ms, "
+            f"avg {r['avg_candidates']}), x{r['speedup']}, agree {r['decisions_agree_rate']:.2%} of {r['naive_probes']} "
+            f"(recall {r['lsh_recall']}), index build {r['index_build_s']} s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""End-to-end benchmark on a synthetic corpus: DB ingest writes, normalize_url, in-batch clustering, process_new_messages
+against the deterministic LLM stub, find_or_create_canonical and build_digest_text, at several scales.
+
+Usage:
+  python benchmarks/bench_suite.py --scales 200 1000 5000 --latency 0.005 --out bench.json
+  python benchmarks/bench_suite.py --scales 200 1000 --compare bench.json --tolerance 0.25
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tests"))
+
+import corpus  # noqa: E402
+from llm_stub import StubLLMServer, extraction_for  # noqa: E402
+
+from ai_tg_digest import cluster, db, stats  # noqa: E402
+from ai_tg_digest.config import AppSettings  # noqa: E402
+from ai_tg_digest.pipeline import build_digest_text, find_or_create_canonical, process_new_messages  # noqa: E402
+from ai_tg_digest.utils import normalize_url  # noqa: E402
+
+# Metrics where a bigger number is better; everything else is a duration.
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def make_settings(tmp: Path, base_url: str) -> AppSettings:
+    return AppSettings(
+        db_path=tmp / "bench.db",
+        TG_API_ID=1,
+        TG_API_HASH="bench",
+        TG_SESSION="bench",
+        TARGET_CHANNEL="@bench",
+        OPENAI_BASE_URL=base_url,
+        OPENAI_API_KEY="bench",
+        OPENAI_MODEL="stub-model",
+        LLM_CACHE_ENABLED=False,
+    )
+
+
+def timed(fn, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def bench_scale(messages: int, sources: int, latency: float, seed: int) -> dict:
+    source_rows, payloads = corpus.generate(sources, messages, seed=seed)
+    urls = [u for p in payloads for u in p["known_urls"]]
+    result: dict = {"messages": messages, "sources": sources}
+
+    with tempfile.TemporaryDirectory() as tmp_dir, StubLLMServer(latency=latency) as stub:
+        tmp = Path(tmp_dir)
+        settings = make_settings(tmp, stub.base_url)
+        conn = db.connect(settings.db_path)
+        db.migrate(conn, ROOT / "migrations")
+        db.upsert_sources(conn, source_rows)
+        conn.commit()
+
+        def ingest() -> None:
+            with db.BulkWriter(conn) as writer:
+                writer.add_raw_messages(payloads)
+
+        result["db_insert_rows_per_s"] = round(messages / timed(ingest))
+        result["normalize_url_us"] = round(timed(lambda: [normalize_url(u) for u in urls]) / max(1, len(urls)) * 1e6, 2)
+        texts = [p["text"] for p in payloads]
+        result["cluster_ms"] = round(timed(lambda: cluster.leaders(texts, settings.cluster_threshold)) * 1000, 1)
+
+        with stats.run(conn, "bench-process") as recorder:
+            process_seconds = timed(lambda: process_new_messages(conn, settings))
+        result["process_messages_per_s"] = round(messages / process_seconds, 1)
+        result["llm_requests"] = stub.requests
+        result["canonicals"] = conn.execute("SELECT COUNT(*) FROM canonical_news").fetchone()[0]
+        result["dedup_by_url"] = int(recorder.counters["dedup.by_url"])
+        result["dedup_by_similarity"] = int(recorder.counters["dedup.by_similarity"])
+        result["clustered"] = int(recorder.counters["process.clustered"])
+        result["summarized"] = int(recorder.counters["summary.canonicals"])
+
+        rng = random.Random(seed)
+        probes = [extraction_for(p["text"]) for p in rng.sample(payloads, min(200, messages))]
+        started = time.perf_counter()
+        for extracted in probes:
+            find_or_create_canonical(conn, extracted, extracted["main_event_ru"] or "", settings)
+        result["find_or_create_canonical_ms"] = round((time.perf_counter() - started) / len(probes) * 1000, 3)
+        conn.rollback()
+
+        result["build_digest_text_ms"] = round(timed(lambda: build_digest_text(conn, "morning", settings), repeat=20) * 1000, 3)
+        conn.close()
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "machine": platform.machine()}
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    base_by_scale = {r["messages"]: r for r in baseline["results"]}
+    for r in current["results"]:
+        base = base_by_scale.get(r["messages"])
+        if not base:
+            continue
+        for key in (
+            "db_insert_rows_per_s",
+            "normalize_url_us",
+            "cluster_ms",
+            "process_messages_per_s",
+            "find_or_create_canonical_ms",
+            "build_digest_text_ms",
+        ):
+            if not base.get(key):
+                continue
+            ratio = r[key] / base[key]
+            worse = ratio < 1 - tolerance if key.endswith(HIGHER_IS_BETTER) else ratio > 1 + tolerance
+            if worse:
+                regressions.append(f"{r['messages']:>6} msgs {key}: {base[key]} -> {r[key]} (x{ratio:.2f})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[200, 1000, 5000])
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub LLM latency per request, seconds")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", type=Path, help="write results JSON here")
+    parser.add_argument("--compare", type=Path, help="baseline JSON from a previous --out")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    report = {
+        "environment": environment(),
+        "params": {"sources": args.sources, "latency": args.latency, "seed": args.seed},
+        "results": [bench_scale(n, args.sources, args.latency, args.seed) for n in args.scales],
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+    print(text)
+    if args.compare:
+        regressions = compare(report, json.loads(args.compare.read_text(encoding="utf-8")), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
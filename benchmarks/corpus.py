@@ -0,0 +1,95 @@
+"""Synthetic Telegram corpus: sources, raw message payloads with exact reposts, near-duplicate
+rewrites and a skewed URL distribution with the tracking/format noise real channels add."""
+from __future__ import annotations
+
+import random
+from datetime import datetime, timedelta
+
+SYLLABLES = "ка ро ми не то ла ви за де по ри су мо ге ли ба ну ко ды ша ai ml gp lm ra ge nt co de".split()
+
+# (domain, path template, relative weight); a few hosts carry most links, like real AI channels.
+URL_SHAPES = [
+    ("arxiv.org", "/abs/24{:02d}.{:05d}", 30),
+    ("github.com", "/org{}/repo{}", 25),
+    ("huggingface.co", "/models/org{}/model{}", 15),
+    ("openai.com", "/blog/post-{}-{}", 8),
+    ("www.youtube.com", "/watch?v=vid{}x{}", 7),
+    ("t.me", "/channel{}/{}", 7),
+    ("habr.com", "/ru/articles/{}{}/", 5),
+    ("example.org", "/news/{}/{}", 3),
+]
+URL_NOISE = ["", "?utm_source=telegram", "?utm_source=tg&utm_medium=social", "#comments", "/"]
+
+
+def make_vocabulary(rng: random.Random, size: int = 5000) -> list[str]:
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+
+
+def make_text(rng: random.Random, vocabulary: list[str], words: tuple[int, int] = (12, 40)) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(*words)))
+
+
+def make_url(rng: random.Random) -> str:
+    domain, path, _ = rng.choices(URL_SHAPES, weights=[s[2] for s in URL_SHAPES])[0]
+    return f"https://{domain}{path.format(rng.randint(1, 12), rng.randint(1, 99999))}"
+
+
+def add_noise(url: str, rng: random.Random) -> str:
+    noisy = url + rng.choice(URL_NOISE)
+    if rng.random() < 0.2:
+        noisy = noisy.replace("https://", "http://", 1)
+    return noisy
+
+
+def rewrite(text: str, rng: random.Random, vocabulary: list[str]) -> str:
+    words = text.split()
+    for _ in range(max(1, len(words) // 20)):
+        words[rng.randrange(len(words))] = rng.choice(vocabulary)
+    return " ".join(words) + rng.choice([".", "!", " 🔥", ""])
+
+
+def generate(
+    sources: int, messages: int, dup_rate: float = 0.15, near_dup_rate: float = 0.15, seed: int = 7
+) -> tuple[list[dict], list[dict]]:
+    """Messages split into fresh stories, exact reposts (same text, noisy copy of the same link)
+    and near-duplicates (reworded text, link kept or dropped), spread over the last day."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    source_rows = [
+        {"id_or_username": f"@bench_src{i}", "type": "channel", "weight": round(rng.uniform(0.8, 1.6), 2), "enabled": True}
+        for i in range(1, sources + 1)
+    ]
+    now = datetime.utcnow()
+    stories: list[tuple[str, str | None]] = []
+    next_id = [0] * (sources + 1)
+    payloads = []
+    for _ in range(messages):
+        roll = rng.random()
+        if stories and roll < dup_rate:
+            text, url = rng.choice(stories)
+            url = add_noise(url, rng) if url else None
+        elif stories and roll < dup_rate + near_dup_rate:
+            text, url = rng.choice(stories)
+            text = rewrite(text, rng, vocabulary)
+            url = add_noise(url, rng) if url and rng.random() < 0.6 else None
+        else:
+            text = make_text(rng, vocabulary)
+            url = make_url(rng) if rng.random() < 0.8 else None
+            stories.append((text, url))
+        source_id = rng.randint(1, sources)
+        next_id[source_id] += 1
+        payloads.append(
+            {
+                "source_id": source_id,
+                "tg_message_id": next_id[source_id],
+                "permalink": f"https://t.me/bench_src{source_id}/{next_id[source_id]}",
+                "posted_at": (now - timedelta(seconds=rng.randint(0, 86_400))).isoformat(),
+                "text": f"{text} {url}" if url else text,
+                "views": int(rng.paretovariate(1.5) * 100),
+                "forwards": rng.randint(0, 50),
+                "reactions_count": rng.randint(0, 200),
+                "comments_count": rng.randint(0, 30),
+                "known_urls": [url] if url else [],
+            }
+        )
+    return source_rows, payloads
@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS canonical_minhash (
+  canonical_news_id INTEGER PRIMARY KEY,
+  signature BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS canonical_lsh (
+  band INTEGER NOT NULL,
+  bucket INTEGER NOT NULL,
+  canonical_news_id INTEGER NOT NULL,
+  PRIMARY KEY (band, bucket, canonical_news_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_canonical_lsh_canonical ON canonical_lsh(canonical_news_id);
@@ -0,0 +1,4 @@
+ALTER TABLE sources ADD COLUMN last_tg_message_id INTEGER;
+
+UPDATE sources
+SET last_tg_message_id = (SELECT MAX(tg_message_id) FROM raw_messages WHERE raw_messages.source_id = sources.id);
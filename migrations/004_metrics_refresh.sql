@@ -0,0 +1 @@
+ALTER TABLE raw_messages ADD COLUMN metrics_refreshed_at TEXT;
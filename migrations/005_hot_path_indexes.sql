@@ -0,0 +1,13 @@
+-- Backlog scan in process_new_messages: only unlinked rows, already in posted_at order.
+CREATE INDEX IF NOT EXISTS idx_raw_messages_backlog ON raw_messages(posted_at DESC, id) WHERE canonical_news_id IS NULL;
+-- Lookups by canonical id only ever target linked rows; keeping NULLs out leaves the backlog to the index above.
+CREATE INDEX IF NOT EXISTS idx_raw_messages_canonical ON raw_messages(canonical_news_id) WHERE canonical_news_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_raw_messages_posted_at ON raw_messages(posted_at);
+
+CREATE INDEX IF NOT EXISTS idx_canonical_news_last_seen ON canonical_news(last_seen_at);
+CREATE INDEX IF NOT EXISTS idx_canonical_news_importance ON canonical_news(importance_score DESC);
+
+-- URL dedup lookup answers from the index alone.
+CREATE INDEX IF NOT EXISTS idx_canonical_links_url ON canonical_links(normalized_url, canonical_news_id);
+
+CREATE INDEX IF NOT EXISTS idx_digests_auto_publish ON digests(auto_publish_at) WHERE status = 'queued';
@@ -0,0 +1 @@
+ALTER TABLE digests ADD COLUMN publish_text TEXT;
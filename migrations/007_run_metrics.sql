@@ -0,0 +1,17 @@
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  command TEXT NOT NULL,
+  started_at TEXT NOT NULL,
+  duration_seconds REAL
+);
+
+-- One row per counter or latency histogram per run; buckets_json holds per-bucket counts for stats.BUCKETS.
+CREATE TABLE IF NOT EXISTS run_metrics (
+  run_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  total REAL NOT NULL,
+  buckets_json TEXT,
+  PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
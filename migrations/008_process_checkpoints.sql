@@ -0,0 +1,11 @@
+-- Per-message processing checkpoints: each LLM stage result is stored as soon as it
+-- arrives, so a crashed or failed run resumes from the last finished stage.
+ALTER TABLE raw_messages ADD COLUMN process_stage TEXT;
+ALTER TABLE raw_messages ADD COLUMN extracted_json TEXT;
+ALTER TABLE raw_messages ADD COLUMN classified_json TEXT;
+ALTER TABLE raw_messages ADD COLUMN summary_json TEXT;
+ALTER TABLE raw_messages ADD COLUMN process_attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE raw_messages ADD COLUMN next_attempt_at TEXT;
+ALTER TABLE raw_messages ADD COLUMN last_error TEXT;
+
+UPDATE raw_messages SET process_stage='linked' WHERE canonical_news_id IS NOT NULL;
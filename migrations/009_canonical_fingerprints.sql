@@ -0,0 +1,8 @@
+-- Dedup comparisons read these instead of re-normalizing main_event_ru for every candidate.
+-- Filled by dedup.index_canonical on every main_event_ru change; existing rows by
+-- `aidigest db backfill-fingerprints` (or the next process run).
+ALTER TABLE canonical_news ADD COLUMN norm_text TEXT;
+ALTER TABLE canonical_news ADD COLUMN norm_len INTEGER;
+ALTER TABLE canonical_news ADD COLUMN simhash INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_canonical_news_unfingerprinted ON canonical_news(id) WHERE norm_len IS NULL;
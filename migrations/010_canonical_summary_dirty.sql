@@ -0,0 +1,6 @@
+-- Titles, bullets and labels are a per-canonical stage: linking a post only marks its canonical
+-- dirty, and the end of a processing run regenerates each dirty canonical once from all of its
+-- linked posts.
+ALTER TABLE canonical_news ADD COLUMN summary_dirty INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_canonical_news_summary_dirty ON canonical_news(id) WHERE summary_dirty=1;
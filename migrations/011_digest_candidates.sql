@@ -0,0 +1,39 @@
+-- Digest items are rendered as canonicals change rather than when a digest is queued: every
+-- write that can change an item marks its canonical digest_dirty, the end of a processing run
+-- re-renders the dirty ones into digest_candidates, and queueing reads the ranked candidates.
+-- New canonicals start dirty; so does every existing one, which fills the table on first refresh.
+ALTER TABLE canonical_news ADD COLUMN digest_dirty INTEGER NOT NULL DEFAULT 1;
+
+CREATE INDEX IF NOT EXISTS idx_canonical_news_digest_dirty ON canonical_news(id) WHERE digest_dirty=1;
+
+CREATE TABLE IF NOT EXISTS digest_candidates (
+  canonical_news_id INTEGER PRIMARY KEY,
+  category TEXT NOT NULL,
+  importance_score REAL NOT NULL,
+  last_seen_at TEXT NOT NULL,
+  item_json TEXT NOT NULL,
+  preview_block TEXT NOT NULL,
+  publish_block TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_digest_candidates_rank ON digest_candidates(category, importance_score DESC);
+CREATE INDEX IF NOT EXISTS idx_digest_candidates_seen ON digest_candidates(last_seen_at);
+
+CREATE TRIGGER IF NOT EXISTS canonical_news_digest_dirty
+AFTER UPDATE OF title_ru, summary_bullets_json, why_important_ru, labels_json, importance_score, last_seen_at ON canonical_news
+WHEN NEW.digest_dirty=0
+BEGIN
+  UPDATE canonical_news SET digest_dirty=1 WHERE id=NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS canonical_links_digest_dirty_insert
+AFTER INSERT ON canonical_links
+BEGIN
+  UPDATE canonical_news SET digest_dirty=1 WHERE id=NEW.canonical_news_id AND digest_dirty=0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS canonical_links_digest_dirty_update
+AFTER UPDATE OF normalized_url ON canonical_links
+BEGIN
+  UPDATE canonical_news SET digest_dirty=1 WHERE id=NEW.canonical_news_id AND digest_dirty=0;
+END;
@@ -0,0 +1,44 @@
+-- Labels and message URLs get typed tables so category filtering and URL dedup are indexed
+-- lookups rather than a json.loads per row. New writes go straight to these tables (and leave
+-- labels_json NULL); rows that existed before this migration are converted by
+-- db.convert_json_columns a chunk per transaction, from `aidigest db convert-json` or at the
+-- start of the next process run. json_conversions tracks how far each conversion got.
+CREATE TABLE IF NOT EXISTS canonical_labels (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  canonical_news_id INTEGER NOT NULL,
+  label TEXT NOT NULL,
+  confidence REAL NOT NULL DEFAULT 0,
+  UNIQUE(canonical_news_id, label)
+);
+
+CREATE INDEX IF NOT EXISTS idx_canonical_labels_label ON canonical_labels(label, confidence DESC);
+
+CREATE TABLE IF NOT EXISTS raw_message_urls (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  raw_message_id INTEGER NOT NULL,
+  normalized_url TEXT NOT NULL,
+  UNIQUE(raw_message_id, normalized_url)
+);
+
+CREATE INDEX IF NOT EXISTS idx_raw_message_urls_url ON raw_message_urls(normalized_url);
+
+CREATE TABLE IF NOT EXISTS json_conversions (
+  name TEXT PRIMARY KEY,
+  last_id INTEGER NOT NULL,
+  max_id INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO json_conversions(name, last_id, max_id) SELECT 'canonical_labels', 0, COALESCE(MAX(id), 0) FROM canonical_news;
+INSERT OR IGNORE INTO json_conversions(name, last_id, max_id) SELECT 'raw_message_urls', 0, COALESCE(MAX(id), 0) FROM raw_messages;
+
+CREATE TRIGGER IF NOT EXISTS canonical_labels_digest_dirty_insert
+AFTER INSERT ON canonical_labels
+BEGIN
+  UPDATE canonical_news SET digest_dirty=1 WHERE id=NEW.canonical_news_id AND digest_dirty=0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS canonical_labels_digest_dirty_delete
+AFTER DELETE ON canonical_labels
+BEGIN
+  UPDATE canonical_news SET digest_dirty=1 WHERE id=OLD.canonical_news_id AND digest_dirty=0;
+END;
@@ -0,0 +1,6 @@
+-- normalize_url now folds http/https, www. and the arXiv/GitHub/YouTube/t.me spellings, so
+-- canonical_links stored before this migration carry keys new messages no longer produce.
+-- Queue them for db.convert_json_columns, which re-keys them a chunk per transaction at the
+-- start of the next process run (or from `aidigest db convert-json`). A later rules change
+-- queues the same conversion again from its own migration.
+INSERT OR REPLACE INTO json_conversions(name, last_id, max_id) SELECT 'canonical_links', 0, COALESCE(MAX(id), 0) FROM canonical_links;
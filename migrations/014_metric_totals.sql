@@ -0,0 +1,29 @@
+-- Cumulative totals per command and metric, added to as each run is saved. `stats --prometheus`
+-- reads these instead of summing run_metrics on every scrape, and retention may prune old runs
+-- without the exported counters going backwards.
+CREATE TABLE IF NOT EXISTS metric_totals (
+  command TEXT NOT NULL,
+  name TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  total REAL NOT NULL,
+  buckets_json TEXT,
+  PRIMARY KEY (command, name)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO metric_totals(command, name, kind, count, total, buckets_json)
+SELECT r.command, m.name, MIN(m.kind), SUM(m.count), SUM(m.total), NULL
+FROM run_metrics m JOIN runs r ON r.id = m.run_id
+GROUP BY r.command, m.name;
+
+UPDATE metric_totals SET buckets_json = (
+  SELECT json_group_array(n) FROM (
+    SELECT SUM(b.value) AS n
+    FROM run_metrics m JOIN runs r ON r.id = m.run_id, json_each(m.buckets_json) b
+    WHERE r.command = metric_totals.command AND m.name = metric_totals.name AND m.kind = 'histogram'
+    GROUP BY b.key ORDER BY b.key
+  )
+)
+WHERE kind = 'histogram';
+
+CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs(started_at);
@@ -0,0 +1,37 @@
+from pathlib import Path
+
+import pytest
+
+from ai_tg_digest import db
+from ai_tg_digest.config import AppSettings
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[1] / "migrations"
+
+
+@pytest.fixture()
+def conn(tmp_path):
+    conn = db.connect(tmp_path / "test.db")
+    db.migrate(conn, MIGRATIONS_DIR)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture()
+def make_settings(tmp_path):
+    def factory(**overrides):
+        values = {
+            "db_path": tmp_path / "test.db",
+            "TG_API_ID": 1,
+            "TG_API_HASH": "hash",
+            "TG_SESSION": "session",
+            "TARGET_CHANNEL": "@target",
+            "OPENAI_BASE_URL": "http://127.0.0.1:1/v1",
+            "OPENAI_API_KEY": "key",
+            "OPENAI_MODEL": "stub-model",
+            "LLM_CACHE_PATH": tmp_path / "llm_cache.db",
+            "LLM_BACKOFF_BASE_SECONDS": 0.01,
+        }
+        values.update(overrides)
+        return AppSettings(**values)
+
+    return factory
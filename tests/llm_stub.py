@@ -0,0 +1,158 @@
+"""Deterministic OpenAI-compatible /chat/completions stub for tests and benchmarks."""
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_tg_digest.pipeline import LABELS
+
+URL_RE = re.compile(r"https?://[^\s\"'<>)]+")
+POST_TEXT_RE = re.compile(r'(?:post_text|raw_text): """(.*?)"""', re.S)
+
+
+BATCH_INPUT_RE = re.compile(r"^\[.*\]$", re.M)
+
+
+def _post_text(prompt: str) -> str:
+    match = POST_TEXT_RE.search(prompt)
+    return match.group(1).strip() if match else prompt
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def extraction_for(text: str) -> dict:
+    urls = sorted(set(URL_RE.findall(text)))
+    return {
+        "external_urls": [{"url": u, "normalized_url": u, "domain": u.split("/")[2]} for u in urls],
+        "main_event_ru": URL_RE.sub("", text).strip()[:200] or None,
+        "event_type": "релиз",
+        "entities": [],
+        "signals": {"mentions_release": True, "mentions_paper": False, "mentions_benchmark": False, "mentions_security": False},
+    }
+
+
+def multilabel_for(text: str) -> dict:
+    h = _digest(text)
+    return {
+        "labels": [{"label": LABELS[h % len(LABELS)], "confidence": 0.9}, {"label": LABELS[(h >> 4) % len(LABELS)], "confidence": 0.4}],
+        "humor": False,
+        "rationale_ru": "stub",
+    }
+
+
+def summary_for(text: str) -> dict:
+    return {
+        "title_ru": text[:80],
+        "bullets_ru": [text[:60], "Второй пункт", "Третий пункт"],
+        "why_important_ru": "Заглушка для тестов.",
+        "key_claims": [],
+        "suggested_tags_text": [],
+    }
+
+
+def respond(system_prompt: str, user_prompt: str, drop_batch_items: int = 0):
+    if "batches" in system_prompt:
+        items = json.loads(BATCH_INPUT_RE.search(user_prompt).group(0))
+        build = extraction_for if "extraction" in system_prompt else multilabel_for
+        out = [dict(build(item.get("post_text") or item.get("raw_text") or ""), id=item["id"]) for item in items]
+        return {"items": out[: len(out) - drop_batch_items] if drop_batch_items else out}
+    if "extraction" in system_prompt:
+        return extraction_for(_post_text(user_prompt))
+    if "classifier" in system_prompt:
+        return multilabel_for(_post_text(user_prompt))
+    return summary_for(_post_text(user_prompt))
+
+
+class StubLLMServer:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        drop_batch_items: int = 0,
+        fail_on: tuple[str, str] | None = None,
+        throttle: int = 0,
+        retry_after: str | None = None,
+    ):
+        self.latency = latency
+        self.drop_batch_items = drop_batch_items
+        # (system prompt substring, user prompt substring): matching requests get a 500.
+        self.fail_on = fail_on
+        # The first `throttle` requests get a 429, with this Retry-After header if given.
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> StubLLMServer:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args) -> None:  # noqa: ANN002
+                pass
+
+            def do_POST(self) -> None:  # noqa: N802
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                    throttled = stub.requests <= stub.throttle
+                try:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    messages = {m["role"]: m["content"] for m in body["messages"]}
+                    if throttled:
+                        self.send_response(429)
+                        if stub.retry_after is not None:
+                            self.send_header("Retry-After", stub.retry_after)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    if stub.fail_on and stub.fail_on[0] in messages.get("system", "") and stub.fail_on[1] in messages.get("user", ""):
+                        self.send_response(500)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    content = json.dumps(respond(messages.get("system", ""), messages.get("user", ""), stub.drop_batch_items), ensure_ascii=False)
+                    data = json.dumps(
+                        {
+                            "choices": [{"message": {"role": "assistant", "content": content}}],
+                            "usage": {"prompt_tokens": len(messages.get("user", "")) // 4, "completion_tokens": len(content) // 4},
+                        }
+                    ).encode("utf-8")
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,67 @@
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from conftest import MIGRATIONS_DIR
+from llm_stub import extraction_for, multilabel_for, summary_for
+from test_ingest import FakeClient
+
+from ai_tg_digest import db
+from ai_tg_digest.backfill import ingest_history, link_staged
+from ai_tg_digest.pipeline import process_new_messages
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+import corpus  # noqa: E402
+
+
+def _staged_db(path, payloads, sources):
+    conn = db.connect(path)
+    db.migrate(conn, MIGRATIONS_DIR)
+    db.upsert_sources(conn, sources)
+    db.insert_raw_messages(conn, payloads)
+    for row in conn.execute("SELECT id, text FROM raw_messages").fetchall():
+        conn.execute(
+            "UPDATE raw_messages SET extracted_json=?, classified_json=?, summary_json=? WHERE id=?",
+            tuple(json.dumps(f(row["text"]), ensure_ascii=False) for f in (extraction_for, multilabel_for, summary_for)) + (row["id"],),
+        )
+    conn.commit()
+    return conn
+
+
+def _groups(conn):
+    # Canonical ids are assigned in the same order on both paths, so the mapping must match exactly.
+    return conn.execute("SELECT id, canonical_news_id FROM raw_messages ORDER BY id").fetchall()
+
+
+def test_pool_linking_matches_serial_decisions(tmp_path, make_settings):
+    sources, payloads = corpus.generate(6, 400, dup_rate=0.25, near_dup_rate=0.25, seed=11)
+    settings = make_settings(LLM_CACHE_ENABLED=False)
+    since = datetime.utcnow() - timedelta(days=2)
+
+    serial = _staged_db(tmp_path / "serial.db", payloads, sources)
+    # Every stage is checkpointed, so this links without a single LLM request.
+    assert process_new_messages(serial, settings) == len(payloads)
+
+    pooled = _staged_db(tmp_path / "pooled.db", payloads, sources)
+    assert link_staged(pooled, settings, since, workers=2) == len(payloads)
+
+    assert [tuple(r) for r in _groups(pooled)] == [tuple(r) for r in _groups(serial)]
+    assert pooled.execute("SELECT COUNT(*) FROM canonical_news").fetchone()[0] < len(payloads)
+
+
+def test_ingest_history_ignores_cursor_and_stops_at_since(conn, make_settings):
+    now = datetime.now(timezone.utc)
+    msgs = [SimpleNamespace(id=i, message=f"пост {i}", date=now - timedelta(days=10 - i), entities=None) for i in range(1, 11)]
+    settings = make_settings(sources=[{"id_or_username": "@hist"}])
+    db.upsert_sources(conn, [{"id_or_username": "@hist", "type": "channel", "weight": 1.0, "enabled": True}])
+    conn.execute("UPDATE sources SET last_tg_message_id=1")
+    conn.commit()
+
+    client = FakeClient({"@hist": msgs})
+    since = datetime.utcnow() - timedelta(days=5, hours=12)
+    assert asyncio.run(ingest_history(conn, settings, since, client)) == 6
+    assert client.calls == [("@hist", 0, False)]
+    assert conn.execute("SELECT last_tg_message_id FROM sources").fetchone()[0] == 10
@@ -0,0 +1,40 @@
+from ai_tg_digest.batching import pack_batches, parse_batch_items, run_batched
+
+
+def test_pack_batches_respects_budget_and_size():
+    items = [{"id": str(i), "post_text": "x" * 300} for i in range(10)]
+    batches = pack_batches(items, token_budget=350, max_items=4)
+    assert [len(b) for b in batches] == [3, 3, 3, 1]
+    assert [len(b) for b in pack_batches(items, token_budget=10_000, max_items=4)] == [4, 4, 2]
+
+
+def test_parse_batch_items_handles_shapes_and_mismatched_ids():
+    expected = ["1", "2", "3"]
+    assert set(parse_batch_items({"items": [{"id": 1, "a": 1}, {"id": "2", "a": 2}]}, expected)) == {"1", "2"}
+    assert parse_batch_items([{"id": " 3 ", "a": 3}, {"id": "9", "a": 9}, "junk"], expected) == {"3": {"a": 3}}
+    assert parse_batch_items({"1": {"a": 1}, "x": {"a": 0}}, expected) == {"1": {"a": 1}}
+    assert parse_batch_items([{"id": "1", "a": 1}, {"id": "1", "a": 2}], expected) == {"1": {"a": 1}}
+    assert parse_batch_items(None, expected) == {}
+
+
+class _FakeLLM:
+    def __init__(self, answer):
+        self.answer = answer
+        self.calls = 0
+
+    def complete_json(self, system_prompt, user_prompt, template=""):
+        self.calls += 1
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+def test_run_batched_falls_back_per_item_for_missing_and_failed():
+    items = [{"id": "1", "t": "a"}, {"id": "2", "t": "b"}]
+    partial = _FakeLLM({"items": [{"id": "1", "v": "batch"}]})
+    result = run_batched(partial, "s", "{posts_json}", "posts_json", items, lambda i: {"v": f"single-{i}"}, 1000, 10)
+    assert result == {"1": {"v": "batch"}, "2": {"v": "single-2"}}
+
+    failing = _FakeLLM(RuntimeError("boom"))
+    result = run_batched(failing, "s", "{posts_json}", "posts_json", items, lambda i: {"v": f"single-{i}"}, 1000, 10)
+    assert result == {"1": {"v": "single-1"}, "2": {"v": "single-2"}}
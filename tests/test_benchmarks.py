@@ -0,0 +1,29 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+import bench_suite  # noqa: E402
+import corpus  # noqa: E402
+
+
+def test_corpus_is_reproducible_and_has_duplicates():
+    sources, payloads = corpus.generate(5, 300, seed=3)
+    _, again = corpus.generate(5, 300, seed=3)
+    assert [p["text"] for p in payloads] == [p["text"] for p in again]
+    assert len(sources) == 5
+    assert len({p["text"] for p in payloads}) < len(payloads)
+    assert len({(p["source_id"], p["tg_message_id"]) for p in payloads}) == len(payloads)
+
+
+def test_suite_smoke_run():
+    result = bench_suite.bench_scale(40, 4, latency=0.0, seed=1)
+    # Labels and summary for each canonical summarized in the run, plus at most one extraction
+    # per post that was not clustered away (URL dedup, prefilter and batching only lower it).
+    assert 0 < result["llm_requests"] - 2 * result["summarized"] <= 40 - result["clustered"]
+    assert result["clustered"] > 0
+    assert result["canonicals"] < 40
+    # At this size every duplicate shares a page with its original, so clustering catches them first.
+    assert result["clustered"] + result["dedup_by_url"] + result["dedup_by_similarity"] > 0
+    baseline = {"results": [dict(result, build_digest_text_ms=result["build_digest_text_ms"] / 10)]}
+    assert bench_suite.compare({"results": [result]}, baseline, 0.25)[0].startswith("    40 msgs build_digest_text_ms")
@@ -0,0 +1,22 @@
+import re
+import subprocess
+import sys
+
+# Importing the CLI is what every `aidigest ...` invocation pays before the command runs.
+# Measured around 70 ms here; telethon alone would add ~350 ms.
+CLI_IMPORT_BUDGET_MS = 250
+HEAVY_MODULES = ("telethon", "httpx", "apscheduler", "numpy", "asyncio")
+
+
+def _import_cli() -> tuple[int, set[str]]:
+    code = "import sys, ai_tg_digest.cli; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    cumulative = max(int(m[1]) for m in re.finditer(r"^import time:\s+\d+ \|\s+(\d+) \| ai_tg_digest\.cli$", result.stderr, re.M))
+    return cumulative // 1000, set(result.stdout.split())
+
+
+def test_cli_import_stays_light():
+    runs = [_import_cli() for _ in range(3)]
+    assert not {m for m in runs[0][1] if m.split(".")[0] in HEAVY_MODULES}
+    # Best of three, so a busy test machine doesn't fail the budget.
+    assert min(ms for ms, _ in runs) < CLI_IMPORT_BUDGET_MS
@@ -0,0 +1,39 @@
+from llm_stub import StubLLMServer
+from test_pipeline import _seed
+
+from ai_tg_digest.cluster import leaders
+from ai_tg_digest.pipeline import fetch_backlog, process_new_messages
+
+RELEASE = "Anthropic представила Claude с контекстом на миллион токенов и новым режимом рассуждений для агентов"
+OTHER = "Google открыла исходники Gemma 3 и опубликовала отчёт о качестве на задачах программирования"
+REPOST = RELEASE.replace("представила", "показала") + " https://anthropic.com/news"
+
+
+def test_leaders_group_near_duplicates_only():
+    texts = [RELEASE, OTHER, RELEASE + " 🔥", REPOST, "Спасибо!"]
+    assert leaders(texts, 0.85) == [0, 1, 0, 0, 4]
+    assert leaders(texts, 0.999) == [0, 1, 2, 3, 4]
+    assert leaders([RELEASE], 0.85) == [0]
+
+
+def test_followers_are_linked_to_the_leader_canonical(conn, make_settings):
+    _seed(conn, [RELEASE, REPOST, OTHER])
+    with StubLLMServer() as stub:
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url)) == 3
+    assert stub.requests == 3 * 2
+    rows = conn.execute("SELECT canonical_news_id, dedup_status FROM raw_messages ORDER BY id").fetchall()
+    assert rows[0]["canonical_news_id"] == rows[1]["canonical_news_id"] != rows[2]["canonical_news_id"]
+    assert sorted(r["dedup_status"] for r in rows) == ["clustered", "linked", "linked"]
+    assert conn.execute("SELECT raw_count FROM canonical_news WHERE id=?", (rows[0]["canonical_news_id"],)).fetchone()[0] == 3
+
+
+def test_followers_of_a_failed_leader_stay_in_the_backlog(conn, make_settings):
+    _seed(conn, [RELEASE, REPOST, OTHER])
+    with StubLLMServer(fail_on=("extraction", "Anthropic")) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False)
+        assert process_new_messages(conn, settings) == 1
+    rows = conn.execute("SELECT process_attempts, canonical_news_id FROM raw_messages ORDER BY id").fetchall()[:2]
+    assert sorted(r["process_attempts"] for r in rows) == [0, 1]
+    assert all(r["canonical_news_id"] is None for r in rows)
+    # The untouched follower is picked up again on the next run; the failed leader is backing off.
+    assert [r["text"] for r in fetch_backlog(conn)] == [RELEASE]
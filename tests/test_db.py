@@ -0,0 +1,87 @@
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+from conftest import MIGRATIONS_DIR
+
+from ai_tg_digest import db
+
+
+def test_connect_enables_wal_and_readonly_rejects_writes(conn, tmp_path):
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    ro = db.connect_readonly(tmp_path / "test.db")
+    assert ro.execute("SELECT COUNT(*) FROM sources").fetchone()[0] == 0
+    with pytest.raises(sqlite3.OperationalError):
+        ro.execute("INSERT INTO sources(id_or_username, type) VALUES('@x', 'channel')")
+
+
+def test_bulk_writer_flushes_rows_and_cursors_together(conn):
+    db.upsert_sources(conn, [{"id_or_username": "@src", "type": "channel", "weight": 1.0, "enabled": True}])
+    payloads = [{"source_id": 1, "tg_message_id": i, "posted_at": datetime.utcnow().isoformat(), "text": "t"} for i in range(1, 6)]
+    with db.BulkWriter(conn, batch_size=3) as writer:
+        writer.add_raw_messages(payloads[:3])
+        assert conn.execute("SELECT COUNT(*) FROM raw_messages").fetchone()[0] == 3
+        writer.add_raw_messages(payloads[2:])
+        writer.set_source_cursor(1, 5)
+    assert writer.inserted == 5
+    assert conn.execute("SELECT last_tg_message_id FROM sources").fetchone()[0] == 5
+
+
+def test_hot_queries_use_indexes(conn):
+    scans = [name for name, _plan, has_scan in db.explain_hot_queries(conn) if has_scan]
+    assert scans == []
+
+
+def test_migrate_skips_current_schema_by_user_version(conn, tmp_path):
+    newest = max(int(p.name.split("_", 1)[0]) for p in MIGRATIONS_DIR.glob("*.sql"))
+    assert db.LATEST_SCHEMA_VERSION == newest
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == newest
+    # Current DB: the migrations directory is not even looked at.
+    db.migrate(conn, tmp_path / "does-not-exist")
+
+    conn.execute("PRAGMA user_version=0")
+    conn.execute("DELETE FROM schema_migrations WHERE name LIKE '010_%'")
+    conn.execute("DROP INDEX idx_canonical_news_summary_dirty")
+    conn.execute("ALTER TABLE canonical_news DROP COLUMN summary_dirty")
+    db.migrate(conn, MIGRATIONS_DIR)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == newest
+    assert "summary_dirty" in [r[1] for r in conn.execute("PRAGMA table_info(canonical_news)")]
+
+
+def test_json_columns_written_before_012_are_converted_in_chunks(conn):
+    # Rows as an older version wrote them: labels only in labels_json, URLs only in known_urls_json.
+    labels = [{"label": "RAG", "confidence": 0.4}, {"label": "NLP", "confidence": 0.9}]
+    for n in range(3):
+        conn.execute("INSERT INTO canonical_news(title_ru, labels_json) VALUES(?,?)", (f"t{n}", json.dumps(labels)))
+        conn.execute(
+            "INSERT INTO raw_messages(source_id, tg_message_id, posted_at, text, known_urls_json) VALUES(1,?,?,?,?)",
+            (n, "2024-01-01", f"см. https://arxiv.org/pdf/2401.0000{n}v2.", json.dumps(["https://github.com/a/b?utm_source=tg"])),
+        )
+    conn.execute("UPDATE json_conversions SET max_id=3")
+    conn.commit()
+
+    assert db.convert_json_columns(conn, batch_size=2) == 6
+    assert conn.execute("SELECT COUNT(*) FROM json_conversions").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM canonical_news WHERE labels_json IS NOT NULL").fetchone()[0] == 0
+    top = conn.execute("SELECT label FROM canonical_labels WHERE canonical_news_id=1 ORDER BY confidence DESC").fetchall()
+    assert [r[0] for r in top] == ["NLP", "RAG"]
+    urls = conn.execute("SELECT normalized_url FROM raw_message_urls WHERE raw_message_id=1 ORDER BY id").fetchall()
+    assert [r[0] for r in urls] == ["https://github.com/a/b", "https://arxiv.org/abs/2401.00000"]
+    assert db.convert_json_columns(conn) == 0
+
+
+def test_links_stored_under_old_rules_are_rekeyed_by_migration_013(conn):
+    cid = db.create_canonical(conn, {"title_ru": "x"})
+    db.insert_canonical_links(conn, [(cid, "http://www.arxiv.org/pdf/2401.00001v2.pdf", "arxiv.org")])
+    conn.executescript((MIGRATIONS_DIR / "013_renormalize_links.sql").read_text(encoding="utf-8"))
+    conn.commit()
+
+    assert db.convert_json_columns(conn) == 1
+    assert [r[0] for r in conn.execute("SELECT normalized_url FROM canonical_links")] == ["https://arxiv.org/abs/2401.00001"]
+
+
+def test_message_urls_are_normalized_at_ingest(conn):
+    payload = {"source_id": 1, "tg_message_id": 1, "posted_at": "2024-01-01", "text": "https://x.com/a?utm_medium=tg и https://x.com/a"}
+    db.insert_raw_messages(conn, [payload, payload])
+    assert [r[0] for r in conn.execute("SELECT normalized_url FROM raw_message_urls")] == ["https://x.com/a"]
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from ai_tg_digest import db, dedup
+
+
+def _add(conn, text, days_ago=0):
+    seen = (datetime.utcnow() - timedelta(days=days_ago)).isoformat()
+    cid = db.create_canonical(conn, {"main_event_ru": text, "first_seen_at": seen, "last_seen_at": seen})
+    dedup.index_canonical(conn, cid, text)
+    return cid
+
+
+def test_lsh_candidates_find_near_duplicate(conn):
+    since = (datetime.utcnow() - timedelta(days=7)).isoformat()
+    target = _add(conn, "OpenAI выпустила новую модель GPT для генерации кода на Python")
+    _add(conn, "Курс валют вырос на фоне новостей рынка")
+    ids = [r["id"] for r in dedup.lsh_candidates(conn, "OpenAI выпустила новую модель GPT для генерации кода на Python!", since)]
+    assert ids == [target]
+
+
+def test_lsh_candidates_respect_window(conn):
+    since = (datetime.utcnow() - timedelta(days=7)).isoformat()
+    _add(conn, "Meta открыла веса модели Llama для исследователей", days_ago=30)
+    assert dedup.lsh_candidates(conn, "Meta открыла веса модели Llama для исследователей", since) == []
+
+
+def test_index_missing_backfills_unindexed_rows(conn):
+    db.create_canonical(conn, {"main_event_ru": "Новый релиз PyTorch"})
+    assert dedup.index_missing(conn) == 1
+    assert dedup.index_missing(conn) == 0
+
+
+def test_fingerprints_follow_main_event_and_backfill_legacy_rows(conn):
+    cid = _add(conn, "  Новый   релиз PyTorch ")
+    row = conn.execute("SELECT norm_text, norm_len, simhash FROM canonical_news WHERE id=?", (cid,)).fetchone()
+    assert tuple(row) == ("новый релиз pytorch", 19, dedup.simhash("новый релиз pytorch"))
+
+    conn.execute("UPDATE canonical_news SET norm_text=NULL, norm_len=NULL, simhash=NULL")
+    assert dedup.backfill_fingerprints(conn, batch_size=1) == 1
+    assert conn.execute("SELECT norm_len FROM canonical_news").fetchone()[0] == 19
+
+
+def test_simhash_distance_tracks_similarity():
+    base = "openai выпустила новую модель gpt для генерации кода на python и других языках"
+    near = base.replace("python", "rust")
+    other = "курс валют вырос на фоне новостей рынка и заявлений центробанка о ставке"
+    assert dedup.hamming(dedup.simhash(base), dedup.simhash(near)) < dedup.hamming(dedup.simhash(base), dedup.simhash(other))
+
+
+def test_renormalize_links_rekeys_old_spellings(conn):
+    cid = db.create_canonical(conn, {"title_ru": "x"})
+    other = db.create_canonical(conn, {"title_ru": "y"})
+    db.insert_canonical_links(
+        conn,
+        [
+            (cid, "http://arxiv.org/pdf/2401.00001v2.pdf", "arxiv.org"),
+            (cid, "https://arxiv.org/abs/2401.00001", "arxiv.org"),
+            (other, "https://youtu.be/abcdefg", "youtu.be"),
+        ],
+    )
+    assert dedup.renormalize_links(conn, batch_size=2) == 2
+    rows = conn.execute("SELECT canonical_news_id, normalized_url FROM canonical_links ORDER BY canonical_news_id").fetchall()
+    assert [tuple(r) for r in rows] == [(cid, "https://arxiv.org/abs/2401.00001"), (other, "https://www.youtube.com/watch?v=abcdefg")]
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.errors import FloodWaitError
+
+from ai_tg_digest.ingest import ingest_new_messages, sync_sources
+
+
+class FakeClient:
+    def __init__(self, messages_by_source, flood_once=()):
+        self.messages = messages_by_source
+        self.flood_once = set(flood_once)
+        self.calls = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def iter_messages(self, entity, limit=None, min_id=0, reverse=False):
+        self.calls.append((entity, min_id, reverse))
+        if entity in self.flood_once:
+            self.flood_once.discard(entity)
+            raise FloodWaitError(None, capture=0)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        msgs = sorted(self.messages[entity], key=lambda m: m.id, reverse=not reverse)
+        msgs = [m for m in msgs if m.id > min_id][:limit]
+        self.in_flight -= 1
+        for m in msgs:
+            yield m
+
+
+def _msg(i, text="пост", age=None):
+    return SimpleNamespace(id=i, message=text, date=datetime.now(timezone.utc) - (age or timedelta(minutes=i)), entities=None)
+
+
+def test_ingest_uses_cursor_and_runs_sources_concurrently(conn, make_settings):
+    sources = [{"id_or_username": f"@s{i}", "type": "channel"} for i in range(4)]
+    settings = make_settings(sources=sources, INGEST_CONCURRENCY=4)
+    client = FakeClient({s["id_or_username"]: [_msg(1), _msg(2), _msg(3, text="")] for s in sources}, flood_once={"@s0"})
+
+    assert asyncio.run(ingest_new_messages(conn, settings, client=client)) == 8
+    assert client.peak_in_flight > 1
+    cursors = {r[0]: r[1] for r in conn.execute("SELECT id_or_username, last_tg_message_id FROM sources")}
+    assert set(cursors.values()) == {3}
+
+    client.messages["@s1"].append(_msg(4))
+    client.calls.clear()
+    assert asyncio.run(ingest_new_messages(conn, settings, client=client)) == 1
+    assert sorted(client.calls) == [(s["id_or_username"], 3, True) for s in sources]
+    assert conn.execute("SELECT last_tg_message_id FROM sources WHERE id_or_username='@s1'").fetchone()[0] == 4
+
+
+def test_ingest_drops_posts_older_than_window_after_cursor(conn, make_settings):
+    # A source re-enabled after a week: everything above its cursor but before the window stays out.
+    settings = make_settings(sources=[{"id_or_username": "@s", "type": "channel"}], DEDUP_WINDOW_DAYS=1)
+    sync_sources(conn, settings)
+    conn.execute("UPDATE sources SET last_tg_message_id=1")
+    client = FakeClient({"@s": [_msg(1), _msg(2, age=timedelta(days=7)), _msg(3, age=timedelta(days=6)), _msg(4)]})
+
+    assert asyncio.run(ingest_new_messages(conn, settings, client=client)) == 1
+    assert [r[0] for r in conn.execute("SELECT tg_message_id FROM raw_messages")] == [4]
+    assert conn.execute("SELECT last_tg_message_id FROM sources").fetchone()[0] == 4
@@ -0,0 +1,41 @@
+import time
+
+from llm_stub import StubLLMServer
+
+from ai_tg_digest.llm import OpenAICompatClient
+from ai_tg_digest.llm_cache import LLMCache, make_cache_key
+
+
+def test_cache_key_depends_on_model_template_and_prompt():
+    base = make_cache_key("m", "sys", "tpl {x}", "tpl 1")
+    assert base == make_cache_key("m", "sys", "tpl {x}", "tpl 1")
+    assert base != make_cache_key("m2", "sys", "tpl {x}", "tpl 1")
+    assert base != make_cache_key("m", "sys", "tpl2 {x}", "tpl 1")
+    assert base != make_cache_key("m", "sys", "tpl {x}", "tpl 2")
+
+
+def test_cache_ttl_and_lru_eviction(tmp_path):
+    cache = LLMCache(tmp_path / "c.db", ttl_seconds=60, max_entries=2)
+    cache.put("a", "m", {"v": 1})
+    cache.put("b", "m", {"v": 2})
+    assert cache.get("a") == {"v": 1}
+    cache.put("c", "m", {"v": 3})
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+    cache.conn.execute("UPDATE llm_cache SET created_at=?", (time.time() - 120,))
+    assert cache.get("c") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "entries": 2}
+
+
+def test_client_serves_repeated_prompt_from_cache(tmp_path):
+    cache = LLMCache(tmp_path / "c.db", ttl_seconds=60, max_entries=100)
+    with StubLLMServer() as stub:
+        llm = OpenAICompatClient(stub.base_url, "key", "m", cache=cache)
+        system = "You are a careful information extraction engine."
+        first = llm.complete_json(system, 'post_text: """Релиз модели"""', template="t")
+        second = llm.complete_json(system, 'post_text: """Релиз модели"""', template="t")
+        llm.close()
+    assert first == second
+    assert stub.requests == 1
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,272 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from llm_stub import StubLLMServer, respond
+
+from ai_tg_digest import db, pipeline
+from ai_tg_digest.pipeline import (
+    Budget,
+    build_digest_texts,
+    fetch_backlog,
+    iter_backlog,
+    process_new_messages,
+    process_new_messages_async,
+    refresh_digest_candidates,
+    select_digest_items,
+    summarize_dirty,
+    summarize_dirty_async,
+)
+from ai_tg_digest.ratelimit import CircuitOpenError
+
+POSTS = [
+    "OpenAI выпустила новую модель для генерации кода https://openai.com/blog/code",
+    "OpenAI выпустила новую модель для генерации кода https://openai.com/blog/code?utm_source=tg",
+    "Вышел LangGraph 0.3 с поддержкой долгоживущих агентов https://github.com/langchain-ai/langgraph",
+    "Исследователи показали новый метод RAG с графами знаний https://arxiv.org/abs/2401.00001",
+    "Meta открыла веса Llama для исследователей https://ai.meta.com/llama",
+    "Курс по классическому ML от Яндекса стартует в марте https://practicum.yandex.ru/ml",
+]
+# POSTS[1] repeats POSTS[0] and is clustered onto it within the page, without LLM calls.
+LLM_POSTS = len(POSTS) - 1
+CANONICALS = len(POSTS) - 1
+# One extraction per post that reaches the LLM, then labels and a summary once per canonical.
+PROCESS_REQUESTS = LLM_POSTS + 2 * CANONICALS
+
+
+def _seed(conn, posts=POSTS):
+    db.upsert_sources(conn, [{"id_or_username": "@src", "type": "channel", "weight": 1.0, "enabled": True}])
+    for i, text in enumerate(posts, start=1):
+        db.insert_raw_message(
+            conn,
+            {"source_id": 1, "tg_message_id": i, "posted_at": datetime.utcnow().isoformat(), "text": text, "views": 10 * i},
+        )
+    conn.commit()
+
+
+def _snapshot(conn):
+    linked = conn.execute("SELECT COUNT(*) FROM raw_messages WHERE canonical_news_id IS NOT NULL").fetchone()[0]
+    canonicals = conn.execute("SELECT COUNT(*) FROM canonical_news").fetchone()[0]
+    return linked, canonicals
+
+
+def test_process_new_messages_with_stub(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer() as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url)
+        assert process_new_messages(conn, settings) == len(POSTS)
+    assert stub.requests == PROCESS_REQUESTS
+    assert _snapshot(conn) == (len(POSTS), CANONICALS)
+
+
+def test_async_processing_runs_requests_concurrently(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer(latency=0.05) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url)
+        assert asyncio.run(process_new_messages_async(conn, settings, concurrency=4)) == len(POSTS)
+    assert stub.requests == PROCESS_REQUESTS
+    assert 1 < stub.peak_in_flight <= 4
+    assert _snapshot(conn) == (len(POSTS), CANONICALS)
+
+
+def test_batched_processing_falls_back_for_dropped_items(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer(drop_batch_items=1) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_BATCH_SIZE=3)
+        assert process_new_messages(conn, settings) == len(POSTS)
+    # 2 row pages x (extraction batch + 1 fallback) + 2 canonical pages x (label batch + 1 fallback) + summaries
+    assert stub.requests == 2 * 2 + 2 * 2 + CANONICALS
+    assert _snapshot(conn) == (len(POSTS), CANONICALS)
+
+
+def test_backlog_keyset_pages_match_full_order(conn):
+    _seed(conn)
+    # Ties on posted_at are ordered by id, and the cursor must not skip or repeat them.
+    conn.execute("UPDATE raw_messages SET posted_at=(SELECT MAX(posted_at) FROM raw_messages) WHERE id IN (2, 3, 4)")
+    expected = [r["id"] for r in fetch_backlog(conn)]
+    paged = [[r["id"] for r in page] for page in iter_backlog(conn, 2)]
+    assert [len(p) for p in paged] == [2, 2, 2]
+    assert sum(paged, []) == expected
+
+
+def test_max_items_stops_early_and_next_run_continues(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer() as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, PROCESS_PAGE_SIZE=2)
+        assert process_new_messages(conn, settings, max_items=3) == 3
+        assert _snapshot(conn)[0] == 3
+        assert asyncio.run(process_new_messages_async(conn, settings, concurrency=2, max_items=0)) == len(POSTS) - 3
+    assert _snapshot(conn) == (len(POSTS), CANONICALS)
+
+
+def test_failed_stage_is_checkpointed_backed_off_and_resumed(conn, make_settings):
+    _seed(conn)
+    broken = ("extraction engine", "Meta открыла веса")
+    with StubLLMServer(fail_on=broken) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False, PROCESS_COMMIT_EVERY=2)
+        assert process_new_messages(conn, settings) == len(POSTS) - 1
+        # The failed row is backed off, so an immediate rerun leaves it alone.
+        requests = stub.requests
+        assert process_new_messages(conn, settings) == 0
+        assert stub.requests == requests
+
+    row = conn.execute("SELECT * FROM raw_messages WHERE text LIKE 'Meta%'").fetchone()
+    assert row["canonical_news_id"] is None and row["process_stage"] is None
+    assert row["process_attempts"] == 1 and row["next_attempt_at"] and row["last_error"]
+
+    conn.execute("UPDATE raw_messages SET next_attempt_at=? WHERE id=?", ("2000-01-01", row["id"]))
+    conn.commit()
+    with StubLLMServer() as stub:
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False)) == 1
+    # The extraction, then labels and a summary for its new canonical; nothing else is redone.
+    assert stub.requests == 3
+    assert conn.execute("SELECT process_stage FROM raw_messages WHERE id=?", (row["id"],)).fetchone()[0] == "linked"
+
+
+def test_canonical_summary_is_regenerated_once_per_run(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer(fail_on=("editor", "Meta открыла веса")) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False)
+        assert process_new_messages(conn, settings) == len(POSTS)
+    meta = conn.execute("SELECT * FROM canonical_news WHERE main_event_ru LIKE 'Meta%'").fetchone()
+    # The row is linked; only its canonical's summary is left for the next run, with a provisional title.
+    assert meta["summary_dirty"] == 1 and meta["title_ru"] == meta["main_event_ru"]
+    assert conn.execute("SELECT COUNT(*) FROM canonical_news WHERE summary_dirty=1").fetchone()[0] == 1
+
+    # A short repost adds neither a URL nor text, so it does not make its canonical stale again.
+    repost = "LangGraph 0.3 https://github.com/langchain-ai/langgraph"
+    db.insert_raw_message(conn, {"source_id": 1, "tg_message_id": 100, "posted_at": datetime.utcnow().isoformat(), "text": repost})
+    conn.commit()
+    with StubLLMServer() as stub:
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False)) == 1
+    # The repost is linked by URL; only the Meta canonical gets its labels and summary.
+    assert stub.requests == 2
+    assert conn.execute("SELECT COUNT(*) FROM canonical_news WHERE summary_dirty=1").fetchone()[0] == 0
+    assert conn.execute("SELECT title_ru FROM canonical_news WHERE id=?", (meta["id"],)).fetchone()[0] != meta["title_ru"]
+
+
+class CircuitAfter:
+    # Async LLM double: answers like the stub until `calls` requests were made, then the circuit opens.
+    def __init__(self, calls: int):
+        self.calls = calls
+
+    async def complete_json(self, system_prompt, user_prompt, template=None):
+        if self.calls <= 0:
+            raise CircuitOpenError(60)
+        self.calls -= 1
+        await asyncio.sleep(0)
+        return respond(system_prompt, user_prompt)
+
+
+def test_summaries_are_paged_and_respect_the_run_budget(conn, make_settings, monkeypatch):
+    _seed(conn, POSTS[2:])
+    with StubLLMServer() as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False, CLUSTER_ENABLED=False)
+        process_new_messages(conn, settings)
+    dirty = conn.execute("UPDATE canonical_news SET summary_dirty=1").rowcount
+    monkeypatch.setattr(pipeline, "SUMMARY_PAGE_SIZE", 1)
+    prompts = pipeline.load_pipeline_prompts()
+
+    assert summarize_dirty(conn, None, prompts, settings, Budget(seconds=1e-9)) == 0
+
+    # Two summaries land, then the circuit opens: the finished ones stay written.
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(summarize_dirty_async(conn, CircuitAfter(4), prompts, settings))
+    assert conn.execute("SELECT COUNT(*) FROM canonical_news WHERE summary_dirty=1").fetchone()[0] == dirty - 2
+    assert asyncio.run(summarize_dirty_async(conn, CircuitAfter(100), prompts, settings)) == dirty - 2
+
+
+def test_repeated_failures_quarantine_the_row(conn, make_settings):
+    _seed(conn, POSTS[:2])
+    with StubLLMServer(fail_on=("extraction", "генерации кода https://openai.com/blog/code?utm")) as stub:
+        # The prefilter or the in-batch clustering would link the retried repost without calling the LLM at all.
+        settings = make_settings(
+            OPENAI_BASE_URL=stub.base_url,
+            LLM_CACHE_ENABLED=False,
+            PROCESS_MAX_ATTEMPTS=2,
+            LLM_BATCH_SIZE=2,
+            PREFILTER_ENABLED=False,
+            CLUSTER_ENABLED=False,
+        )
+        assert process_new_messages(conn, settings) == 1
+        conn.execute("UPDATE raw_messages SET next_attempt_at='2000-01-01' WHERE canonical_news_id IS NULL")
+        assert asyncio.run(process_new_messages_async(conn, settings, concurrency=2)) == 0
+    stages = [r[0] for r in conn.execute("SELECT process_stage FROM raw_messages ORDER BY id")]
+    assert stages == ["linked", "quarantined"]
+
+
+def test_digest_fills_quota_greedily_within_window(conn, make_settings):
+    now = datetime.utcnow()
+    stale = (now - timedelta(hours=48)).isoformat()
+    # The top of the ranking is all NLP: a query cut at LIMIT max_items_per_digest before the
+    # per-category cap leaves a one-item digest; the per-category ranking in SQL fills it.
+    rows = [("NLP", 100 - i, now.isoformat()) for i in range(5)] + [("AGENTS", 50, now.isoformat()), ("RAG", 40, now.isoformat())]
+    rows.append(("GRAPHS", 999, stale))
+    for label, score, seen in rows:
+        cid = db.create_canonical(
+            conn,
+            {"title_ru": f"{label} {score}", "labels": [{"label": label, "confidence": 0.9}], "importance_score": score, "last_seen_at": seen},
+        )
+        db.insert_canonical_links(conn, [(cid, f"https://example.com/{cid}/{n}", "example.com") for n in range(5)])
+    conn.commit()
+    settings = make_settings(MAX_ITEMS_PER_DIGEST=3, MAX_ITEMS_PER_CATEGORY=1)
+
+    assert refresh_digest_candidates(conn, settings, now) == 7
+    items = select_digest_items(conn, settings, now)
+    assert [(i["category"], i["importance_score"]) for i in items] == [("NLP", 100), ("AGENTS", 50), ("RAG", 40)]
+    assert all(len(i["links"]) == 3 for i in items)
+
+    preview, publish = build_digest_texts(conn, "morning", settings)
+    assert "score 100.0" in preview and "score" not in publish
+    assert "GRAPHS" not in publish
+
+
+def test_digest_refresh_holds_the_write_lock_while_rendering(conn, make_settings, monkeypatch, tmp_path):
+    db.create_canonical(conn, {"title_ru": "Заголовок", "importance_score": 1})
+    conn.commit()
+    other = sqlite3.connect(tmp_path / "test.db", timeout=0)
+    blocked = []
+    render = pipeline.render_digest_item
+
+    def render_while_another_writer_tries(item, variant="publish"):
+        try:
+            other.execute("UPDATE canonical_news SET importance_score=2")
+        except sqlite3.OperationalError as e:
+            blocked.append(str(e))
+        return render(item, variant)
+
+    monkeypatch.setattr(pipeline, "render_digest_item", render_while_another_writer_tries)
+    assert refresh_digest_candidates(conn, make_settings()) == 1
+    assert blocked and all("locked" in e for e in blocked)
+    other.close()
+
+
+def test_digest_candidates_are_rendered_only_when_an_item_changes(conn, make_settings):
+    settings = make_settings()
+    cid = db.create_canonical(conn, {"title_ru": "Старый заголовок", "labels": [{"label": "RAG", "confidence": 0.9}], "importance_score": 5})
+    conn.commit()
+    assert refresh_digest_candidates(conn, settings) == 1
+    assert refresh_digest_candidates(conn, settings) == 0
+
+    conn.execute("UPDATE canonical_news SET title_ru='Новый заголовок' WHERE id=?", (cid,))
+    db.insert_canonical_links(conn, [(cid, "https://example.com/rag", "example.com")])
+    assert refresh_digest_candidates(conn, settings) == 1
+    publish = build_digest_texts(conn, "evening", settings)[1]
+    assert "Новый заголовок" in publish and "https://example.com/rag" in publish
+
+    conn.execute("UPDATE canonical_news SET last_seen_at='2000-01-01' WHERE id=?", (cid,))
+    assert refresh_digest_candidates(conn, settings) == 0
+    assert conn.execute("SELECT COUNT(*) FROM digest_candidates").fetchone()[0] == 0
+
+
+def test_digest_uses_labels_json_until_the_canonical_is_converted(conn, make_settings):
+    labels = '[{"label": "RAG", "confidence": 0.3}, {"label": "AGENTS", "confidence": 0.8}]'
+    conn.execute(
+        "INSERT INTO canonical_news(title_ru, labels_json, importance_score, last_seen_at) VALUES('Старый', ?, 1, ?)",
+        (labels, datetime.utcnow().isoformat()),
+    )
+    conn.commit()
+    settings = make_settings()
+    refresh_digest_candidates(conn, settings)
+    assert [(i["category"], i["tags"]) for i in select_digest_items(conn, settings)] == [("AGENTS", ["RAG"])]
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime, timedelta
+
+from llm_stub import StubLLMServer
+
+from ai_tg_digest import db
+from ai_tg_digest.pipeline import fetch_backlog, process_new_messages, requeue_skipped
+from ai_tg_digest.prefilter import decide, message_urls
+
+
+def _row(conn, text, source_type="channel", known_urls=()):
+    db.upsert_sources(conn, [{"id_or_username": f"@{source_type}", "type": source_type, "weight": 1.0, "enabled": True}])
+    source_id = conn.execute("SELECT id FROM sources WHERE id_or_username=?", (f"@{source_type}",)).fetchone()[0]
+    n = conn.execute("SELECT COUNT(*) FROM raw_messages").fetchone()[0] + 1
+    db.insert_raw_message(
+        conn,
+        {"source_id": source_id, "tg_message_id": n, "posted_at": datetime.utcnow().isoformat(), "text": text, "known_urls": list(known_urls)},
+    )
+    conn.commit()
+    return next(r for r in fetch_backlog(conn) if r["tg_message_id"] == n)
+
+
+def test_relevance_rules_depend_on_source_type(conn, make_settings):
+    settings = make_settings()
+    chat = "Спасибо, завтра посмотрю"
+    assert decide(conn, _row(conn, chat, "group"), settings)[:2] == ("skipped_offtopic", None)
+    assert decide(conn, _row(conn, chat, "channel"), settings)[:2] == ("skipped_offtopic", None)
+    question = "Кто-нибудь пробовал дообучать Llama на своих данных? Какой датасет брали и сколько заняло обучение?"
+    assert decide(conn, _row(conn, question, "group"), settings) is None
+    assert decide(conn, _row(conn, "Интересно https://example.com/x", "channel"), settings) is None
+    assert decide(conn, _row(conn, "Курс по нейросетям со скидкой, промокод AI2024 https://x.com/a"), settings)[0] == "skipped_ad"
+
+
+def test_known_url_duplicate_is_linked_without_llm(conn, make_settings):
+    cid = db.create_canonical(conn, {"title_ru": "Релиз", "importance_score": 0, "last_seen_at": "2000-01-01"})
+    db.insert_canonical_links(conn, [(cid, "https://github.com/langchain-ai/langgraph", "github.com")])
+    repost = _row(conn, "Смотрите, что вышло 🔥", known_urls=["https://github.com/langchain-ai/langgraph/?utm_source=tg"])
+    chat = _row(conn, "ок", "group")
+    assert message_urls(conn, repost) == ["https://github.com/langchain-ai/langgraph"]
+
+    with StubLLMServer() as stub:
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url)) == 2
+    assert stub.requests == 0
+    linked = conn.execute("SELECT * FROM raw_messages WHERE id=?", (repost["id"],)).fetchone()
+    assert (linked["canonical_news_id"], linked["dedup_status"], linked["process_stage"]) == (cid, "url_duplicate", "linked")
+    canonical = conn.execute("SELECT raw_count, last_seen_at FROM canonical_news WHERE id=?", (cid,)).fetchone()
+    assert canonical["raw_count"] == 2 and canonical["last_seen_at"] > "2000-01-01"
+    skipped = conn.execute("SELECT dedup_status, process_stage FROM raw_messages WHERE id=?", (chat["id"],)).fetchone()
+    assert tuple(skipped) == ("skipped_offtopic", "skipped")
+    assert fetch_backlog(conn) == []
+    assert json.loads(linked["known_urls_json"])
+
+
+def test_skipped_rows_can_be_requeued_after_thresholds_change(conn, make_settings):
+    row = _row(conn, "Новый вектор развития компании", "group")
+    with StubLLMServer() as stub:
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url)) == 1
+        assert fetch_backlog(conn) == []
+        assert requeue_skipped(conn, datetime.utcnow() - timedelta(days=1)) == 1
+        assert process_new_messages(conn, make_settings(OPENAI_BASE_URL=stub.base_url, PREFILTER_MIN_SCORE_GROUP=0)) == 1
+    linked = conn.execute("SELECT process_stage, dedup_status FROM raw_messages WHERE id=?", (row["id"],)).fetchone()
+    assert tuple(linked) == ("linked", "linked")
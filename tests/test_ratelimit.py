@@ -0,0 +1,80 @@
+import time
+
+import pytest
+from llm_stub import StubLLMServer
+from test_pipeline import POSTS, _seed
+
+from ai_tg_digest.llm import OpenAICompatClient
+from ai_tg_digest.pipeline import process_new_messages
+from ai_tg_digest.ratelimit import CircuitBreaker, CircuitOpenError, RateLimiter
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_limiter_spaces_requests_and_corrects_token_estimates():
+    clock = Clock()
+    limiter = RateLimiter(rpm=60, tpm=600, clock=clock)
+    assert limiter.reserve(100) == 0
+    # Usage says the call cost 550 tokens, not 100, so the next 100 have to wait for the refill.
+    limiter.record_usage(100, 550)
+    assert limiter.reserve(100) == pytest.approx(5.0)
+    clock.now += 60
+    assert limiter.reserve(100) == 0
+
+
+def test_backoff_pauses_everyone_and_halves_the_rate():
+    clock = Clock()
+    limiter = RateLimiter(rpm=60, clock=clock)
+    assert limiter.backoff(0, retry_after=7) == 7
+    assert limiter.reserve(1) == pytest.approx(7)
+    assert limiter.factor == 0.5 and limiter.requests.rate == pytest.approx(0.5)
+    for _ in range(20):
+        limiter.record_usage(1, 1)
+    assert limiter.factor == 1.0
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_after_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30, clock=clock)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(3):
+        breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+    clock.now += 31
+    breaker.check()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_client_honors_retry_after_on_429():
+    with StubLLMServer(throttle=2, retry_after="0.2") as stub:
+        client = OpenAICompatClient(stub.base_url, "key", "stub-model")
+        started = time.perf_counter()
+        result = client.complete_json("You are an extraction tool", 'post_text: """hello"""')
+        client.close()
+    assert result["main_event_ru"] == "hello"
+    assert stub.requests == 3
+    assert time.perf_counter() - started >= 0.4
+
+
+def test_open_circuit_pauses_processing_without_failing_rows(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer(fail_on=("", "")) as stub:
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, LLM_CACHE_ENABLED=False, LLM_CIRCUIT_FAILURES=4)
+        assert process_new_messages(conn, settings) == 0
+    # Two rows' worth of retries opened the circuit; the rest were never sent.
+    assert stub.requests == 4
+    rows = conn.execute("SELECT process_attempts, process_stage FROM raw_messages").fetchall()
+    assert len(rows) == len(POSTS)
+    assert sum(r["process_attempts"] for r in rows) == 1
+    assert all(r["process_stage"] != "quarantined" for r in rows)
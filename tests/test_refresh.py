@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from ai_tg_digest import db
+from ai_tg_digest.refresh import plan_requests, refresh_engagement
+
+
+class FakeClient:
+    def __init__(self, views_by_id):
+        self.views = views_by_id
+        self.requests = []
+
+    async def get_messages(self, entity, ids):
+        self.requests.append((entity, list(ids)))
+        return [SimpleNamespace(id=i, views=self.views[i], forwards=0) if i in self.views else None for i in ids]
+
+
+def test_refresh_updates_only_changed_rows_and_rescores(conn, make_settings):
+    settings = make_settings()
+    db.upsert_sources(conn, [{"id_or_username": "@src", "type": "channel", "weight": 1.0, "enabled": True}])
+    canonical_id = db.create_canonical(conn, {"main_event_ru": "x", "importance_score": 1.0})
+    posted = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+    for i, views in ((1, 10), (2, 20), (3, 30)):
+        db.insert_raw_message(
+            conn,
+            {"source_id": 1, "tg_message_id": i, "posted_at": posted, "views": views, "forwards": 0, "reactions_count": 0, "canonical_news_id": canonical_id},
+        )
+    conn.commit()
+
+    client = FakeClient({1: 10, 2: 5000})
+    stats = asyncio.run(refresh_engagement(conn, settings, client=client))
+
+    assert stats == {"requests": 1, "polled": 3, "changed": 1, "rescored": 1}
+    assert conn.execute("SELECT views FROM raw_messages WHERE tg_message_id=2").fetchone()[0] == 5000
+    assert conn.execute("SELECT importance_score FROM canonical_news").fetchone()[0] > 1.0
+    assert conn.execute("SELECT COUNT(*) FROM raw_messages WHERE metrics_refreshed_at IS NULL").fetchone()[0] == 0
+
+
+def test_plan_requests_chunks_per_source_within_budget():
+    rows = [{"id_or_username": "@a", "tg_message_id": i} for i in range(250)] + [{"id_or_username": "@b", "tg_message_id": 1}]
+    plan = plan_requests(rows, max_requests=3)
+    assert [(entity, len(chunk)) for entity, chunk in plan] == [("@a", 100), ("@a", 100), ("@a", 50)]
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from ai_tg_digest import db, dedup
+from ai_tg_digest.retention import compact, open_archives, run_retention
+
+
+def _canonical(conn, title, last_seen):
+    cid = db.create_canonical(conn, {"title_ru": title, "main_event_ru": title, "last_seen_at": last_seen.isoformat()})
+    dedup.index_canonical(conn, cid, title)
+    db.insert_canonical_links(conn, [(cid, f"https://example.com/{cid}", "example.com")])
+    return cid
+
+
+def _message(conn, n, posted_at, canonical_id, text):
+    db.insert_raw_message(conn, {"source_id": 1, "tg_message_id": n, "posted_at": posted_at.isoformat(), "text": text})
+    conn.execute("UPDATE raw_messages SET canonical_news_id=? WHERE tg_message_id=?", (canonical_id, n))
+
+
+def test_old_rows_move_to_monthly_archives(conn, make_settings, tmp_path):
+    now = datetime(2024, 6, 15, 12, 0)
+    old, recent = now - timedelta(days=100), now - timedelta(hours=2)
+    db.upsert_sources(conn, [{"id_or_username": "@src", "type": "channel", "weight": 1.0, "enabled": True}])
+    gone = _canonical(conn, "Старая новость про модели", old)
+    kept = _canonical(conn, "Свежая новость про агентов", recent)
+    _message(conn, 1, old, gone, "старый пост " * 50)
+    _message(conn, 2, old, kept, "старый репост свежей новости")
+    _message(conn, 3, recent, kept, "свежий пост")
+    db.insert_canonical_links(conn, [(9999, "https://orphan.example.com", "orphan.example.com")])
+    conn.commit()
+
+    settings = make_settings(RETENTION_DAYS=30, ARCHIVE_DIR=tmp_path / "archive")
+    result = run_retention(conn, settings, now=now)
+    assert (result["raw_messages"], result["canonical_news"], result["orphans"]) == (2, 1, 1)
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert [r[0] for r in conn.execute("SELECT tg_message_id FROM raw_messages")] == [3]
+    assert [r[0] for r in conn.execute("SELECT id FROM canonical_news")] == [kept]
+    assert conn.execute("SELECT COUNT(*) FROM canonical_lsh WHERE canonical_news_id=?", (gone,)).fetchone()[0] == 0
+    assert {r[0] for r in conn.execute("SELECT canonical_news_id FROM canonical_links")} == {kept}
+    assert (tmp_path / "archive" / "2024-03.db").exists()
+
+    # Nothing left to move on a second pass.
+    assert run_retention(conn, settings, now=now)["raw_messages"] == 0
+
+    ro = open_archives(settings)
+    texts = [r[0] for r in ro.execute("SELECT unzip(text) FROM archive_2024_03.raw_messages ORDER BY tg_message_id")]
+    assert texts == ["старый пост " * 50, "старый репост свежей новости"]
+    assert ro.execute("SELECT title_ru FROM archive_2024_03.canonical_news").fetchone()[0] == "Старая новость про модели"
+    assert ro.execute("SELECT normalized_url FROM archive_2024_03.canonical_links").fetchone()[0] == f"https://example.com/{gone}"
+    ro.close()
+
+
+def test_compact_switches_to_incremental_vacuum(tmp_path):
+    path = tmp_path / "legacy.db"
+    legacy = db.sqlite3.connect(path)
+    legacy.execute("CREATE TABLE t(x)")
+    legacy.executemany("INSERT INTO t VALUES(?)", [("x" * 500,) for _ in range(2000)])
+    legacy.commit()
+    legacy.close()
+
+    conn = db.connect(path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    before, after = compact(conn)
+    assert after < before
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,34 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+from ai_tg_digest.moderation import process_auto_publish
+from ai_tg_digest.scheduler import next_run_at, queue_period
+
+
+class FakeClient:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, entity, text, buttons=None):
+        self.sent.append((entity, text))
+        return SimpleNamespace(id=len(self.sent))
+
+
+def test_next_run_at_rolls_over_to_tomorrow():
+    now = datetime(2024, 5, 1, 10, 30)
+    assert next_run_at(now, "19:00") == datetime(2024, 5, 1, 19, 0)
+    assert next_run_at(now, "09:00") == datetime(2024, 5, 2, 9, 0)
+    assert next_run_at(datetime(2024, 5, 1, 9, 0), "09:00") == datetime(2024, 5, 2, 9, 0)
+
+
+def test_queue_and_publish_reuse_the_shared_client(conn, make_settings):
+    settings = make_settings(AUTO_PUBLISH_AFTER_MINUTES=0)
+    client = FakeClient()
+
+    digest_id = asyncio.run(queue_period(conn, settings, client, "morning"))
+    assert client.sent[0][0] == "self" and f"#{digest_id}" in client.sent[0][1]
+
+    assert asyncio.run(process_auto_publish(conn, settings, client)) == 1
+    assert client.sent[1] == ("@target", "Утренний AI-дайджест")
+    assert conn.execute("SELECT status FROM digests WHERE id=?", (digest_id,)).fetchone()[0] == "published"
@@ -0,0 +1,76 @@
+from llm_stub import StubLLMServer
+from test_pipeline import POSTS, _seed
+
+from ai_tg_digest import stats
+from ai_tg_digest.pipeline import process_new_messages
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    h = stats.Histogram()
+    for _ in range(90):
+        h.observe(0.002)
+    for _ in range(10):
+        h.observe(3.0)
+    assert 0.001 < h.quantile(0.5) <= 0.0025
+    assert 2.5 < h.quantile(0.95) <= 5.0
+    assert h.count == 100
+
+
+def test_process_run_is_persisted_and_exported(conn, make_settings):
+    _seed(conn)
+    with StubLLMServer() as stub:
+        # Keeps the repost on the LLM path so the by_url dedup counter is exercised.
+        settings = make_settings(OPENAI_BASE_URL=stub.base_url, CLUSTER_ENABLED=False)
+        with stats.run(conn, "process"):
+            process_new_messages(conn, settings)
+
+    counters, histograms = stats.load_recent(conn, runs=5)
+    # Every post is extracted; labels and summary are made once per canonical.
+    requests = len(POSTS) + 2 * (len(POSTS) - 1)
+    assert counters["llm.calls"] == requests
+    assert counters["llm.cache_misses"] == requests
+    assert counters["llm.prompt_tokens"] > 0
+    assert counters["dedup.by_url"] == 1 and counters["dedup.new"] == len(POSTS) - 1
+    assert histograms["llm.request"].count == requests
+    assert counters["summary.canonicals"] == len(POSTS) - 1
+    assert histograms["process"].count == 1
+
+    text = stats.render_prometheus(counters, histograms)
+    assert f'aidigest_llm_request_seconds_bucket{{le="+Inf"}} {requests}' in text
+    assert "aidigest_dedup_by_url_total 1" in text
+    assert "p95 ms" in stats.render_table(counters, histograms)
+
+
+def test_failed_run_leaves_pending_writes_alone(conn):
+    # Another handler's uncommitted write on the shared connection survives a failing job.
+    conn.execute("INSERT INTO sources(id_or_username, type) VALUES('@pending', 'channel')")
+    try:
+        with stats.run(conn, "cycle"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert conn.in_transaction
+    conn.commit()
+    assert conn.execute("SELECT COUNT(*) FROM sources WHERE id_or_username='@pending'").fetchone()[0] == 1
+    with stats.run(conn, "cycle"):
+        stats.incr("ok")
+    counters, _ = stats.load_recent(conn, runs=0)
+    assert counters["cycle.failed"] == 1 and counters["ok"] == 1
+    assert stats.load_recent(conn, runs=1)[0] == {"ok": 1}
+
+
+def test_prometheus_totals_survive_pruning_and_keep_full_precision(conn):
+    with stats.run(conn, "ingest"):
+        stats.incr("llm.prompt_tokens", 12345678)
+        stats.observe("llm.request", 0.1234567)
+    with stats.run(conn, "ingest"):
+        stats.incr("llm.prompt_tokens", 2)
+    assert stats.prune_runs(conn, "9999") == 2
+    conn.commit()
+
+    counters, histograms = stats.load_totals(conn, "ingest")
+    assert stats.load_recent(conn, runs=0) == ({}, {})
+    assert counters["llm.prompt_tokens"] == 12345680 and histograms["ingest"].count == 2
+    text = stats.render_prometheus(counters, histograms)
+    assert "aidigest_llm_prompt_tokens_total 12345680\n" in text
+    assert "aidigest_llm_request_seconds_sum 0.1234567\n" in text
@@ -1,4 +1,14 @@
-from ai_tg_digest.utils import normalize_url, robust_json_loads, text_similarity
+import random
+
+from ai_tg_digest.utils import (
+    bounded_similarity,
+    normalize_text,
+    normalize_url,
+    normalize_url_uncached,
+    normalize_urls,
+    robust_json_loads,
+    text_similarity,
+)
 
 
 def test_normalize_url_removes_tracking():
@@ -6,6 +16,47 @@ def test_normalize_url_removes_tracking():
     assert normalize_url(url) == "https://example.com/x?id=42"
 
 
+def test_normalize_url_domain_rules():
+    cases = {
+        "https://arxiv.org/pdf/2401.00001v2.pdf": "https://arxiv.org/abs/2401.00001",
+        "http://export.arxiv.org/abs/2401.00001v1?context=cs": "https://arxiv.org/abs/2401.00001",
+        "https://www.arxiv.org/html/2401.00001v3": "https://arxiv.org/abs/2401.00001",
+        "https://github.com/LangChain-AI/langgraph.git": "https://github.com/langchain-ai/langgraph",
+        "https://github.com/langchain-ai/langgraph/tree/main/": "https://github.com/langchain-ai/langgraph",
+        "https://github.com/langchain-ai/langgraph/releases/tag/0.3": "https://github.com/langchain-ai/langgraph/releases/tag/0.3",
+        "https://youtu.be/dQw4w9WgXcQ?si=abc&t=42": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=share": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://www.youtube.com/shorts/dQw4w9WgXcQ": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://t.me/s/ai_news/123?single": "https://t.me/ai_news/123",
+        "https://telegram.me/ai_news/123/": "https://t.me/ai_news/123",
+        "https://t.me/iv?url=https%3A%2F%2Fhabr.com%2Fru%2Farticles%2F1%2F%3Futm_source%3Dtg&rhash=x": "https://habr.com/ru/articles/1",
+        "http://WWW.Example.com:80/x?b=2&a=1": "https://example.com/x?a=1&b=2",
+        "https://open.spotify.com/episode/4rOoJ6Egrf8K2IrywzwOMk?si=abc": "https://open.spotify.com/episode/4rOoJ6Egrf8K2IrywzwOMk",
+        "https://www.youtube.com/playlist?list=PL1&si=abc": "https://youtube.com/playlist?list=PL1",
+        "https://example.com/search?si=1&q=x": "https://example.com/search?q=x&si=1",
+    }
+    for url, expected in cases.items():
+        assert normalize_url_uncached(url) == expected, url
+
+
+def test_memoized_and_batch_normalize_url_match_scalar():
+    rng = random.Random(11)
+    hosts = ["arxiv.org", "www.arxiv.org", "github.com", "youtu.be", "www.youtube.com", "t.me", "telegram.me", "Example.COM", "habr.com"]
+    paths = ["", "/", "/abs/2401.0000{}v{}", "/pdf/2401.0000{}", "/org{}/repo{}", "/org{}/repo{}/tree/main", "/watch", "/s/chan{}/{}", "/a/b{}/"]
+    queries = ["", "?utm_source=tg", "?v=vid{}&t={}", "?b={}&a={}", "?single", "?fbclid=x&id={}", "#frag{}"]
+    urls = [
+        f"{rng.choice(['http', 'https'])}://{rng.choice(hosts)}"
+        + rng.choice(paths).format(rng.randint(1, 9), rng.randint(1, 3))
+        + rng.choice(queries).format(rng.randint(1, 9), rng.randint(1, 9))
+        for _ in range(2000)
+    ]
+    expected = [normalize_url_uncached(u) for u in urls]
+    assert [normalize_url(u) for u in urls] == expected
+    assert [normalize_url(u) for u in urls] == expected
+    assert normalize_urls(urls) == expected
+    assert [normalize_url_uncached(u) for u in expected] == expected
+
+
 def test_similarity_threshold_behavior():
     a = "OpenAI выпустила новую модель для кода"
     b = "OpenAI представила новую модель для программирования"
@@ -16,3 +67,21 @@ def test_similarity_threshold_behavior():
 def test_robust_json_loads_with_wrapper_text():
     raw = "Result:\n```json\n{\"x\": 1}\n```"
     assert robust_json_loads(raw)["x"] == 1
+
+
+def test_robust_json_loads_with_wrapped_array():
+    raw = "Here you go:\n[{\"id\": \"1\"}, {\"id\": \"2\"}]\nDone."
+    assert [x["id"] for x in robust_json_loads(raw)] == ["1", "2"]
+
+
+def test_bounded_similarity_keeps_threshold_decisions():
+    rng = random.Random(3)
+    words = "модель релиз openai код данные агент граф обучение ранжирование поиск".split()
+    texts = [" ".join(rng.choice(words) for _ in range(rng.randint(2, 15))) for _ in range(60)]
+    for a in texts:
+        for b in texts[:20]:
+            exact = text_similarity(a, b)
+            bounded = bounded_similarity(normalize_text(a), normalize_text(b), 0.85)
+            assert (bounded >= 0.85) == (exact >= 0.85)
+            if exact >= 0.85:
+                assert bounded == exact